@@ -1,35 +1,187 @@
-from chalice import Chalice, BadRequestError, ChaliceViewError, CognitoUserPoolAuthorizer, UnauthorizedError
+from chalice import Chalice, BadRequestError, ChaliceViewError, CognitoUserPoolAuthorizer, UnauthorizedError, Response, \
+    CORSConfig, NotFoundError
+import json
+import math
 import os
-import cognitojwt
-import aurora_data_api
+import re
+import uuid
+from collections import Counter
+from datetime import datetime
+from chalicelib import admission, db, exports, geo, timing
+from chalicelib.catalogs import CatalogCache
+from chalicelib.pagination import decode_cursor, default_page_size, encode_cursor, parse_limit
+from chalicelib.queues import SQSQueue, get_queue
+from chalicelib.rbac import PermissionIndex
+from chalicelib.tokens import JWTVerifier, load_snapshot
 
 region = os.environ['REGION']
 user_pool_id = os.environ['COGNITO_USER_POOL_ID']
-db_name = os.environ['DB_NAME']
 db_citizen_role_id = os.environ['DB_CITIZEN_ROL']
-db_cluster_arn = os.environ['DB_CLUSTER_ARN']
-db_credentials_secret_arn = os.environ['DB_CREDENTIALS_SECRET_ARN']
+permissions = PermissionIndex(check_interval=int(os.environ.get('RBAC_CHECK_INTERVAL', '30')),
+                              cache_size=int(os.environ.get('ACCESS_CACHE_SIZE', '1024')),
+                              cache_ttl=int(os.environ.get('ACCESS_CACHE_TTL', '60')),
+                              token_max_age_hours=int(os.environ.get('TOKEN_MAX_AGE_HOURS', '24')))
+incident_fields = ('hechos', 'ubicacion', 'fecha', 'id_tipo_incidente', 'id_municipio')
+incident_batch_max = int(os.environ.get('INCIDENT_BATCH_MAX', '500'))
+insert_incident_sql = """
+    INSERT INTO INCIDENTE (hechos, ubicacion, fecha, id_tipo_incidente, id_municipio, id_usuario,
+                           latitud, longitud, geohash)
+    VALUES (:hechos, :ubicacion, :fecha, :id_tipo_incidente, :id_municipio, :id_usuario,
+            :latitud, :longitud, :geohash)
+    """
+# Solo el id_seguimiento repetido (mensaje entregado más de una vez) se descarta, los demás errores se reportan
+insert_queued_incident_sql = """
+    INSERT INTO INCIDENTE (hechos, ubicacion, fecha, id_tipo_incidente, id_municipio, id_usuario,
+                           latitud, longitud, geohash, id_seguimiento)
+    VALUES (:hechos, :ubicacion, :fecha, :id_tipo_incidente, :id_municipio, :id_usuario,
+            :latitud, :longitud, :geohash, :id_seguimiento)
+    ON DUPLICATE KEY UPDATE id_seguimiento = id_seguimiento
+    """
+insert_rejected_incident_sql = """
+    INSERT IGNORE INTO INCIDENTE_RECHAZADO (id_seguimiento, motivo) VALUES (:id_seguimiento, :motivo)
+    """
+# Los contadores diarios se suman dentro de la misma transacción que inserta los incidentes
+upsert_incident_stats_sql = """
+    INSERT INTO ESTADISTICA_INCIDENTE (id_municipio, id_tipo_incidente, dia, total)
+    VALUES (:id_municipio, :id_tipo_incidente, :dia, :total)
+    ON DUPLICATE KEY UPDATE total = total + VALUES(total)
+    """
+stats_periods = {
+    'dia': "DATE_FORMAT(e.dia, '%Y-%m-%d')",
+    'mes': "DATE_FORMAT(e.dia, '%Y-%m')",
+    'total': None
+}
+nearby_max_radius = float(os.environ.get('NEARBY_MAX_RADIUS', '50000'))
+# Las filas más recientes que este margen no se entregan: una transacción aún abierta puede confirmar después
+# filas con un momento de escritura anterior al de la última fila leída
+change_feed_lag = int(os.environ.get('CHANGE_FEED_LAG', '5'))
+search_max_length = int(os.environ.get('SEARCH_MAX_LENGTH', '200'))
+search_relevance = "MATCH(i.hechos) AGAINST (:q IN NATURAL LANGUAGE MODE)"
+# Campos que acepta fields= en los listados de incidentes y la columna que cada uno agrega al SELECT
+incident_columns = {
+    'id': 'i.id',
+    'hechos': 'i.hechos',
+    'ubicacion': 'i.ubicacion',
+    'fecha': 'i.fecha',
+    'id_tipo_incidente': 'i.id_tipo_incidente',
+    'tipo_incidente': 'ti.descripcion',
+    'id_municipio': 'i.id_municipio',
+    'municipio': 'm.nombre',
+    'latitud': 'i.latitud',
+    'longitud': 'i.longitud',
+    'actualizado': 'i.actualizado'
+}
+incident_list_fields = ['id', 'hechos', 'ubicacion', 'fecha', 'id_tipo_incidente', 'tipo_incidente', 'id_municipio',
+                        'municipio']
+incident_nearby_fields = incident_list_fields + ['latitud', 'longitud']
+incident_change_fields = incident_list_fields + ['actualizado']
+# Campos calculados por la consulta que se entregan aunque no se pidan en fields=
+computed_fields = ('distancia', 'relevancia')
+incident_queue = get_queue(os.environ.get('INCIDENT_QUEUE_URL'))
+incident_queue_name = os.environ['INCIDENT_QUEUE_URL'].rsplit('/', 1)[-1] \
+    if isinstance(incident_queue, SQSQueue) else None
+incident_write_mode = os.environ.get('INCIDENT_WRITE_MODE', 'sync')
+export_store = exports.get_store(os.environ.get('EXPORT_STORE_URL'))
+export_queue = get_queue(os.environ.get('EXPORT_QUEUE_URL'))
+export_queue_name = os.environ['EXPORT_QUEUE_URL'].rsplit('/', 1)[-1] \
+    if isinstance(export_queue, SQSQueue) else None
+export_chunk_size = int(os.environ.get('EXPORT_CHUNK_SIZE', '1000'))
+# Sin cola la exportación corre dentro de la petición y debe terminar antes del límite de 29 s de API Gateway
+export_sync_max_days = int(os.environ.get('EXPORT_SYNC_MAX_DAYS', '31'))
+export_id_pattern = re.compile(r'^[0-9a-f]{32}$')
+list_types = ['municipios', 'incidentes', 'terminos', 'roles']
+list_cache = CatalogCache(list_types, check_interval=int(os.environ.get('LIST_CHECK_INTERVAL', '10')))
+# Vigencia en el cliente, después revalida con If-None-Match
+list_max_age = int(os.environ.get('LIST_CACHE_TTL', '300'))
+verifier = JWTVerifier(region, user_pool_id, jwks_path=os.environ.get('AWS_COGNITO_JWKS_PATH'),
+                       snapshot=load_snapshot(), client_id=os.environ.get('COGNITO_CLIENT_ID'))
 authorizer = CognitoUserPoolAuthorizer(os.environ['COGNITO_USER_POOL'],
                                        provider_arns=[os.environ['COGNITO_USER_POOL_ARN']])
 
+# Escrituras que aceptan Idempotency-Key
+idempotent_routes = {'/incidentes', '/incidentes/lote', '/admin/incidentes/exportaciones'}
+
 app = Chalice(app_name=os.environ['API_NAME'])
-app.api.cors = True
+app.api.cors = CORSConfig(allow_origin='*', allow_headers=['Idempotency-Key'],
+                          expose_headers=['ETag', 'X-Next-Cursor', 'Retry-After', 'Idempotent-Replayed'])
+
+
+@app.middleware('http')
+def request_timing(event, get_response):
+    with timing.request() as timer:
+        response = get_response(event)
+    timing.finish(timer, event, response)
+    return response
+
+
+@app.middleware('http')
+def admission_control(event, get_response):
+    return admission.admit(event, get_response, idempotent_routes, app.api.cors)
+
+
+@app.middleware('http')
+def db_transaction(event, get_response):
+    with db.transaction() as tx:
+        response = get_response(event)
+        if response.status_code >= 400:
+            tx.rollback()
+    return response
+
 
 @app.route('/listas/{tipo_lista}', methods=['GET'])
 def get_list(tipo_lista):
-    if tipo_lista in ['municipios', 'incidentes', 'terminos', 'roles']:
-        return get_list_db(tipo_lista)
+    if tipo_lista in list_types:
+        # El ETag sale de la versión compartida, un 304 no necesita leer el catálogo
+        etag = list_cache.etag(tipo_lista)
+        headers = {
+            'ETag': etag,
+            'Cache-Control': 'public, max-age=%d' % list_max_age
+        }
+        if_none_match = app.current_request.headers.get('If-None-Match')
+        if if_none_match and (if_none_match.strip() == '*' or
+                              etag in [tag.strip() for tag in if_none_match.split(',')]):
+            return Response(body='', headers=headers, status_code=304)
+        cached = get_cached_list(tipo_lista)
+        headers.update({'ETag': list_cache.etag(tipo_lista), 'Content-Type': 'application/json'})
+        return Response(body=cached['body'], headers=headers)
     else:
         raise BadRequestError("El tipo " + tipo_lista + " no es una lista válida")
 
 
+@app.route('/admin/listas/{tipo_lista}/invalidar', methods=['POST'], authorizer=authorizer)
+def invalidate_list(tipo_lista):
+    id_token = app.current_request.headers["Authorization"][7:]
+    resource = app.current_request.method + '/admin/listas'
+    if check_user_access(id_token, resource):
+        # La nueva versión invalida el catálogo en todos los contenedores en la siguiente consulta de versiones
+        if tipo_lista in list_types:
+            list_cache.bump([tipo_lista])
+        elif tipo_lista == 'todas':
+            list_cache.bump(list_types)
+        else:
+            raise BadRequestError("El tipo " + tipo_lista + " no es una lista válida")
+        return {
+            "status": "success",
+            "message": "Cache de listas invalidado"
+        }
+    else:
+        raise UnauthorizedError("El usuario no tiene acceso al recurso")
+
+
 @app.route('/incidentes', methods=['POST'], authorizer=authorizer)
 def create_incident():
     id_token = app.current_request.headers["Authorization"][7:]
     resource = app.current_request.method + '/incidentes'
     if check_user_access(id_token, resource):
         body = app.current_request.json_body
-        if all(k in body for k in ('hechos', 'ubicacion', 'fecha', 'id_tipo_incidente', 'id_municipio')):
+        if all(k in body for k in incident_fields):
+            # Municipio, tipo y fecha inválidos se rechazan con 400 antes de insertar o de encolar
+            error = validate_incident(body)
+            if error:
+                raise BadRequestError(error)
+            if incident_queue and (incident_write_mode == 'async' or
+                                   'respond-async' in app.current_request.headers.get('Prefer', '')):
+                return enqueue_incident(body)
             try:
                 id_incident = create_incident_db(body)
             except Exception as e:
@@ -48,173 +200,834 @@ def create_incident():
         raise UnauthorizedError("El usuario no tiene acceso al recurso")
 
 
+@app.route('/incidentes/seguimiento/{id_seguimiento}', methods=['GET'], authorizer=authorizer)
+def get_incident_status(id_seguimiento):
+    id_token = app.current_request.headers["Authorization"][7:]
+    resource = app.current_request.method + '/incidentes/seguimiento'
+    if check_user_access(id_token, resource):
+        id_incident, estado = get_incident_by_tracking_id_db(id_seguimiento)
+        return {
+            "status": "success",
+            "data": {
+                "id_seguimiento": id_seguimiento,
+                "estado": estado,
+                "id_incidente": id_incident
+            }
+        }
+    else:
+        raise UnauthorizedError("El usuario no tiene acceso al recurso")
+
+
+@app.route('/incidentes/lote', methods=['POST'], authorizer=authorizer)
+def create_incident_batch():
+    id_token = app.current_request.headers["Authorization"][7:]
+    resource = app.current_request.method + '/incidentes/lote'
+    if check_user_access(id_token, resource):
+        body = app.current_request.json_body
+        incidents = body.get('incidentes') if isinstance(body, dict) else None
+        if not isinstance(incidents, list) or not incidents:
+            raise BadRequestError("El campo incidentes es obligatorio")
+        if len(incidents) > incident_batch_max:
+            raise BadRequestError("El lote supera el máximo de %d incidentes" % incident_batch_max)
+        try:
+            results = create_incident_batch_db(incidents)
+        except Exception as e:
+            print(e)
+            raise ChaliceViewError("Ocurrio un error al crear el lote de incidentes")
+        created = len([r for r in results if r['status'] == 'success'])
+        return {
+            "status": "success",
+            "message": "Lote procesado",
+            "data": {
+                "creados": created,
+                "rechazados": len(results) - created,
+                "resultados": results
+            }
+        }
+    else:
+        raise UnauthorizedError("El usuario no tiene acceso al recurso")
+
+
 @app.route('/admin/incidentes', methods=['GET'],
            authorizer=authorizer)
 def get_incidents():
     id_token = app.current_request.headers["Authorization"][7:]
     resource = app.current_request.method + '/admin/incidentes'
     if check_user_access(id_token, resource):
-        query_params = app.current_request.query_params
+        query_params = app.current_request.query_params or {}
         if all(k in query_params for k in ('fecha_inicial', 'fecha_final', 'id_municipio')):
-            return get_incidents_db(query_params['fecha_inicial'], query_params['fecha_final'], query_params['id_municipio'],
-                                    query_params['id_tipo_incidente'] if 'id_tipo_incidente' in query_params else None)
+            incident_list, next_cursor = get_incidents_db(
+                query_params['fecha_inicial'], query_params['fecha_final'], query_params['id_municipio'],
+                query_params['id_tipo_incidente'] if 'id_tipo_incidente' in query_params else None,
+                limit=parse_limit(query_params.get('limit')),
+                cursor=decode_cursor(query_params['cursor']) if 'cursor' in query_params else None,
+                fields=parse_fields(query_params.get('fields'), incident_list_fields),
+                q=query_params.get('q', '').strip() or None)
+            headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
+            return Response(body=incident_list, headers=headers)
         else:
             raise BadRequestError("Campos obligatorios incompletos")
     else:
         raise UnauthorizedError("El usuario no tiene acceso al recurso")
 
 
+@app.route('/admin/incidentes/estadisticas', methods=['GET'], authorizer=authorizer)
+def get_incident_stats():
+    id_token = app.current_request.headers["Authorization"][7:]
+    resource = app.current_request.method + '/admin/incidentes'
+    if check_user_access(id_token, resource):
+        query_params = app.current_request.query_params or {}
+        if all(k in query_params for k in ('fecha_inicial', 'fecha_final')):
+            agrupacion = query_params.get('agrupacion', 'dia')
+            if agrupacion not in stats_periods:
+                raise BadRequestError("La agrupación debe ser una de: " + ', '.join(stats_periods))
+            return get_incident_stats_db(query_params['fecha_inicial'], query_params['fecha_final'],
+                                         query_params.get('id_municipio'), query_params.get('id_tipo_incidente'),
+                                         agrupacion)
+        else:
+            raise BadRequestError("Campos obligatorios incompletos")
+    else:
+        raise UnauthorizedError("El usuario no tiene acceso al recurso")
+
+
+@app.route('/admin/incidentes/cercanos', methods=['GET'], authorizer=authorizer)
+def get_nearby_incidents():
+    id_token = app.current_request.headers["Authorization"][7:]
+    resource = app.current_request.method + '/admin/incidentes'
+    if check_user_access(id_token, resource):
+        query_params = app.current_request.query_params or {}
+        bbox, center = parse_search_area(query_params)
+        if 'zoom' in query_params:
+            try:
+                precision = geo.zoom_precision(query_params['zoom'])
+            except ValueError:
+                raise BadRequestError("El zoom no es válido")
+            return get_incident_clusters_db(bbox, precision, query_params)
+        return get_nearby_incidents_db(bbox, center, query_params, parse_limit(query_params.get('limit')),
+                                       parse_fields(query_params.get('fields'), incident_nearby_fields))
+    else:
+        raise UnauthorizedError("El usuario no tiene acceso al recurso")
+
+
+@app.route('/admin/incidentes/cambios', methods=['GET'], authorizer=authorizer)
+def get_incident_changes():
+    id_token = app.current_request.headers["Authorization"][7:]
+    resource = app.current_request.method + '/admin/incidentes'
+    if check_user_access(id_token, resource):
+        query_params = app.current_request.query_params or {}
+        incident_list, next_cursor = get_incident_changes_db(
+            query_params, limit=parse_limit(query_params.get('limit')),
+            cursor=decode_cursor(query_params['desde']) if 'desde' in query_params else None,
+            fields=parse_fields(query_params.get('fields'), incident_change_fields))
+        return Response(body=incident_list, headers={'X-Next-Cursor': next_cursor})
+    else:
+        raise UnauthorizedError("El usuario no tiene acceso al recurso")
+
+
+@app.route('/admin/incidentes/exportaciones', methods=['POST'], authorizer=authorizer)
+def create_incident_export():
+    id_token = app.current_request.headers["Authorization"][7:]
+    resource = app.current_request.method + '/admin/incidentes/exportaciones'
+    if check_user_access(id_token, resource):
+        if export_store is None:
+            raise ChaliceViewError("Las exportaciones no están habilitadas")
+        job = parse_export_job(app.current_request.json_body)
+        if not export_queue and export_days(job) > export_sync_max_days:
+            raise BadRequestError("Sin cola de exportaciones el rango no puede superar %d días"
+                                  % export_sync_max_days)
+        if export_queue:
+            try:
+                exports.save_manifest(export_store, {"id_exportacion": job['id_exportacion'], "estado": "pendiente"})
+                export_queue.send(job)
+            except Exception as e:
+                print(e)
+                raise ChaliceViewError("Ocurrio un error al recibir la exportación")
+            return Response(body={
+                "status": "success",
+                "message": "Exportación recibida",
+                "data": {
+                    "id_exportacion": job['id_exportacion']
+                }
+            }, status_code=202)
+        try:
+            manifest = run_export(job)
+        except Exception as e:
+            print(e)
+            raise ChaliceViewError("Ocurrio un error al exportar los incidentes")
+        return {
+            "status": "success",
+            "message": "Exportación completada",
+            "data": export_handle(manifest)
+        }
+    else:
+        raise UnauthorizedError("El usuario no tiene acceso al recurso")
+
+
+@app.route('/admin/incidentes/exportaciones/{id_exportacion}', methods=['GET'], authorizer=authorizer)
+def get_incident_export(id_exportacion):
+    id_token = app.current_request.headers["Authorization"][7:]
+    resource = app.current_request.method + '/admin/incidentes/exportaciones'
+    if check_user_access(id_token, resource):
+        if export_store is None:
+            raise ChaliceViewError("Las exportaciones no están habilitadas")
+        manifest = exports.load_manifest(export_store, id_exportacion) \
+            if export_id_pattern.match(id_exportacion) else None
+        if manifest is None:
+            raise NotFoundError("La exportación " + id_exportacion + " no existe")
+        return {
+            "status": "success",
+            "data": export_handle(manifest)
+        }
+    else:
+        raise UnauthorizedError("El usuario no tiene acceso al recurso")
+
+
+if incident_queue_name:
+    @app.on_sqs_message(queue=incident_queue_name, batch_size=10)
+    def consume_incident_queue(event):
+        with db.transaction():
+            create_queued_incidents_db([json.loads(record.body) for record in event])
+
+if export_queue_name:
+    # Una exportación por invocación, el rango completo puede tardar varios minutos
+    @app.on_sqs_message(queue=export_queue_name, batch_size=1)
+    def consume_export_queue(event):
+        for record in event:
+            run_export(json.loads(record.body))
+
+
+def enqueue_incident(incident):
+    tracking_id = uuid.uuid4().hex
+    try:
+        with timing.phase('cola'):
+            incident_queue.send({"id_seguimiento": tracking_id, "incidente": incident})
+    except Exception as e:
+        print(e)
+        raise ChaliceViewError("Ocurrio un error al recibir el incidente")
+    return Response(body={
+        "status": "success",
+        "message": "Incidente recibido",
+        "data": {
+            "id_seguimiento": tracking_id
+        }
+    }, status_code=202)
+
+
+def parse_export_job(body):
+    if not isinstance(body, dict) or not all(k in body for k in ('fecha_inicial', 'fecha_final')):
+        raise BadRequestError("Campos obligatorios incompletos")
+    for key in ('fecha_inicial', 'fecha_final'):
+        try:
+            datetime.strptime(str(body[key]), '%Y-%m-%d')
+        except ValueError:
+            raise BadRequestError("El campo " + key + " no es válido")
+    formato = body.get('formato', 'ndjson')
+    if formato not in exports.formats:
+        raise BadRequestError("El formato " + str(formato) + " no es válido")
+    fields = body.get('fields')
+    if isinstance(fields, list):
+        fields = ','.join(str(field) for field in fields)
+    job = {
+        "id_exportacion": uuid.uuid4().hex,
+        "fecha_inicial": body['fecha_inicial'],
+        "fecha_final": body['fecha_final'],
+        "formato": formato,
+        "gzip": bool(body.get('gzip', False)),
+        "fields": parse_fields(fields, incident_nearby_fields)
+    }
+    for key in ('id_municipio', 'id_tipo_incidente'):
+        if body.get(key) is not None:
+            job.update({key: body[key]})
+    return job
+
+
+def export_days(job):
+    return (datetime.strptime(job['fecha_final'], '%Y-%m-%d') -
+            datetime.strptime(job['fecha_inicial'], '%Y-%m-%d')).days + 1
+
+
+def run_export(job):
+    key = exports.object_key(job['id_exportacion'], job['formato'], job['gzip'])
+    writer = exports.ExportWriter(export_store.open(key, exports.formats[job['formato']][0]), job['formato'],
+                                  job['fields'], compress=job['gzip'])
+    manifest = {"id_exportacion": job['id_exportacion'], "formato": job['formato'], "gzip": job['gzip']}
+    try:
+        # Cada bloque se escribe y se descarta antes de leer el siguiente, la memoria no crece con el rango
+        for chunk in get_incident_chunks_db(job, export_chunk_size):
+            writer.write_rows(chunk)
+        writer.close()
+    except Exception:
+        writer.abort()
+        manifest.update(estado="error")
+        exports.save_manifest(export_store, manifest)
+        raise
+    manifest.update(estado="completada", registros=writer.rows, clave=key)
+    exports.save_manifest(export_store, manifest)
+    return manifest
+
+
+def export_handle(manifest):
+    handle = {k: v for k, v in manifest.items() if k != 'clave'}
+    if manifest.get('estado') == 'completada':
+        handle.update(url=export_store.url(manifest['clave']))
+    return handle
+
+
+def drain_export_queue(max_messages=10):
+    drained = 0
+    while drained < max_messages:
+        messages = export_queue.receive(1)
+        if not messages:
+            break
+        try:
+            run_export(messages[0].body)
+        except Exception as e:
+            # El manifiesto ya quedó en error, el mensaje vuelve a la cola cuando vence su plazo de visibilidad
+            print(e)
+        else:
+            export_queue.delete([messages[0].receipt])
+        drained += 1
+    return drained
+
+
+def drain_incident_queue(max_messages=100):
+    drained = 0
+    while drained < max_messages:
+        messages = incident_queue.receive(min(10, max_messages - drained))
+        if not messages:
+            break
+        with db.transaction():
+            create_queued_incidents_db([message.body for message in messages])
+        incident_queue.delete([message.receipt for message in messages])
+        drained += len(messages)
+    return drained
+
+
 def get_list_db(list_type):
     list = []
-    with aurora_data_api.connect(aurora_cluster_arn=db_cluster_arn, secret_arn=db_credentials_secret_arn,
-                                 database=db_name) as conn:
-        with conn.cursor() as cursor:
-            if list_type == 'municipios':
-                cursor.execute("""
-                SELECT id, nombre, logo, slogan, coordenadas
-                FROM MUNICIPIO
-                """)
-                for reg in cursor:
-                    municipio = {}
-                    municipio.update(id=reg[0])
-                    municipio.update(nombre=reg[1])
-                    municipio.update(logo=reg[2])
-                    municipio.update(slogan=reg[3])
-                    municipio.update(coordenadas=reg[4])
-                    list.append(municipio)
-            elif list_type == 'incidentes':
-                cursor.execute("""
-                SELECT id, descripcion, icono
-                FROM TIPO_INCIDENTE
-                """)
-                for reg in cursor:
-                    tipo_incidente = {}
-                    tipo_incidente.update(id=reg[0])
-                    tipo_incidente.update(descripcion=reg[1])
-                    tipo_incidente.update(icono=reg[2])
-                    list.append(tipo_incidente)
-            elif list_type == 'terminos':
-                cursor.execute("""
-                                SELECT id, texto_legal, version
-                                FROM TERMINOS_CONDICIONES ORDER BY id DESC LIMIT 1
-                                """)
-                for reg in cursor:
-                    tipo_terminos = {}
-                    tipo_terminos.update(id=reg[0])
-                    tipo_terminos.update(texto_legal=reg[1])
-                    tipo_terminos.update(version=reg[2])
-                return tipo_terminos
-            elif list_type == 'roles':
-                cursor.execute("""
-                                SELECT id, nombre
-                                FROM ROL
-                                """)
-                for reg in cursor:
-                    tipo_rol = {}
-                    tipo_rol.update(id=reg[0])
-                    tipo_rol.update(nombre=reg[1])
-                    list.append(tipo_rol)
-            return list
+    with db.cursor() as cursor:
+        if list_type == 'municipios':
+            cursor.execute("""
+            SELECT id, nombre, logo, slogan, coordenadas
+            FROM MUNICIPIO
+            """)
+            for reg in cursor:
+                municipio = {}
+                municipio.update(id=reg[0])
+                municipio.update(nombre=reg[1])
+                municipio.update(logo=reg[2])
+                municipio.update(slogan=reg[3])
+                municipio.update(coordenadas=reg[4])
+                list.append(municipio)
+        elif list_type == 'incidentes':
+            cursor.execute("""
+            SELECT id, descripcion, icono
+            FROM TIPO_INCIDENTE
+            """)
+            for reg in cursor:
+                tipo_incidente = {}
+                tipo_incidente.update(id=reg[0])
+                tipo_incidente.update(descripcion=reg[1])
+                tipo_incidente.update(icono=reg[2])
+                list.append(tipo_incidente)
+        elif list_type == 'terminos':
+            cursor.execute("""
+                            SELECT id, texto_legal, version
+                            FROM TERMINOS_CONDICIONES ORDER BY id DESC LIMIT 1
+                            """)
+            for reg in cursor:
+                tipo_terminos = {}
+                tipo_terminos.update(id=reg[0])
+                tipo_terminos.update(texto_legal=reg[1])
+                tipo_terminos.update(version=reg[2])
+            return tipo_terminos
+        elif list_type == 'roles':
+            cursor.execute("""
+                            SELECT id, nombre
+                            FROM ROL
+                            """)
+            for reg in cursor:
+                tipo_rol = {}
+                tipo_rol.update(id=reg[0])
+                tipo_rol.update(nombre=reg[1])
+                list.append(tipo_rol)
+        return list
 
 
-def create_incident_db(incident):
-    with aurora_data_api.connect(aurora_cluster_arn=db_cluster_arn, secret_arn=db_credentials_secret_arn,
-                                 database=db_name) as conn:
-        with conn.cursor() as cursor:
-            id_usuario = None
-            if 'correo_usuario' in incident:
-                cursor.execute("""
-                                SELECT id
-                                FROM USUARIO
-                                WHERE correo = :email
-                                """, {
-                    "email": incident['correo_usuario']
-                })
-                for reg in cursor:
-                    id_usuario = reg[0]
+def get_cached_list(list_type):
+    return list_cache.get(list_type, load_list)
 
+
+def load_list(list_type):
+    data = get_list_db(list_type)
+    return {
+        "body": json.dumps(data, separators=(',', ':'), default=str),
+        "ids": {str(item['id']) for item in data} if isinstance(data, list) else set()
+    }
+
+
+def create_incident_db(incident):
+    with db.cursor() as cursor:
+        id_usuario = None
+        if 'correo_usuario' in incident:
             cursor.execute("""
-                INSERT INTO INCIDENTE (hechos, ubicacion, fecha, id_tipo_incidente, 
-                           id_municipio, id_usuario) 
-                           VALUES (:hechos, :ubicacion, :fecha, :id_tipo_incidente, 
-                           :id_municipio, :id_usuario)
-                """,
-                           {
-                               "hechos": incident["hechos"],
-                               "ubicacion": incident["ubicacion"],
-                               "fecha": incident["fecha"],
-                               "id_tipo_incidente": incident["id_tipo_incidente"],
-                               "id_municipio": incident["id_municipio"],
-                               "id_usuario": id_usuario
-                           }
-                           )
-            return cursor.lastrowid
-
-
-def get_incidents_db(fecha_inicial, fecha_final, id_municipio, id_tipo_inicidente):
-    with aurora_data_api.connect(aurora_cluster_arn=db_cluster_arn, secret_arn=db_credentials_secret_arn,
-                                 database=db_name) as conn:
-        query = """
-            SELECT i.id, i.hechos, i.ubicacion, i.fecha, i.id_tipo_incidente, ti.descripcion, i.id_municipio, m.nombre
-            FROM INCIDENTE i, MUNICIPIO m, TIPO_INCIDENTE ti
-            WHERE i.id_municipio = m.id AND i.id_tipo_incidente = ti.id
-            AND DATE(i.fecha) BETWEEN STR_TO_DATE(:fecha_inicial,'%Y-%m-%d') AND STR_TO_DATE(:fecha_final,'%Y-%m-%d')
-            AND i.id_municipio = :id_municipio
-            """
-        params = {
-            "fecha_inicial": fecha_inicial,
-            "fecha_final": fecha_final,
-            "id_municipio": id_municipio
-        }
-        incident_list = []
-        if id_tipo_inicidente:
-            query += " AND i.id_tipo_incidente = :id_tipo_incidente"
-            params.update(id_tipo_incidente=id_tipo_inicidente)
-        with conn.cursor() as cursor:
-            cursor.execute(query, params)
+                            SELECT id
+                            FROM USUARIO
+                            WHERE correo = :email
+                            """, {
+                "email": incident['correo_usuario']
+            })
             for reg in cursor:
-                incident = {}
-                incident.update(id=reg[0])
-                incident.update(hechos=reg[1])
-                incident.update(ubicacion=reg[2])
-                incident.update(fecha=reg[3])
-                incident.update(id_tipo_incidente=reg[4])
-                incident.update(tipo_incidente=reg[5])
-                incident.update(id_municipio=reg[6])
-                incident.update(municipio=reg[7])
-                incident_list.append(incident)
-            return incident_list
+                id_usuario = reg[0]
 
+        cursor.execute(insert_incident_sql, incident_params(incident, id_usuario))
+        id_incident = cursor.lastrowid
+    update_incident_stats_db([incident])
+    return id_incident
 
-def check_user_access(id_token, resource):
-    user_claims = get_token_claims(id_token)
-    if user_claims:
-        email = user_claims.get('email')
-        with aurora_data_api.connect(aurora_cluster_arn=db_cluster_arn, secret_arn=db_credentials_secret_arn,
-                                     database=db_name) as conn:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                SELECT re.nombre AS recurso, re.path
-                FROM USUARIO u, ROL r, ROL_RECURSO rr, RECURSO re
-                WHERE rr.id_rol = r.id AND rr.id_recurso = re.id
-                AND u.id_rol = r.id
-                AND u.correo = :email and re.path = :resource
-                """, {
-                    "email": email,
-                    "resource": resource
-                })
-                if cursor.rowcount > 0:
-                    return True
-                else:
-                    return False
+
+def create_incident_batch_db(incidents):
+    results = [None] * len(incidents)
+    valid = []
+    for index, incident in enumerate(incidents):
+        error = validate_incident(incident)
+        if error:
+            results[index] = {"indice": index, "status": "error", "message": error}
+        else:
+            valid.append(index)
+    user_ids = get_user_ids_db(list({incidents[i]['correo_usuario'] for i in valid
+                                     if incidents[i].get('correo_usuario')}))
+    params = [incident_params(incidents[i], user_ids.get(incidents[i].get('correo_usuario'))) for i in valid]
+    if params:
+        for index, id_incident in zip(valid, db.execute_batch(insert_incident_sql, params)):
+            results[index] = {"indice": index, "status": "success", "id_incidente": id_incident}
+        update_incident_stats_db([incidents[i] for i in valid])
+    return results
+
+
+def create_queued_incidents_db(messages):
+    # Los mensajes que la cola entrega de nuevo ya tienen fila, no se insertan ni se cuentan otra vez
+    existing = get_tracking_ids_db([m['id_seguimiento'] for m in messages])
+    messages = [m for m in messages if m['id_seguimiento'] not in existing]
+    if not messages:
+        return
+    user_ids = get_user_ids_db(list({m['incidente']['correo_usuario'] for m in messages
+                                     if m['incidente'].get('correo_usuario')}))
+    params = [dict(incident_params(m['incidente'], user_ids.get(m['incidente'].get('correo_usuario'))),
+                   id_seguimiento=m['id_seguimiento']) for m in messages]
+    try:
+        ids = db.execute_batch(insert_queued_incident_sql, params)
+    except db.get_client().exceptions.BadRequestException as e:
+        # Una fila que la base de datos rechaza (municipio o tipo inexistente) hace fallar todo el lote, se
+        # deshace y se inserta mensaje por mensaje para marcar como rechazado solo el que falla
+        print(e)
+        with db.transaction() as tx:
+            tx.rollback()
+        ids = [create_queued_incident_db(p) for p in params]
+    # Un mensaje repetido que llega a la vez por dos consumidores no genera id y no se cuenta de nuevo
+    update_incident_stats_db([m['incidente'] for m, id_incident in zip(messages, ids) if id_incident])
+
+
+def create_queued_incident_db(params):
+    try:
+        return db.execute_batch(insert_queued_incident_sql, [params])[0]
+    except db.get_client().exceptions.BadRequestException as e:
+        # Un reintento de la cola fallaría igual, el seguimiento queda en estado rechazado
+        print(e)
+        with db.cursor() as cursor:
+            cursor.execute(insert_rejected_incident_sql, {"id_seguimiento": params['id_seguimiento'],
+                                                          "motivo": str(e)[:255]})
+        return None
+
+
+def update_incident_stats_db(incidents):
+    counts = Counter((int(i['id_municipio']), int(i['id_tipo_incidente']), str(i['fecha'])[:10]) for i in incidents)
+    # Orden fijo de llaves para que dos lotes concurrentes no se bloqueen mutuamente
+    db.execute_batch(upsert_incident_stats_sql, [{
+        "id_municipio": id_municipio,
+        "id_tipo_incidente": id_tipo_incidente,
+        "dia": dia,
+        "total": total
+    } for (id_municipio, id_tipo_incidente, dia), total in sorted(counts.items())])
+
+
+def get_incident_stats_db(fecha_inicial, fecha_final, id_municipio, id_tipo_incidente, agrupacion):
+    period = stats_periods[agrupacion]
+    columns = (period + " AS periodo, " if period else "") + "e.id_municipio, e.id_tipo_incidente"
+    query = """
+        SELECT %s, SUM(e.total)
+        FROM ESTADISTICA_INCIDENTE e
+        WHERE e.dia >= STR_TO_DATE(:fecha_inicial,'%%Y-%%m-%%d')
+        AND e.dia <= STR_TO_DATE(:fecha_final,'%%Y-%%m-%%d')
+        """ % columns
+    params = {
+        "fecha_inicial": fecha_inicial,
+        "fecha_final": fecha_final
+    }
+    if id_municipio:
+        query += " AND e.id_municipio = :id_municipio"
+        params.update(id_municipio=id_municipio)
+    if id_tipo_incidente:
+        query += " AND e.id_tipo_incidente = :id_tipo_incidente"
+        params.update(id_tipo_incidente=id_tipo_incidente)
+    group = ("periodo, " if period else "") + "e.id_municipio, e.id_tipo_incidente"
+    query += " GROUP BY %s ORDER BY %s" % (group, group)
+    stats = []
+    with db.read_cursor() as cursor:
+        cursor.execute(query, params)
+        for reg in cursor:
+            stat = {}
+            if period:
+                stat.update(periodo=reg[0])
+            stat.update(id_municipio=reg[-3])
+            stat.update(id_tipo_incidente=reg[-2])
+            stat.update(total=int(reg[-1]))
+            stats.append(stat)
+    return stats
+
+
+def get_incident_by_tracking_id_db(tracking_id):
+    with db.cursor() as cursor:
+        cursor.execute("""
+            SELECT id, 'creado' FROM INCIDENTE WHERE id_seguimiento = :id_seguimiento
+            UNION ALL
+            SELECT NULL, 'rechazado' FROM INCIDENTE_RECHAZADO WHERE id_seguimiento = :id_seguimiento
+            """, {"id_seguimiento": tracking_id})
+        for reg in cursor:
+            return reg[0], reg[1]
+    return None, "pendiente"
+
+
+def validate_incident(incident):
+    if not isinstance(incident, dict):
+        return "El incidente debe ser un objeto"
+    if not all(k in incident for k in incident_fields):
+        return "Campos obligatorios incompletos"
+    try:
+        datetime.fromisoformat(str(incident['fecha']))
+    except ValueError:
+        return "La fecha no es válida"
+    if str(incident['id_municipio']) not in get_cached_list('municipios')['ids']:
+        return "El municipio no existe"
+    if str(incident['id_tipo_incidente']) not in get_cached_list('incidentes')['ids']:
+        return "El tipo de incidente no existe"
+    return None
+
+
+def get_tracking_ids_db(tracking_ids):
+    with db.cursor() as cursor:
+        cursor.execute("""
+            SELECT id_seguimiento FROM INCIDENTE WHERE id_seguimiento IN (%s)
+            UNION ALL
+            SELECT id_seguimiento FROM INCIDENTE_RECHAZADO WHERE id_seguimiento IN (%s)
+            """ % ((','.join(':' + str(i) for i in range(len(tracking_ids))),) * 2),
+                       {str(i): tracking_ids[i] for i in range(len(tracking_ids))})
+        return {reg[0] for reg in cursor}
+
+
+def get_user_ids_db(email_list):
+    user_ids = {}
+    if not email_list:
+        return user_ids
+    with db.cursor() as cursor:
+        cursor.execute("""
+            SELECT correo, id
+            FROM USUARIO
+            WHERE correo IN (%s)
+            """ % ','.join(':' + str(i) for i in range(len(email_list))),
+                       {str(i): email_list[i] for i in range(len(email_list))})
+        for reg in cursor:
+            user_ids[reg[0]] = reg[1]
+    return user_ids
+
+
+def incident_params(incident, id_usuario):
+    # Una ubicación que no sea "latitud,longitud" se guarda tal cual y queda fuera de las búsquedas por área
+    location = geo.parse_location(incident["ubicacion"])
+    return {
+        "hechos": incident["hechos"],
+        "ubicacion": incident["ubicacion"],
+        "fecha": incident["fecha"],
+        "id_tipo_incidente": incident["id_tipo_incidente"],
+        "id_municipio": incident["id_municipio"],
+        "id_usuario": id_usuario,
+        "latitud": location[0] if location else None,
+        "longitud": location[1] if location else None,
+        "geohash": geo.encode(*location) if location else None
+    }
+
+
+def get_incidents_db(fecha_inicial, fecha_final, id_municipio, id_tipo_inicidente, limit=default_page_size,
+                     cursor=None, fields=incident_list_fields, q=None):
+    if q:
+        return search_incidents_db(q, fecha_inicial, fecha_final, id_municipio, id_tipo_inicidente, limit=limit,
+                                   cursor=cursor, fields=fields)
+    # id y fecha siempre se leen porque forman el cursor de la página siguiente
+    select, columns = incident_select(fields, ['id', 'fecha'])
+    query = select + """
+        WHERE i.fecha >= STR_TO_DATE(:fecha_inicial,'%Y-%m-%d')
+        AND i.fecha < STR_TO_DATE(:fecha_final,'%Y-%m-%d') + INTERVAL 1 DAY
+        """
+    params = {
+        "fecha_inicial": fecha_inicial,
+        "fecha_final": fecha_final
+    }
+    incident_list = []
+    if id_municipio:
+        query += " AND i.id_municipio = :id_municipio"
+        params.update(id_municipio=id_municipio)
+    if id_tipo_inicidente:
+        query += " AND i.id_tipo_incidente = :id_tipo_incidente"
+        params.update(id_tipo_incidente=id_tipo_inicidente)
+    if cursor:
+        if len(cursor) != 2:
+            raise BadRequestError("El cursor no es válido")
+        query += " AND (i.fecha > :cursor_fecha OR (i.fecha = :cursor_fecha AND i.id > :cursor_id))"
+        params.update(cursor_fecha=cursor[0], cursor_id=cursor[1])
+    # Se pide un registro adicional para saber si existe una página siguiente
+    query += " ORDER BY i.fecha, i.id LIMIT %d" % (limit + 1)
+    with db.read_cursor() as db_cursor:
+        db_cursor.execute(query, params)
+        for reg in db_cursor:
+            incident_list.append(incident_from_row(columns, reg))
+    next_cursor = None
+    if len(incident_list) > limit:
+        incident_list = incident_list[:limit]
+        next_cursor = encode_cursor([incident_list[-1]['fecha'], incident_list[-1]['id']])
+    return [project_incident(incident, fields) for incident in incident_list], next_cursor
+
+
+def search_incidents_db(q, fecha_inicial, fecha_final, id_municipio, id_tipo_incidente, limit=default_page_size,
+                        cursor=None, fields=incident_list_fields):
+    if len(q) > search_max_length:
+        raise BadRequestError("La búsqueda supera el máximo de %d caracteres" % search_max_length)
+    if cursor and (len(cursor) != 1 or not isinstance(cursor[0], int) or cursor[0] < 0):
+        raise BadRequestError("El cursor no es válido")
+    offset = cursor[0] if cursor else 0
+    select, columns = incident_select(fields, ['id'], computed={'relevancia': search_relevance})
+    # El índice FULLTEXT resuelve el texto y los filtros de siempre se aplican en la misma consulta
+    query = select + """
+        WHERE """ + search_relevance + """
+        AND i.fecha >= STR_TO_DATE(:fecha_inicial,'%Y-%m-%d')
+        AND i.fecha < STR_TO_DATE(:fecha_final,'%Y-%m-%d') + INTERVAL 1 DAY
+        AND i.id_municipio = :id_municipio
+        """
+    params = {
+        "q": q,
+        "fecha_inicial": fecha_inicial,
+        "fecha_final": fecha_final,
+        "id_municipio": id_municipio
+    }
+    if id_tipo_incidente:
+        query += " AND i.id_tipo_incidente = :id_tipo_incidente"
+        params.update(id_tipo_incidente=id_tipo_incidente)
+    # La relevancia no es única ni estable entre consultas, el cursor es la posición dentro del orden
+    query += " ORDER BY relevancia DESC, i.id LIMIT %d OFFSET %d" % (limit + 1, offset)
+    incident_list = []
+    with db.read_cursor() as db_cursor:
+        db_cursor.execute(query, params)
+        for reg in db_cursor:
+            incident_list.append(incident_from_row(columns, reg))
+    next_cursor = None
+    if len(incident_list) > limit:
+        incident_list = incident_list[:limit]
+        next_cursor = encode_cursor([offset + limit])
+    return [project_incident(incident, fields) for incident in incident_list], next_cursor
+
+
+def get_incident_changes_db(query_params, limit=default_page_size, cursor=None, fields=incident_change_fields):
+    params = {"lag": change_feed_lag}
+    if cursor is None:
+        # Sin cursor el feed empieza ahora, el tablero carga el estado inicial con /admin/incidentes
+        with db.read_cursor() as db_cursor:
+            db_cursor.execute("SELECT NOW(3) - INTERVAL :lag SECOND", params)
+            return [], encode_cursor([db_cursor.fetchone()[0], 0])
+    if len(cursor) != 2:
+        raise BadRequestError("El cursor no es válido")
+    select, columns = incident_select(fields, ['id', 'actualizado'])
+    query = select + """
+        WHERE i.actualizado >= :cursor_actualizado
+        AND (i.actualizado > :cursor_actualizado OR i.id > :cursor_id)
+        AND i.actualizado < NOW(3) - INTERVAL :lag SECOND
+        """
+    params.update(cursor_actualizado=cursor[0], cursor_id=cursor[1])
+    if 'id_municipio' in query_params:
+        query += " AND i.id_municipio = :id_municipio"
+        params.update(id_municipio=query_params['id_municipio'])
+    if 'id_tipo_incidente' in query_params:
+        query += " AND i.id_tipo_incidente = :id_tipo_incidente"
+        params.update(id_tipo_incidente=query_params['id_tipo_incidente'])
+    query += " ORDER BY i.actualizado, i.id LIMIT %d" % limit
+    incident_list = []
+    with db.read_cursor() as db_cursor:
+        db_cursor.execute(query, params)
+        for reg in db_cursor:
+            incident_list.append(incident_from_row(columns, reg))
+    # Sin filas nuevas el cursor no avanza
+    next_cursor = encode_cursor([incident_list[-1]['actualizado'], incident_list[-1]['id']]) if incident_list \
+        else encode_cursor(cursor)
+    return [project_incident(incident, fields) for incident in incident_list], next_cursor
+
+
+def get_incident_chunks_db(job, chunk_size):
+    cursor = None
+    while True:
+        chunk, next_cursor = get_incidents_db(job['fecha_inicial'], job['fecha_final'], job.get('id_municipio'),
+                                              job.get('id_tipo_incidente'), limit=chunk_size, cursor=cursor,
+                                              fields=job['fields'])
+        if chunk:
+            yield chunk
+        if not next_cursor:
+            return
+        cursor = decode_cursor(next_cursor)
+
+
+def parse_fields(value, default):
+    if not value:
+        return default
+    fields = []
+    for field in value.split(','):
+        field = field.strip()
+        if not field:
+            continue
+        if field not in incident_columns:
+            raise BadRequestError("El campo " + field + " no es válido")
+        if field not in fields:
+            fields.append(field)
+    return fields
+
+
+def incident_select(fields, required, computed=None):
+    columns = list(fields) + [field for field in required if field not in fields]
+    expressions = [incident_columns[field] for field in columns]
+    for field, expression in (computed or {}).items():
+        columns.append(field)
+        expressions.append(expression + " AS " + field)
+    query = "SELECT " + ", ".join(expressions) + " FROM INCIDENTE i"
+    # Las tablas de catálogo solo se unen cuando se pide su descripción
+    if 'tipo_incidente' in columns:
+        query += " JOIN TIPO_INCIDENTE ti ON ti.id = i.id_tipo_incidente"
+    if 'municipio' in columns:
+        query += " JOIN MUNICIPIO m ON m.id = i.id_municipio"
+    return query, columns
+
+
+def incident_from_row(columns, reg):
+    incident = {}
+    for field, value in zip(columns, reg):
+        if field in ('latitud', 'longitud') and value is not None:
+            value = float(value)
+        elif field == 'relevancia':
+            value = round(float(value), 4)
+        incident.update({field: value})
+    return incident
+
+
+def project_incident(incident, fields):
+    if len(incident) == len(fields):
+        return incident
+    return {field: value for field, value in incident.items() if field in fields or field in computed_fields}
+
+
+def parse_search_area(query_params):
+    try:
+        if all(k in query_params for k in ('latitud', 'longitud', 'radio')):
+            lat, lon, radius = float(query_params['latitud']), float(query_params['longitud']), \
+                float(query_params['radio'])
+            if -90 <= lat <= 90 and -180 <= lon <= 180 and 0 < radius <= nearby_max_radius:
+                return geo.bounding_box(lat, lon, radius), (lat, lon, radius)
+        elif 'bbox' in query_params:
+            min_lat, min_lon, max_lat, max_lon = [float(v) for v in query_params['bbox'].split(',')]
+            if -90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= max_lon <= 180:
+                return (min_lat, min_lon, max_lat, max_lon), None
+        else:
+            raise BadRequestError("Se requiere latitud, longitud y radio, o bbox")
+    except ValueError:
+        pass
+    raise BadRequestError("El área de búsqueda no es válida (radio máximo %d metros)" % nearby_max_radius)
+
+
+def area_conditions(bbox, query_params):
+    min_lat, min_lon, max_lat, max_lon = bbox
+    prefixes = geo.cover(min_lat, min_lon, max_lat, max_lon)
+    # El prefijo de geohash recorre el índice, el rango exacto de coordenadas descarta los bordes de las celdas
+    conditions = [
+        "(" + " OR ".join("i.geohash LIKE :geohash_%d" % n for n in range(len(prefixes))) + ")",
+        "i.latitud BETWEEN :min_lat AND :max_lat",
+        "i.longitud BETWEEN :min_lon AND :max_lon"
+    ]
+    params = {"geohash_%d" % n: prefix + '%' for n, prefix in enumerate(prefixes)}
+    params.update(min_lat=min_lat, min_lon=min_lon, max_lat=max_lat, max_lon=max_lon)
+    if 'fecha_inicial' in query_params:
+        conditions.append("i.fecha >= STR_TO_DATE(:fecha_inicial,'%Y-%m-%d')")
+        params.update(fecha_inicial=query_params['fecha_inicial'])
+    if 'fecha_final' in query_params:
+        conditions.append("i.fecha < STR_TO_DATE(:fecha_final,'%Y-%m-%d') + INTERVAL 1 DAY")
+        params.update(fecha_final=query_params['fecha_final'])
+    if 'id_municipio' in query_params:
+        conditions.append("i.id_municipio = :id_municipio")
+        params.update(id_municipio=query_params['id_municipio'])
+    if 'id_tipo_incidente' in query_params:
+        conditions.append("i.id_tipo_incidente = :id_tipo_incidente")
+        params.update(id_tipo_incidente=query_params['id_tipo_incidente'])
+    return " AND ".join(conditions), params
+
+
+def get_nearby_incidents_db(bbox, center, query_params, limit, fields=incident_nearby_fields):
+    conditions, params = area_conditions(bbox, query_params)
+    select, columns = incident_select(fields, ['latitud', 'longitud'] if center else [])
+    query = select + " WHERE " + conditions
+    if center:
+        # Distancia equirectangular para ordenar en la base de datos, la exacta se calcula sobre la página
+        query += " ORDER BY POW(i.latitud - :lat, 2) + POW((i.longitud - :lon) * :cos_lat, 2), i.id"
+        params.update(lat=center[0], lon=center[1], cos_lat=math.cos(math.radians(center[0])))
     else:
-        return False
+        query += " ORDER BY i.fecha DESC, i.id DESC"
+    query += " LIMIT %d" % limit
+    incident_list = []
+    with db.read_cursor() as cursor:
+        cursor.execute(query, params)
+        for reg in cursor:
+            incident = incident_from_row(columns, reg)
+            if center:
+                distance = geo.distance_m(center[0], center[1], incident['latitud'], incident['longitud'])
+                if distance > center[2]:
+                    continue
+                incident.update(distancia=round(distance, 1))
+            incident_list.append(project_incident(incident, fields))
+    return incident_list
+
+
+def get_incident_clusters_db(bbox, precision, query_params):
+    conditions, params = area_conditions(bbox, query_params)
+    query = """
+        SELECT LEFT(i.geohash, %d) AS celda, COUNT(*), AVG(i.latitud), AVG(i.longitud)
+        FROM INCIDENTE i
+        WHERE """ % precision + conditions + """
+        GROUP BY celda"""
+    clusters = []
+    with db.read_cursor() as cursor:
+        cursor.execute(query, params)
+        for reg in cursor:
+            cluster = {}
+            cluster.update(geohash=reg[0])
+            cluster.update(total=int(reg[1]))
+            cluster.update(latitud=float(reg[2]))
+            cluster.update(longitud=float(reg[3]))
+            clusters.append(cluster)
+    return clusters
+
+
+def check_user_access(id_token, resource):
+    with timing.phase('acceso'):
+        user_claims = get_token_claims(id_token)
+        if user_claims:
+            return permissions.check(user_claims, resource)
+        else:
+            return False
 
 
 def get_token_claims(id_token):
-    verified_claims: dict = cognitojwt.decode(
-        id_token,
-        region,
-        user_pool_id
-    )
+    with timing.phase('jwt'):
+        verified_claims: dict = verifier.decode(id_token)
     return verified_claims
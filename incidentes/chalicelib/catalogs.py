@@ -0,0 +1,64 @@
+import threading
+import time
+
+from chalicelib import db
+
+versions_sql = """
+    SELECT tipo, version FROM VERSION_LISTA
+    """
+
+
+class CatalogCache:
+    # El contenido de cada catálogo se guarda hasta que cambia su versión en VERSION_LISTA, que es compartida por
+    # todos los contenedores y se consulta como mucho una vez por intervalo
+
+    def __init__(self, list_types, check_interval=10):
+        self.list_types = list_types
+        self.check_interval = check_interval
+        self.loads = 0
+        self._versions = {}
+        self._entries = {}
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _is_fresh(self):
+        return self._checked_at is not None and time.monotonic() - self._checked_at < self.check_interval
+
+    def refresh(self, force=False):
+        if not force and self._is_fresh():
+            return
+        with self._lock:
+            if not force and self._is_fresh():
+                return
+            with db.read_cursor() as cursor:
+                cursor.execute(versions_sql)
+                self._versions = {reg[0]: str(reg[1]) for reg in cursor}
+            self._checked_at = time.monotonic()
+
+    def version(self, list_type):
+        self.refresh()
+        return self._versions.get(list_type, '0')
+
+    def etag(self, list_type):
+        return '"%s-%s"' % (list_type, self.version(list_type))
+
+    def get(self, list_type, load):
+        version = self.version(list_type)
+        entry = self._entries.get(list_type)
+        if entry is None or entry['version'] != version:
+            entry = dict(load(list_type), version=version)
+            self._entries[list_type] = entry
+            self.loads += 1
+        return entry
+
+    def bump(self, list_types):
+        with db.cursor() as cursor:
+            cursor.execute("UPDATE VERSION_LISTA SET version = version + 1 WHERE tipo IN (%s)"
+                           % ','.join(':' + str(i) for i in range(len(list_types))),
+                           {str(i): list_types[i] for i in range(len(list_types))})
+        for list_type in list_types:
+            self._entries.pop(list_type, None)
+        self.refresh(force=True)
+
+    def stats(self):
+        return {'loads': self.loads, 'versions': dict(self._versions)}
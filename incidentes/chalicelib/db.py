@@ -0,0 +1,129 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from chalicelib import timing
+
+db_name = os.environ['DB_NAME']
+db_cluster_arn = os.environ['DB_CLUSTER_ARN']
+db_credentials_secret_arn = os.environ['DB_CREDENTIALS_SECRET_ARN']
+
+_client = None
+_client_lock = threading.Lock()
+_request = threading.local()
+
+stats = {
+    'clients_created': 0,
+    'clients_reused': 0,
+    'transactions_opened': 0,
+    'transactions_joined': 0,
+    'autocommit_reads': 0
+}
+
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            import boto3
+            _client = timing.instrument(boto3.client('rds-data'), 'db')
+            stats['clients_created'] += 1
+        else:
+            stats['clients_reused'] += 1
+        return _client
+
+
+def get_stats():
+    return dict(stats)
+
+
+class Transaction:
+    # La conexión (y la importación de aurora_data_api) se crea con el primer cursor
+
+    def __init__(self):
+        self._conn = None
+
+    @property
+    def connection(self):
+        if self._conn is None:
+            import aurora_data_api
+            self._conn = aurora_data_api.connect(aurora_cluster_arn=db_cluster_arn,
+                                                 secret_arn=db_credentials_secret_arn,
+                                                 database=db_name, rds_data_client=get_client())
+            stats['transactions_opened'] += 1
+        return self._conn
+
+    @property
+    def transaction_id(self):
+        return self._conn._transaction_id if self._conn is not None else None
+
+    def cursor(self):
+        return self.connection.cursor()
+
+    def commit(self):
+        if self._conn is not None:
+            self._conn.commit()
+
+    def rollback(self):
+        if self._conn is not None:
+            self._conn.rollback()
+
+
+@contextmanager
+def transaction():
+    # Las llamadas anidadas dentro del mismo request se unen a la transacción abierta
+    tx = getattr(_request, 'tx', None)
+    if tx is not None:
+        stats['transactions_joined'] += 1
+        yield tx
+        return
+    tx = Transaction()
+    _request.tx = tx
+    try:
+        yield tx
+    except BaseException:
+        tx.rollback()
+        raise
+    else:
+        tx.commit()
+    finally:
+        _request.tx = None
+
+
+@contextmanager
+def cursor():
+    with transaction() as tx:
+        with tx.cursor() as cur:
+            yield cur
+
+
+@contextmanager
+def read_cursor():
+    tx = getattr(_request, 'tx', None)
+    if tx is not None and tx.transaction_id is not None:
+        stats['transactions_joined'] += 1
+        with tx.cursor() as cur:
+            yield cur
+        return
+    # Una lectura fuera de una transacción ya iniciada se ejecuta en autocommit, sin begin/commit
+    import aurora_data_api
+    stats['autocommit_reads'] += 1
+    with aurora_data_api.AuroraDataAPICursor(client=get_client(), dbname=db_name, aurora_cluster_arn=db_cluster_arn,
+                                             secret_arn=db_credentials_secret_arn) as cur:
+        yield cur
+
+
+def execute_batch(sql, parameter_sets, page_size=1000):
+    generated_ids = []
+    with transaction() as tx:
+        with tx.cursor() as cur:
+            for start in range(0, len(parameter_sets), page_size):
+                res = get_client().batch_execute_statement(
+                    resourceArn=db_cluster_arn, secretArn=db_credentials_secret_arn, database=db_name, sql=sql,
+                    parameterSets=[[cur.prepare_param(k, v) for k, v in params.items()]
+                                   for params in parameter_sets[start:start + page_size]],
+                    transactionId=tx.transaction_id)
+                for result in res['updateResults']:
+                    fields = result.get('generatedFields')
+                    generated_ids.append(list(fields[0].values())[0] if fields else None)
+    return generated_ids
@@ -0,0 +1,197 @@
+import csv
+import gzip
+import io
+import json
+import os
+from urllib.parse import quote
+
+part_size = int(os.environ.get('EXPORT_PART_SIZE', str(8 * 1024 * 1024)))
+url_ttl = int(os.environ.get('EXPORT_URL_TTL', '3600'))
+formats = {
+    'ndjson': ('application/x-ndjson', '.ndjson'),
+    'csv': ('text/csv', '.csv')
+}
+
+
+class S3Upload:
+    # Las partes se suben a medida que se llenan, en memoria solo queda la parte en curso
+
+    def __init__(self, client, bucket, key, content_type):
+        self._client = client
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []
+
+    def write(self, data):
+        self._buffer.extend(data)
+        if len(self._buffer) >= part_size:
+            self._upload_part()
+        return len(data)
+
+    def _upload_part(self):
+        if self._upload_id is None:
+            self._upload_id = self._client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType=self.content_type)['UploadId']
+        number = len(self._parts) + 1
+        res = self._client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                       PartNumber=number, Body=bytes(self._buffer))
+        self._parts.append({'ETag': res['ETag'], 'PartNumber': number})
+        self._buffer = bytearray()
+
+    def close(self):
+        if self._upload_id is None:
+            # Un archivo menor que una parte se sube con una sola llamada
+            self._client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer),
+                                    ContentType=self.content_type)
+            return
+        if self._buffer:
+            self._upload_part()
+        self._client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                               MultipartUpload={'Parts': self._parts})
+
+    def abort(self):
+        if self._upload_id is not None:
+            self._client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+
+
+class S3Store:
+
+    def __init__(self, bucket, prefix=''):
+        self.bucket = bucket
+        self.prefix = prefix
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            self._client = boto3.client('s3')
+        return self._client
+
+    def open(self, key, content_type):
+        return S3Upload(self.client, self.bucket, self.prefix + key, content_type)
+
+    def put(self, key, data, content_type):
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data, ContentType=content_type)
+
+    def get(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)['Body'].read()
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+    def url(self, key):
+        return self.client.generate_presigned_url('get_object', Params={'Bucket': self.bucket,
+                                                                        'Key': self.prefix + key},
+                                                  ExpiresIn=url_ttl)
+
+
+class LocalUpload:
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path + '.parcial', 'wb')
+
+    def write(self, data):
+        return self._file.write(data)
+
+    def close(self):
+        self._file.close()
+        os.replace(self.path + '.parcial', self.path)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self.path + '.parcial')
+
+
+class LocalStore:
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key.replace('/', '_'))
+
+    def open(self, key, content_type):
+        return LocalUpload(self._path(key))
+
+    def put(self, key, data, content_type):
+        upload = LocalUpload(self._path(key))
+        upload.write(data)
+        upload.close()
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def url(self, key):
+        return 'file://' + quote(os.path.abspath(self._path(key)))
+
+
+def get_store(url):
+    if not url:
+        return None
+    if url.startswith('file://'):
+        return LocalStore(url[len('file://'):])
+    if url.startswith('s3://'):
+        bucket, _, prefix = url[len('s3://'):].partition('/')
+        return S3Store(bucket, prefix.rstrip('/') + '/' if prefix else '')
+    raise ValueError("El almacén de exportaciones no es válido: " + url)
+
+
+def object_key(export_id, formato, compress):
+    return 'exportaciones/' + export_id + formats[formato][1] + ('.gz' if compress else '')
+
+
+def manifest_key(export_id):
+    return 'exportaciones/' + export_id + '.json'
+
+
+def save_manifest(store, manifest):
+    store.put(manifest_key(manifest['id_exportacion']), json.dumps(manifest).encode('utf-8'), 'application/json')
+
+
+def load_manifest(store, export_id):
+    data = store.get(manifest_key(export_id))
+    return json.loads(data) if data is not None else None
+
+
+class ExportWriter:
+    # Serializa los registros por bloques hacia el objeto, opcionalmente comprimidos con gzip
+
+    def __init__(self, upload, formato, fields, compress=False):
+        self._upload = upload
+        self._stream = gzip.GzipFile(fileobj=upload, mode='wb') if compress else upload
+        self.formato = formato
+        self.fields = fields
+        self.rows = 0
+        if formato == 'csv':
+            self._write_csv([fields])
+
+    def _write_csv(self, rows):
+        text = io.StringIO()
+        csv.writer(text).writerows(rows)
+        self._stream.write(text.getvalue().encode('utf-8'))
+
+    def write_rows(self, rows):
+        if self.formato == 'csv':
+            self._write_csv([[row.get(field) for field in self.fields] for row in rows])
+        else:
+            self._stream.write(''.join(json.dumps(row, separators=(',', ':'), default=str) + '\n'
+                                       for row in rows).encode('utf-8'))
+        self.rows += len(rows)
+
+    def close(self):
+        if self._stream is not self._upload:
+            self._stream.close()
+        self._upload.close()
+
+    def abort(self):
+        self._upload.abort()
@@ -0,0 +1,86 @@
+import math
+import re
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+EARTH_RADIUS_M = 6371008.8
+max_precision = 9
+location_pattern = re.compile(r'^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$')
+
+
+def parse_location(location):
+    match = location_pattern.match(str(location)) if location is not None else None
+    if not match:
+        return None
+    lat, lon = float(match.group(1)), float(match.group(2))
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+
+def encode(lat, lon, precision=max_precision):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits, value, even = 0, 0, True
+    while len(chars) < precision:
+        interval, coord = (lon_range, lon) if even else (lat_range, lat)
+        mid = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    lat_bits = 5 * precision // 2
+    lon_bits = 5 * precision - lat_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def cover(min_lat, min_lon, max_lat, max_lon, max_cells=32):
+    # La precisión más fina cuyo número de celdas no supere max_cells, así el filtro por prefijo usa el índice
+    # sin convertirse en decenas de rangos
+    for precision in range(max_precision, 0, -1):
+        height, width = cell_size(precision)
+        rows = math.floor((max_lat + 90) / height) - math.floor((min_lat + 90) / height) + 1
+        columns = math.floor((max_lon + 180) / width) - math.floor((min_lon + 180) / width) + 1
+        if rows * columns <= max_cells or precision == 1:
+            break
+    first_lat = (math.floor((min_lat + 90) / height) + 0.5) * height - 90
+    first_lon = (math.floor((min_lon + 180) / width) + 0.5) * width - 180
+    prefixes = []
+    for row in range(rows):
+        for column in range(columns):
+            lat = min(first_lat + row * height, 90.0)
+            lon = first_lon + column * width
+            prefix = encode(lat, lon, precision)
+            if prefix not in prefixes:
+                prefixes.append(prefix)
+    return prefixes
+
+
+def bounding_box(lat, lon, radius_m):
+    delta_lat = math.degrees(radius_m / EARTH_RADIUS_M)
+    cos_lat = math.cos(math.radians(lat))
+    delta_lon = 180.0 if cos_lat < 1e-9 else min(180.0, delta_lat / cos_lat)
+    return (max(-90.0, lat - delta_lat), max(-180.0, lon - delta_lon),
+            min(90.0, lat + delta_lat), min(180.0, lon + delta_lon))
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + \
+        math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def zoom_precision(zoom):
+    # Una celda de geohash por cada bloque de pocos píxeles del mapa en cada nivel de zoom
+    return max(1, min(max_precision - 1, (int(zoom) * 2 + 4) // 5))
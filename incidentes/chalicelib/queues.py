@@ -0,0 +1,80 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+Message = namedtuple('Message', ['receipt', 'body'])
+
+
+class SQSQueue:
+
+    def __init__(self, queue_url):
+        self.queue_url = queue_url
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            self._client = boto3.client('sqs')
+        return self._client
+
+    def send(self, body):
+        self.client.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(body))
+
+    def receive(self, max_messages=10):
+        res = self.client.receive_message(QueueUrl=self.queue_url, MaxNumberOfMessages=min(max_messages, 10),
+                                          WaitTimeSeconds=0)
+        return [Message(m['ReceiptHandle'], json.loads(m['Body'])) for m in res.get('Messages', [])]
+
+    def delete(self, receipts):
+        for start in range(0, len(receipts), 10):
+            self.client.delete_message_batch(QueueUrl=self.queue_url, Entries=[
+                {'Id': str(i), 'ReceiptHandle': receipt} for i, receipt in enumerate(receipts[start:start + 10])])
+
+
+class SQLiteQueue:
+
+    def __init__(self, path=':memory:', visibility_timeout=30):
+        self.visibility_timeout = visibility_timeout
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS cola (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                cuerpo TEXT NOT NULL,
+                visible_en REAL NOT NULL
+            )""")
+
+    def send(self, body):
+        with self._lock:
+            self._conn.execute("INSERT INTO cola (cuerpo, visible_en) VALUES (?, ?)", (json.dumps(body), 0))
+
+    def receive(self, max_messages=10):
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute("SELECT id, cuerpo FROM cola WHERE visible_en <= ? ORDER BY id LIMIT ?",
+                                      (now, max_messages)).fetchall()
+            # Igual que en SQS, un mensaje recibido queda oculto hasta que se borre o venza el plazo
+            self._conn.executemany("UPDATE cola SET visible_en = ? WHERE id = ?",
+                                   [(now + self.visibility_timeout, row[0]) for row in rows])
+        return [Message(str(row[0]), json.loads(row[1])) for row in rows]
+
+    def delete(self, receipts):
+        with self._lock:
+            self._conn.executemany("DELETE FROM cola WHERE id = ?", [(int(r),) for r in receipts])
+
+    def size(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cola").fetchone()[0]
+
+
+def get_queue(url):
+    if not url:
+        return None
+    if url.startswith('memory://'):
+        return SQLiteQueue()
+    if url.startswith('sqlite:///'):
+        return SQLiteQueue(url[len('sqlite:///'):])
+    return SQSQueue(url)
@@ -0,0 +1,141 @@
+import threading
+import time
+
+from chalicelib import db
+from chalicelib.cache import TTLCache
+
+# ROL_RECURSO y RECURSO no tienen marca de actualización, la suma de CRC32 cambia con cualquier alta, baja o
+# cambio de path y cuesta un recorrido de tablas de pocas filas
+version_sql = """
+    SELECT COUNT(*), COALESCE(SUM(CRC32(CONCAT(rr.id_rol, ':', re.path))), 0)
+    FROM ROL_RECURSO rr, RECURSO re
+    WHERE rr.id_recurso = re.id
+    """
+roles_sql = """
+    SELECT rr.id_rol, re.path
+    FROM ROL_RECURSO rr, RECURSO re
+    WHERE rr.id_recurso = re.id
+    ORDER BY rr.id_rol, rr.id_recurso
+    """
+# Solo interesan los cambios más recientes que la vida máxima de un token de identidad
+role_changes_sql = """
+    SELECT correo, MAX(id)
+    FROM CAMBIO_ROL
+    WHERE fecha > NOW() - INTERVAL :horas HOUR
+    GROUP BY correo
+    """
+# El rol vigente y la versión de su último cambio, la caché se descarta cuando el historial trae otra versión
+user_role_sql = """
+    SELECT u.id_rol, (SELECT MAX(c.id) FROM CAMBIO_ROL c WHERE c.correo = u.correo)
+    FROM USUARIO u
+    WHERE u.correo = :email
+    """
+
+
+def is_newer(version, known):
+    return version.isdigit() and (known is None or int(version) > int(known))
+
+
+class PermissionIndex:
+
+    def __init__(self, check_interval=30, cache_size=1024, cache_ttl=60, token_max_age_hours=24):
+        self.check_interval = check_interval
+        self.token_max_age_hours = token_max_age_hours
+        self.user_roles = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.version = None
+        self.loads = 0
+        self.claim_hits = 0
+        self._role_changes = {}
+        self._paths = {}
+        self._resources = {}
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _is_fresh(self):
+        return self._checked_at is not None and time.monotonic() - self._checked_at < self.check_interval
+
+    def refresh(self, force=False):
+        if not force and self._is_fresh():
+            return
+        with self._lock:
+            if not force and self._is_fresh():
+                return
+            with db.read_cursor() as cursor:
+                cursor.execute(version_sql)
+                version = '%d-%d' % tuple(cursor.fetchone())
+                if version != self.version:
+                    paths = {}
+                    cursor.execute(roles_sql)
+                    for reg in cursor:
+                        paths.setdefault(reg[0], []).append(reg[1])
+                    self._paths = {id_rol: tuple(role_paths) for id_rol, role_paths in paths.items()}
+                    self._resources = {id_rol: frozenset(role_paths) for id_rol, role_paths in paths.items()}
+                    self.version = version
+                    self.loads += 1
+                cursor.execute(role_changes_sql, {"horas": self.token_max_age_hours})
+                self._role_changes = {reg[0]: str(reg[1]) for reg in cursor}
+            self._checked_at = time.monotonic()
+
+    def _user_state(self, email, reload=False):
+        state = None if reload else self.user_roles.get(email)
+        # Un cambio de rol hecho desde otro contenedor aparece en el historial reciente con otra versión
+        if state is not None and self._role_changes.get(email, state[1]) != state[1]:
+            state = None
+        if state is None:
+            with db.read_cursor() as cursor:
+                cursor.execute(user_role_sql, {"email": email})
+                reg = cursor.fetchone()
+            if reg is None:
+                return None
+            state = (reg[0], str(reg[1]) if reg[1] is not None else None)
+            self.user_roles.set(email, state)
+        return state
+
+    def role_of(self, email):
+        state = self._user_state(email)
+        return state[0] if state is not None else None
+
+    def resources(self, id_rol):
+        self.refresh()
+        return self._paths.get(id_rol, ())
+
+    def allows_role(self, id_rol, resource):
+        self.refresh()
+        return resource in self._resources.get(id_rol, ())
+
+    def allows(self, email, resource):
+        id_rol = self.role_of(email)
+        return id_rol is not None and self.allows_role(id_rol, resource)
+
+    def _in_window(self, claims):
+        issued_at = claims.get('iat')
+        return isinstance(issued_at, (int, float)) and time.time() - issued_at < self.token_max_age_hours * 3600
+
+    def check(self, claims, resource):
+        email = claims.get('email')
+        id_rol = claims.get('custom:id_rol')
+        version = claims.get('custom:version_rol')
+        if id_rol and id_rol.isdigit() and version and self._in_window(claims):
+            self.refresh()
+            # Solo stamp_user_role escribe custom:id_rol y custom:version_rol, junto con su fila en CAMBIO_ROL, y el
+            # cliente de la app no tiene permiso de escritura sobre ellos. Si el correo no tuvo cambios durante la
+            # vida del token, o el último es el que trae el token, el rol del token es el vigente
+            known = self._role_changes.get(email, version)
+            if known == version:
+                self.claim_hits += 1
+                return self.allows_role(int(id_rol), resource)
+            # Un token anterior al último cambio se evalúa con el rol de la base de datos; si trae un cambio que el
+            # historial aún no tiene, se vuelve a leer antes de decidir
+            state = self._user_state(email, reload=is_newer(version, known))
+            return state is not None and self.allows_role(state[0], resource)
+        return self.allows(email, resource)
+
+    def forget(self, email):
+        # Hasta la siguiente lectura del historial, los tokens del correo no se aceptan por sus atributos
+        with self._lock:
+            self._role_changes = dict(self._role_changes, **{email: None})
+        self.user_roles.discard(email)
+
+    def stats(self):
+        return {**self.user_roles.stats(), 'version': self.version, 'loads': self.loads,
+                'roles': len(self._resources), 'claim_hits': self.claim_hits}
@@ -0,0 +1,48 @@
+import argparse
+import json
+import os
+import sys
+import warnings
+
+import pytest
+
+service_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(service_dir), 'tools'))
+
+import benchmark  # noqa: E402
+
+args = argparse.Namespace(db_latency=0, cognito_latency=0, users=10, incidents=50, no_role_claims=False,
+                          timing_sample_rate=0)
+
+
+class Service:
+    """Servicio de incidentes sobre los falsos del benchmark, con colas en memoria."""
+
+    def __init__(self, env, module, client):
+        self.env = env
+        self.module = module
+        self.client = client
+        self.conn = env.data_api.conn
+
+    def request(self, method, path, body=None, token='ciudadano', **headers):
+        headers.update({'Content-Type': 'application/json', 'Authorization': 'Bearer ' + self.env.tokens[token]})
+        response = self.client.http.request(method, path, headers=headers,
+                                            body=json.dumps(body).encode('utf-8') if body is not None else b'')
+        return response.status_code, json.loads(response.body)
+
+
+@pytest.fixture
+def service(tmp_path):
+    from chalice.test import Client
+    warnings.simplefilter('ignore')
+    environ = dict(os.environ)
+    try:
+        env = benchmark.Environment(args, str(tmp_path))
+        # Bloques pequeños para que una exportación de todo el año se escriba en varias partes
+        os.environ.update(EXPORT_QUEUE_URL='memory://', EXPORT_CHUNK_SIZE='7')
+        module = env.load('incidentes')
+        with Client(module.app) as client:
+            yield Service(env, module, client)
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
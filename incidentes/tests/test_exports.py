@@ -0,0 +1,54 @@
+import json
+import os
+from urllib.parse import unquote, urlparse
+
+year = {"fecha_inicial": "2021-01-01", "fecha_final": "2021-12-31"}
+
+
+def export_status(service, export_id):
+    status, body = service.request('GET', '/admin/incidentes/exportaciones/' + export_id, token='admin')
+    assert status == 200
+    return body['data']
+
+
+def test_large_range_export_completes(service):
+    # Un año supera EXPORT_SYNC_MAX_DAYS, con cola la petición solo deja el trabajo pendiente
+    status, body = service.request('POST', '/admin/incidentes/exportaciones', year, token='admin')
+    assert status == 202
+    export_id = body['data']['id_exportacion']
+    assert export_status(service, export_id)['estado'] == 'pendiente'
+
+    assert service.module.drain_export_queue() == 1
+    handle = export_status(service, export_id)
+    total = service.conn.execute("SELECT COUNT(*) FROM INCIDENTE WHERE fecha >= '2021-01-01' "
+                                 "AND fecha < '2022-01-01'").fetchone()[0]
+    assert handle['estado'] == 'completada'
+    assert handle['registros'] == total
+    with open(unquote(urlparse(handle['url']).path)) as f:
+        rows = [json.loads(line) for line in f]
+    assert len(rows) == total
+    assert len({row['id'] for row in rows}) == total
+    assert service.module.export_queue.size() == 0
+
+
+def test_failed_export_reports_error(service, monkeypatch):
+    chunks_db = service.module.get_incident_chunks_db
+
+    def failing_chunks(job, chunk_size):
+        # El primer bloque alcanza a escribirse antes de que falle la lectura
+        yield next(chunks_db(job, chunk_size))
+        raise RuntimeError("Se perdió la conexión con la base de datos")
+
+    monkeypatch.setattr(service.module, 'get_incident_chunks_db', failing_chunks)
+    status, body = service.request('POST', '/admin/incidentes/exportaciones', year, token='admin')
+    assert status == 202
+    export_id = body['data']['id_exportacion']
+
+    assert service.module.drain_export_queue() == 1
+    handle = export_status(service, export_id)
+    assert handle['estado'] == 'error'
+    assert 'url' not in handle
+    # El mensaje queda en la cola para que se reintente al vencer el plazo de visibilidad
+    assert service.module.export_queue.size() == 1
+    assert not [name for name in os.listdir(service.module.export_store.directory)
+                if not name.endswith('.json')]
@@ -0,0 +1,83 @@
+import pytest
+from benchmark import incident
+
+# Un municipio que ya no existe cuando el consumidor procesa el mensaje, la base de datos rechaza la fila
+reject_trigger = """
+    CREATE TRIGGER municipio_inexistente BEFORE INSERT ON INCIDENTE
+    WHEN NEW.id_municipio NOT IN (SELECT id FROM MUNICIPIO)
+    BEGIN SELECT RAISE(ABORT, 'Cannot add or update a child row: a foreign key constraint fails'); END
+"""
+
+
+@pytest.fixture
+def queue(service):
+    service.conn.execute(reject_trigger)
+    return service
+
+
+def tracking(service, tracking_id):
+    status, body = service.request('GET', '/incidentes/seguimiento/' + tracking_id)
+    assert status == 200
+    return body['data']['estado'], body['data']['id_incidente']
+
+
+def incident_count(service, tracking_id):
+    return service.conn.execute("SELECT COUNT(*) FROM INCIDENTE WHERE id_seguimiento = ?",
+                                (tracking_id,)).fetchone()[0]
+
+
+def stats_total(service):
+    return service.conn.execute("SELECT COALESCE(SUM(total), 0) FROM ESTADISTICA_INCIDENTE").fetchone()[0]
+
+
+def test_accepted_incident(queue):
+    status, body = queue.request('POST', '/incidentes', incident(1), Prefer='respond-async')
+    assert status == 202
+    tracking_id = body['data']['id_seguimiento']
+    assert tracking(queue, tracking_id) == ('pendiente', None)
+
+    before = stats_total(queue)
+    assert queue.module.drain_incident_queue() == 1
+    estado, id_incident = tracking(queue, tracking_id)
+    assert estado == 'creado' and id_incident is not None
+    assert stats_total(queue) == before + 1
+    assert queue.module.incident_queue.size() == 0
+
+
+def test_duplicate_delivery(queue):
+    message = {"id_seguimiento": 'a' * 32, "incidente": incident(2)}
+    before = stats_total(queue)
+    # La cola entrega el mismo mensaje dos veces, en el mismo lote y en uno posterior
+    queue.module.incident_queue.send(message)
+    queue.module.incident_queue.send(message)
+    assert queue.module.drain_incident_queue() == 2
+    queue.module.incident_queue.send(message)
+    assert queue.module.drain_incident_queue() == 1
+
+    assert tracking(queue, 'a' * 32)[0] == 'creado'
+    assert incident_count(queue, 'a' * 32) == 1
+    assert stats_total(queue) == before + 1
+
+
+def test_rejected_message_falls_back_per_message(queue):
+    accepted = {"id_seguimiento": 'b' * 32, "incidente": incident(3)}
+    rejected = {"id_seguimiento": 'c' * 32, "incidente": dict(incident(4), id_municipio=999)}
+    before = stats_total(queue)
+    queue.module.incident_queue.send(accepted)
+    queue.module.incident_queue.send(rejected)
+    assert queue.module.drain_incident_queue() == 2
+
+    # El lote se deshace y se reintenta mensaje por mensaje, solo el rechazado queda sin incidente
+    assert tracking(queue, 'b' * 32)[0] == 'creado'
+    assert incident_count(queue, 'b' * 32) == 1
+    assert tracking(queue, 'c' * 32) == ('rechazado', None)
+    motivo = queue.conn.execute("SELECT motivo FROM INCIDENTE_RECHAZADO WHERE id_seguimiento = ?",
+                                ('c' * 32,)).fetchone()[0]
+    assert 'foreign key' in motivo
+    assert stats_total(queue) == before + 1
+    assert queue.module.incident_queue.size() == 0
+
+    # Una nueva entrega del mensaje rechazado no lo vuelve a intentar
+    queue.module.incident_queue.send(rejected)
+    assert queue.module.drain_incident_queue() == 1
+    assert queue.conn.execute("SELECT COUNT(*) FROM INCIDENTE_RECHAZADO").fetchone()[0] == 1
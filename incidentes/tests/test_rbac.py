@@ -0,0 +1,71 @@
+import time
+
+from fakes import user_email
+
+admin_resource = 'GET/admin/incidentes'
+citizen_resource = 'POST/incidentes'
+
+
+def claims(n, id_rol, version, **extra):
+    return dict({'email': user_email(n), 'custom:id_rol': str(id_rol), 'custom:version_rol': str(version),
+                 'iat': int(time.time())}, **extra)
+
+
+def change_role(service, n, id_rol):
+    # Lo que hace stamp_user_role desde otro contenedor: la fila de USUARIO y una versión nueva en CAMBIO_ROL
+    service.conn.execute("UPDATE USUARIO SET id_rol = ? WHERE correo = ?", (id_rol, user_email(n)))
+    service.conn.execute("INSERT INTO CAMBIO_ROL (correo, id_rol) VALUES (?, ?)", (user_email(n), id_rol))
+    return service.conn.execute("SELECT MAX(id) FROM CAMBIO_ROL").fetchone()[0]
+
+
+def db_calls(service, check):
+    before = service.env.data_api.total_calls()
+    result = check()
+    return result, service.env.data_api.total_calls() - before
+
+
+def test_claims_skip_user_lookup(service):
+    permissions = service.module.permissions
+    permissions.refresh(force=True)
+    # Usuarios que este contenedor no ha visto: con los atributos del token no se consulta USUARIO
+    for n in range(3, 8):
+        assert db_calls(service, lambda: permissions.check(claims(n, 2, n), citizen_resource)) == (True, 0)
+        assert db_calls(service, lambda: permissions.check(claims(n, 2, n), admin_resource)) == (False, 0)
+    for n in range(8, 10):
+        allowed, calls = db_calls(service, lambda: permissions.check({'email': user_email(n)}, citizen_resource))
+        assert allowed and calls == 1
+
+
+def test_token_before_role_change_uses_database(service):
+    permissions = service.module.permissions
+    change_role(service, 3, 1)
+    version = change_role(service, 3, 2)
+    permissions.refresh(force=True)
+    # El token se emitió cuando el usuario era administrador, el historial tiene un cambio posterior
+    assert not permissions.check(claims(3, 1, version - 1), admin_resource)
+    assert permissions.check(claims(3, 2, version), citizen_resource)
+
+
+def test_token_with_newer_change_rereads_role(service):
+    permissions = service.module.permissions
+    permissions.refresh(force=True)
+    # El cambio ocurrió después de la última lectura del historial, el token trae la versión nueva
+    version = change_role(service, 4, 1)
+    assert db_calls(service, lambda: permissions.check(claims(4, 1, version), admin_resource))[0]
+
+
+def test_forged_or_stale_claims_are_not_trusted(service):
+    permissions = service.module.permissions
+    permissions.refresh(force=True)
+    old_token = claims(5, 2, 5, iat=int(time.time()) - permissions.token_max_age_hours * 3600 - 1)
+    assert db_calls(service, lambda: permissions.check(old_token, citizen_resource))[1] == 1
+    assert not permissions.check(claims(5, 'administrador', 5), admin_resource)
+
+
+def test_local_role_change_is_seen_before_next_refresh(service):
+    permissions = service.module.permissions
+    permissions.refresh(force=True)
+    assert permissions.check(claims(6, 2, 6), citizen_resource)
+    service.conn.execute("UPDATE USUARIO SET id_rol = NULL WHERE correo = ?", (user_email(6),))
+    permissions.forget(user_email(6))
+    assert not permissions.check(claims(6, 2, 6), citizen_resource)
@@ -0,0 +1,5 @@
+-- Rango de fechas por municipio, ordenado por (fecha, id) para la paginación por cursor
+CREATE INDEX idx_incidente_municipio_fecha ON INCIDENTE (id_municipio, fecha);
+
+-- Mismo rango filtrando además por tipo de incidente
+CREATE INDEX idx_incidente_municipio_tipo_fecha ON INCIDENTE (id_municipio, id_tipo_incidente, fecha);
@@ -0,0 +1,6 @@
+-- Búsqueda de usuarios por correo (check_user_access, perfil, creación de incidentes)
+CREATE INDEX idx_usuario_correo ON USUARIO (correo);
+
+-- Recursos asignados a un rol y búsqueda de recurso por path
+CREATE INDEX idx_rol_recurso_rol ON ROL_RECURSO (id_rol, id_recurso);
+CREATE INDEX idx_recurso_path ON RECURSO (path);
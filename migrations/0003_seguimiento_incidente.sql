@@ -0,0 +1,4 @@
+-- Identificador de seguimiento de los incidentes recibidos en modo asíncrono.
+-- El índice único hace idempotente la inserción cuando la cola entrega un mensaje más de una vez.
+ALTER TABLE INCIDENTE ADD COLUMN id_seguimiento CHAR(32) NULL;
+CREATE UNIQUE INDEX uq_incidente_seguimiento ON INCIDENTE (id_seguimiento);
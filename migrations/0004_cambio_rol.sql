@@ -0,0 +1,10 @@
+-- Historial de asignaciones de rol. El id del último cambio de cada usuario se copia a Cognito como
+-- custom:version_rol, así un token emitido antes de un cambio de rol o de la eliminación del usuario se
+-- reconoce como desactualizado sin consultar USUARIO. id_rol es NULL cuando el usuario se elimina.
+CREATE TABLE CAMBIO_ROL (
+    id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    correo VARCHAR(255) NOT NULL,
+    id_rol INT NULL,
+    fecha DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX idx_cambio_rol_fecha ON CAMBIO_ROL (fecha, correo);
@@ -0,0 +1,10 @@
+-- Conteo diario de incidentes por municipio y tipo, lo mantiene incidentes en cada inserción.
+-- Para llenarlo con el histórico: python migrate.py rebuild-stats
+CREATE TABLE ESTADISTICA_INCIDENTE (
+    id_municipio INT NOT NULL,
+    id_tipo_incidente INT NOT NULL,
+    dia DATE NOT NULL,
+    total INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (id_municipio, dia, id_tipo_incidente)
+);
+CREATE INDEX idx_estadistica_incidente_dia ON ESTADISTICA_INCIDENTE (dia);
@@ -0,0 +1,17 @@
+-- Coordenadas de los incidentes en columnas consultables. El geohash (precisión 9, unos 5 m) con índice B-tree
+-- permite buscar por área con rangos de prefijo, ubicacion se conserva tal como la envía el cliente.
+ALTER TABLE INCIDENTE
+    ADD COLUMN latitud DOUBLE NULL,
+    ADD COLUMN longitud DOUBLE NULL,
+    ADD COLUMN geohash CHAR(9) NULL;
+CREATE INDEX idx_incidente_geohash ON INCIDENTE (geohash);
+
+-- Histórico: solo las ubicaciones con formato "latitud,longitud" dentro de rango
+UPDATE INCIDENTE
+SET latitud = CAST(TRIM(SUBSTRING_INDEX(ubicacion, ',', 1)) AS DECIMAL(10, 7)),
+    longitud = CAST(TRIM(SUBSTRING_INDEX(ubicacion, ',', -1)) AS DECIMAL(10, 7))
+WHERE ubicacion REGEXP '^ *-?[0-9]+(\\.[0-9]+)? *, *-?[0-9]+(\\.[0-9]+)? *$';
+UPDATE INCIDENTE SET latitud = NULL, longitud = NULL
+WHERE latitud NOT BETWEEN -90 AND 90 OR longitud NOT BETWEEN -180 AND 180;
+UPDATE INCIDENTE SET geohash = ST_GeoHash(longitud, latitud, 9)
+WHERE latitud IS NOT NULL AND geohash IS NULL;
@@ -0,0 +1,5 @@
+-- Momento de la última escritura de cada incidente, ordena el feed de cambios de los tableros.
+-- Las filas existentes toman la hora del ALTER y el índice (actualizado, id) es el orden del cursor del feed.
+ALTER TABLE INCIDENTE
+    ADD COLUMN actualizado TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3) ON UPDATE CURRENT_TIMESTAMP(3);
+CREATE INDEX idx_incidente_actualizado ON INCIDENTE (actualizado, id);
@@ -0,0 +1,4 @@
+-- Índice de texto completo sobre el relato de los hechos para la búsqueda q= del listado de incidentes.
+-- InnoDB ignora los términos de menos de innodb_ft_min_token_size (3) caracteres y su lista de palabras vacías es
+-- en inglés. Para excluir las del español se configura innodb_ft_server_stopword_table en el grupo de parámetros.
+ALTER TABLE INCIDENTE ADD FULLTEXT INDEX ftx_incidente_hechos (hechos);
@@ -0,0 +1,7 @@
+-- Mensajes de la cola de incidentes cuya fila rechazó la base de datos (municipio o tipo inexistente).
+-- Reintentarlos fallaría igual, así el seguimiento informa el estado rechazado en lugar de quedar pendiente.
+CREATE TABLE INCIDENTE_RECHAZADO (
+    id_seguimiento CHAR(32) NOT NULL PRIMARY KEY,
+    motivo VARCHAR(255) NOT NULL,
+    fecha DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
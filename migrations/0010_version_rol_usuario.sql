@@ -0,0 +1,3 @@
+-- Versión vigente del rol de cada usuario (último CAMBIO_ROL por correo). Los atributos custom:id_rol y
+-- custom:version_rol del token solo se aceptan si coinciden con ella.
+CREATE INDEX idx_cambio_rol_correo ON CAMBIO_ROL (correo, id);
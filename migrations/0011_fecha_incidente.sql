@@ -0,0 +1,3 @@
+-- Rango de fechas sin municipio (exportaciones de todo el departamento), en el orden (fecha, id) del cursor.
+-- Sin este índice cada bloque de la exportación recorre la tabla completa y la ordena.
+CREATE INDEX idx_incidente_fecha ON INCIDENTE (fecha, id);
@@ -0,0 +1,69 @@
+-- Recursos de las rutas agregadas después del esquema base, check_user_access los exige como método + path.
+-- Cada ruta se asigna a los roles que ya tienen la ruta base equivalente, así no se fijan ids de rol por ambiente.
+-- Las sentencias se pueden repetir sin duplicar filas.
+
+-- Invalidación de catálogos: roles con acceso al listado de incidentes del panel
+INSERT INTO RECURSO (nombre, path)
+SELECT 'Invalidar catálogos', 'POST/admin/listas' FROM DUAL
+WHERE NOT EXISTS (SELECT 1 FROM RECURSO WHERE path = 'POST/admin/listas');
+INSERT INTO ROL_RECURSO (id_rol, id_recurso)
+SELECT DISTINCT rr.id_rol, nuevo.id
+FROM ROL_RECURSO rr, RECURSO base, RECURSO nuevo
+WHERE rr.id_recurso = base.id AND base.path = 'GET/admin/incidentes' AND nuevo.path = 'POST/admin/listas'
+AND NOT EXISTS (SELECT 1 FROM ROL_RECURSO x WHERE x.id_rol = rr.id_rol AND x.id_recurso = nuevo.id);
+
+-- Lotes de incidentes de los centros de llamadas: roles con acceso al listado de incidentes del panel
+INSERT INTO RECURSO (nombre, path)
+SELECT 'Registrar lote de incidentes', 'POST/incidentes/lote' FROM DUAL
+WHERE NOT EXISTS (SELECT 1 FROM RECURSO WHERE path = 'POST/incidentes/lote');
+INSERT INTO ROL_RECURSO (id_rol, id_recurso)
+SELECT DISTINCT rr.id_rol, nuevo.id
+FROM ROL_RECURSO rr, RECURSO base, RECURSO nuevo
+WHERE rr.id_recurso = base.id AND base.path = 'GET/admin/incidentes' AND nuevo.path = 'POST/incidentes/lote'
+AND NOT EXISTS (SELECT 1 FROM ROL_RECURSO x WHERE x.id_rol = rr.id_rol AND x.id_recurso = nuevo.id);
+
+-- Seguimiento de incidentes asíncronos: todos los roles que pueden registrar incidentes, ciudadanos incluidos
+INSERT INTO RECURSO (nombre, path)
+SELECT 'Consultar seguimiento de incidente', 'GET/incidentes/seguimiento' FROM DUAL
+WHERE NOT EXISTS (SELECT 1 FROM RECURSO WHERE path = 'GET/incidentes/seguimiento');
+INSERT INTO ROL_RECURSO (id_rol, id_recurso)
+SELECT DISTINCT rr.id_rol, nuevo.id
+FROM ROL_RECURSO rr, RECURSO base, RECURSO nuevo
+WHERE rr.id_recurso = base.id AND base.path = 'POST/incidentes' AND nuevo.path = 'GET/incidentes/seguimiento'
+AND NOT EXISTS (SELECT 1 FROM ROL_RECURSO x WHERE x.id_rol = rr.id_rol AND x.id_recurso = nuevo.id);
+
+-- Exportaciones de incidentes: roles con acceso al listado de incidentes del panel
+INSERT INTO RECURSO (nombre, path)
+SELECT 'Crear exportación de incidentes', 'POST/admin/incidentes/exportaciones' FROM DUAL
+WHERE NOT EXISTS (SELECT 1 FROM RECURSO WHERE path = 'POST/admin/incidentes/exportaciones');
+INSERT INTO ROL_RECURSO (id_rol, id_recurso)
+SELECT DISTINCT rr.id_rol, nuevo.id
+FROM ROL_RECURSO rr, RECURSO base, RECURSO nuevo
+WHERE rr.id_recurso = base.id AND base.path = 'GET/admin/incidentes' AND nuevo.path = 'POST/admin/incidentes/exportaciones'
+AND NOT EXISTS (SELECT 1 FROM ROL_RECURSO x WHERE x.id_rol = rr.id_rol AND x.id_recurso = nuevo.id);
+INSERT INTO RECURSO (nombre, path)
+SELECT 'Consultar exportación de incidentes', 'GET/admin/incidentes/exportaciones' FROM DUAL
+WHERE NOT EXISTS (SELECT 1 FROM RECURSO WHERE path = 'GET/admin/incidentes/exportaciones');
+INSERT INTO ROL_RECURSO (id_rol, id_recurso)
+SELECT DISTINCT rr.id_rol, nuevo.id
+FROM ROL_RECURSO rr, RECURSO base, RECURSO nuevo
+WHERE rr.id_recurso = base.id AND base.path = 'GET/admin/incidentes' AND nuevo.path = 'GET/admin/incidentes/exportaciones'
+AND NOT EXISTS (SELECT 1 FROM ROL_RECURSO x WHERE x.id_rol = rr.id_rol AND x.id_recurso = nuevo.id);
+
+-- Altas y bajas de usuarios por lote: roles que ya crean o eliminan usuarios uno a uno
+INSERT INTO RECURSO (nombre, path)
+SELECT 'Crear lote de usuarios', 'POST/admin/usuarios/lote' FROM DUAL
+WHERE NOT EXISTS (SELECT 1 FROM RECURSO WHERE path = 'POST/admin/usuarios/lote');
+INSERT INTO ROL_RECURSO (id_rol, id_recurso)
+SELECT DISTINCT rr.id_rol, nuevo.id
+FROM ROL_RECURSO rr, RECURSO base, RECURSO nuevo
+WHERE rr.id_recurso = base.id AND base.path = 'POST/admin/usuarios' AND nuevo.path = 'POST/admin/usuarios/lote'
+AND NOT EXISTS (SELECT 1 FROM ROL_RECURSO x WHERE x.id_rol = rr.id_rol AND x.id_recurso = nuevo.id);
+INSERT INTO RECURSO (nombre, path)
+SELECT 'Eliminar lote de usuarios', 'DELETE/admin/usuarios/lote' FROM DUAL
+WHERE NOT EXISTS (SELECT 1 FROM RECURSO WHERE path = 'DELETE/admin/usuarios/lote');
+INSERT INTO ROL_RECURSO (id_rol, id_recurso)
+SELECT DISTINCT rr.id_rol, nuevo.id
+FROM ROL_RECURSO rr, RECURSO base, RECURSO nuevo
+WHERE rr.id_recurso = base.id AND base.path = 'DELETE/admin/usuarios' AND nuevo.path = 'DELETE/admin/usuarios/lote'
+AND NOT EXISTS (SELECT 1 FROM ROL_RECURSO x WHERE x.id_rol = rr.id_rol AND x.id_recurso = nuevo.id);
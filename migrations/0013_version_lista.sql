@@ -0,0 +1,8 @@
+-- Versión compartida de cada catálogo de /listas. El ETag sale de esta fila y cada contenedor la consulta cada
+-- LIST_CHECK_INTERVAL segundos. Al editar MUNICIPIO, TIPO_INCIDENTE, TERMINOS_CONDICIONES o ROL se llama
+-- POST /admin/listas/{tipo_lista}/invalidar, que suma uno a la versión.
+CREATE TABLE VERSION_LISTA (
+    tipo VARCHAR(32) NOT NULL PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 1
+);
+INSERT INTO VERSION_LISTA (tipo) VALUES ('municipios'), ('incidentes'), ('terminos'), ('roles');
@@ -0,0 +1,277 @@
+import argparse
+import json
+import os
+import re
+import sys
+
+import aurora_data_api
+
+migrations_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(migrations_dir)
+
+migration_table = """
+CREATE TABLE IF NOT EXISTS SCHEMA_MIGRACION (
+    version INT NOT NULL PRIMARY KEY,
+    nombre VARCHAR(255) NOT NULL,
+    aplicada_en DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+hot_queries = {
+    'incidentes_por_rango': ("""
+        SELECT i.id, i.hechos, i.ubicacion, i.fecha, i.id_tipo_incidente, ti.descripcion, i.id_municipio, m.nombre
+        FROM INCIDENTE i, MUNICIPIO m, TIPO_INCIDENTE ti
+        WHERE i.id_municipio = m.id AND i.id_tipo_incidente = ti.id
+        AND i.fecha >= STR_TO_DATE(:fecha_inicial,'%Y-%m-%d')
+        AND i.fecha < STR_TO_DATE(:fecha_final,'%Y-%m-%d') + INTERVAL 1 DAY
+        AND i.id_municipio = :id_municipio
+        ORDER BY i.fecha, i.id LIMIT 201
+        """, {"fecha_inicial": "2021-01-01", "fecha_final": "2021-12-31", "id_municipio": 1}),
+    'incidentes_por_rango_y_tipo': ("""
+        SELECT i.id, i.fecha
+        FROM INCIDENTE i
+        WHERE i.fecha >= STR_TO_DATE(:fecha_inicial,'%Y-%m-%d')
+        AND i.fecha < STR_TO_DATE(:fecha_final,'%Y-%m-%d') + INTERVAL 1 DAY
+        AND i.id_municipio = :id_municipio AND i.id_tipo_incidente = :id_tipo_incidente
+        ORDER BY i.fecha, i.id LIMIT 201
+        """, {"fecha_inicial": "2021-01-01", "fecha_final": "2021-12-31", "id_municipio": 1,
+              "id_tipo_incidente": 1}),
+    'exportacion_por_rango': ("""
+        SELECT i.id, i.fecha
+        FROM INCIDENTE i
+        WHERE i.fecha >= STR_TO_DATE(:fecha_inicial,'%Y-%m-%d')
+        AND i.fecha < STR_TO_DATE(:fecha_final,'%Y-%m-%d') + INTERVAL 1 DAY
+        AND (i.fecha > :cursor_fecha OR (i.fecha = :cursor_fecha AND i.id > :cursor_id))
+        ORDER BY i.fecha, i.id LIMIT 1001
+        """, {"fecha_inicial": "2021-01-01", "fecha_final": "2021-12-31", "cursor_fecha": "2021-06-01 00:00:00",
+              "cursor_id": 0}),
+    'rol_usuario': ("""
+        SELECT u.id_rol, (SELECT MAX(c.id) FROM CAMBIO_ROL c WHERE c.correo = u.correo)
+        FROM USUARIO u
+        WHERE u.correo = :email
+        """, {"email": "admin@example.com"}),
+    'version_permisos': ("""
+        SELECT COUNT(*), COALESCE(SUM(CRC32(CONCAT(rr.id_rol, ':', re.path))), 0)
+        FROM ROL_RECURSO rr, RECURSO re
+        WHERE rr.id_recurso = re.id
+        """, {}),
+    'estadisticas_por_rango': ("""
+        SELECT DATE_FORMAT(e.dia, '%Y-%m-%d') AS periodo, e.id_municipio, e.id_tipo_incidente, SUM(e.total)
+        FROM ESTADISTICA_INCIDENTE e
+        WHERE e.dia >= STR_TO_DATE(:fecha_inicial,'%Y-%m-%d')
+        AND e.dia <= STR_TO_DATE(:fecha_final,'%Y-%m-%d')
+        AND e.id_municipio = :id_municipio
+        GROUP BY periodo, e.id_municipio, e.id_tipo_incidente
+        """, {"fecha_inicial": "2021-01-01", "fecha_final": "2021-12-31", "id_municipio": 1}),
+    'incidentes_por_area': ("""
+        SELECT i.id, i.latitud, i.longitud
+        FROM INCIDENTE i
+        WHERE (i.geohash LIKE :geohash_0 OR i.geohash LIKE :geohash_1)
+        AND i.latitud BETWEEN :min_lat AND :max_lat AND i.longitud BETWEEN :min_lon AND :max_lon
+        """, {"geohash_0": "d29e%", "geohash_1": "d29s%", "min_lat": 3.40, "min_lon": -76.55, "max_lat": 3.48,
+              "max_lon": -76.48}),
+    'cambios_incidentes': ("""
+        SELECT i.id, i.actualizado
+        FROM INCIDENTE i
+        WHERE i.actualizado >= :cursor_actualizado
+        AND (i.actualizado > :cursor_actualizado OR i.id > :cursor_id)
+        AND i.actualizado < NOW(3) - INTERVAL :lag SECOND
+        ORDER BY i.actualizado, i.id LIMIT 200
+        """, {"cursor_actualizado": "2021-01-01 00:00:00.000", "cursor_id": 0, "lag": 5}),
+    'busqueda_hechos': ("""
+        SELECT i.id, MATCH(i.hechos) AGAINST (:q IN NATURAL LANGUAGE MODE) AS relevancia
+        FROM INCIDENTE i
+        WHERE MATCH(i.hechos) AGAINST (:q IN NATURAL LANGUAGE MODE)
+        AND i.fecha >= STR_TO_DATE(:fecha_inicial,'%Y-%m-%d')
+        AND i.fecha < STR_TO_DATE(:fecha_final,'%Y-%m-%d') + INTERVAL 1 DAY
+        AND i.id_municipio = :id_municipio
+        ORDER BY relevancia DESC, i.id LIMIT 201
+        """, {"q": "robo celular", "fecha_inicial": "2021-01-01", "fecha_final": "2021-12-31", "id_municipio": 1}),
+    'usuario_por_correo': ("""
+        SELECT id FROM USUARIO WHERE correo = :email
+        """, {"email": "admin@example.com"}),
+}
+
+
+def load_config(args):
+    env = dict(os.environ)
+    if args.stage:
+        with open(os.path.join(root_dir, args.service, '.chalice', 'config.json')) as f:
+            config = json.load(f)
+        env.update(config.get('environment_variables', {}))
+        env.update(config['stages'][args.stage].get('environment_variables', {}))
+    try:
+        return {
+            "aurora_cluster_arn": env['DB_CLUSTER_ARN'],
+            "secret_arn": env['DB_CREDENTIALS_SECRET_ARN'],
+            "database": env['DB_NAME']
+        }
+    except KeyError as e:
+        sys.exit("Falta la variable de entorno %s" % e)
+
+
+def list_migrations():
+    migrations = []
+    for file_name in sorted(os.listdir(migrations_dir)):
+        match = re.match(r'^(\d+)_(\w+)\.sql$', file_name)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(migrations_dir, file_name)))
+    return migrations
+
+
+def split_statements(sql):
+    # Los comentarios -- se quitan antes de separar, un ; dentro de un comentario o de un literal no corta la sentencia
+    statements = []
+    current = []
+    quote = None
+    i = 0
+    while i < len(sql):
+        char = sql[i]
+        if quote:
+            current.append(char)
+            if char == '\\' and i + 1 < len(sql):
+                current.append(sql[i + 1])
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in ("'", '"', '`'):
+            quote = char
+            current.append(char)
+        elif sql.startswith('--', i):
+            end = sql.find('\n', i)
+            i = len(sql) if end == -1 else end
+            continue
+        elif char == ';':
+            statements.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+        i += 1
+    if quote:
+        raise ValueError("Literal sin cerrar")
+    statements.append(''.join(current))
+    return ['\n'.join(line for line in statement.splitlines() if line.strip()).strip()
+            for statement in statements if statement.strip()]
+
+
+statement_keywords = ('ALTER', 'CREATE', 'DROP', 'INSERT', 'UPDATE', 'DELETE', 'RENAME', 'SET')
+
+
+def check_migrations():
+    # Revisión sin conexión: cada sentencia debe empezar por una palabra clave de DDL o DML
+    errors = 0
+    for version, name, path in list_migrations():
+        with open(path) as f:
+            try:
+                statements = split_statements(f.read())
+            except ValueError as e:
+                print("%04d %s: %s" % (version, name, e))
+                errors += 1
+                continue
+        if not statements:
+            print("%04d %s: no contiene sentencias" % (version, name))
+            errors += 1
+        for statement in statements:
+            if statement.split(None, 1)[0].upper() not in statement_keywords:
+                print("%04d %s: sentencia no válida: %s" % (version, name, statement.splitlines()[0][:80]))
+                errors += 1
+    return errors
+
+
+def applied_versions(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(migration_table)
+        cursor.execute("SELECT version FROM SCHEMA_MIGRACION")
+        return {reg[0] for reg in cursor}
+
+
+def status(conn, args):
+    applied = applied_versions(conn)
+    for version, name, path in list_migrations():
+        print("%04d %-40s %s" % (version, name, 'aplicada' if version in applied else 'pendiente'))
+
+
+def upgrade(conn, args):
+    applied = applied_versions(conn)
+    conn.commit()
+    for version, name, path in list_migrations():
+        if version in applied or (args.target and version > args.target):
+            continue
+        print("Aplicando %04d %s" % (version, name))
+        with open(path) as f:
+            statements = split_statements(f.read())
+        # MySQL confirma implícitamente cada DDL, por eso la versión se registra al final de cada archivo
+        with conn.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute("INSERT INTO SCHEMA_MIGRACION (version, nombre) VALUES (:version, :nombre)",
+                           {"version": version, "nombre": name})
+        conn.commit()
+
+
+def rebuild_stats(conn, args):
+    where = "WHERE fecha >= STR_TO_DATE(:desde,'%Y-%m-%d') AND fecha < STR_TO_DATE(:hasta,'%Y-%m-%d') + INTERVAL 1 DAY"
+    params = {"desde": args.desde, "hasta": args.hasta}
+    # Borrado y recálculo en una sola transacción, las inserciones concurrentes esperan a que termine
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            DELETE FROM ESTADISTICA_INCIDENTE
+            WHERE dia >= STR_TO_DATE(:desde,'%Y-%m-%d') AND dia <= STR_TO_DATE(:hasta,'%Y-%m-%d')
+            """, params)
+        cursor.execute("""
+            INSERT INTO ESTADISTICA_INCIDENTE (id_municipio, id_tipo_incidente, dia, total)
+            SELECT id_municipio, id_tipo_incidente, DATE(fecha), COUNT(*)
+            FROM INCIDENTE
+            %s
+            GROUP BY id_municipio, id_tipo_incidente, DATE(fecha)
+            """ % where, params)
+        print("Estadísticas recalculadas entre %s y %s: %d filas" % (args.desde, args.hasta, cursor.rowcount))
+    conn.commit()
+
+
+def explain(conn, args):
+    for name, (query, params) in hot_queries.items():
+        if args.query and name not in args.query:
+            continue
+        print("== %s" % name)
+        with conn.cursor() as cursor:
+            cursor.execute("EXPLAIN " + query, params)
+            columns = [col.name for col in cursor.description]
+            for reg in cursor:
+                plan = dict(zip(columns, reg))
+                print("  tabla=%s tipo=%s clave=%s filas=%s extra=%s" % (
+                    plan.get('table'), plan.get('type'), plan.get('key'), plan.get('rows'), plan.get('Extra')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migraciones de esquema e índices de la base de datos sis247")
+    parser.add_argument('--stage', help="Lee la conexión de .chalice/config.json para este stage")
+    parser.add_argument('--service', default='incidentes', help="Servicio del que se lee la configuración")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    status_parser = subparsers.add_parser('status', help="Lista las migraciones aplicadas y pendientes")
+    status_parser.add_argument('--check', action='store_true',
+                               help="Solo revisa que las sentencias de cada archivo se separen bien, sin conectarse")
+    up_parser = subparsers.add_parser('up', help="Aplica las migraciones pendientes")
+    up_parser.add_argument('--target', type=int, help="Última versión a aplicar")
+    stats_parser = subparsers.add_parser('rebuild-stats',
+                                         help="Recalcula ESTADISTICA_INCIDENTE a partir de INCIDENTE")
+    stats_parser.add_argument('--desde', default='1970-01-01', help="Primer día a recalcular (AAAA-MM-DD)")
+    stats_parser.add_argument('--hasta', default='9999-12-31', help="Último día a recalcular (AAAA-MM-DD)")
+    explain_parser = subparsers.add_parser('explain', help="Muestra el plan de las consultas más frecuentes")
+    explain_parser.add_argument('query', nargs='*', help="Consultas a revisar (por defecto todas)")
+    args = parser.parse_args()
+
+    if args.command == 'status' and args.check:
+        errors = check_migrations()
+        if errors:
+            sys.exit("%d sentencias no válidas" % errors)
+        print("Migraciones correctas")
+        return
+
+    commands = {'status': status, 'up': upgrade, 'rebuild-stats': rebuild_stats, 'explain': explain}
+    with aurora_data_api.connect(**load_config(args)) as conn:
+        commands[args.command](conn, args)
+
+
+if __name__ == '__main__':
+    main()
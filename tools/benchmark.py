@@ -0,0 +1,314 @@
+import argparse
+import base64
+import contextlib
+import importlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from config import root_dir
+from fakes import FakeCognitoIdp, FakeDataApi, TokenIssuer, temp_jwks_file, user_email
+
+region = 'us-east-1'
+user_pool_id = 'us-east-1_bench'
+client_id = 'bench-client'
+base_env = {
+    'API_NAME': 'bench',
+    'REGION': region,
+    'AWS_DEFAULT_REGION': region,
+    'COGNITO_USER_POOL': 'bench',
+    'COGNITO_USER_POOL_ID': user_pool_id,
+    'COGNITO_USER_POOL_ARN': 'arn:aws:cognito-idp:%s:000000000000:userpool/%s' % (region, user_pool_id),
+    'COGNITO_CLIENT_ID': client_id,
+    'COGNITO_CLIENT_SECRET': 'bench-secret',
+    'DB_NAME': 'bench',
+    'DB_CLUSTER_ARN': 'arn:aws:rds:%s:000000000000:cluster:bench' % region,
+    'DB_CREDENTIALS_SECRET_ARN': 'arn:aws:secretsmanager:%s:000000000000:secret:bench' % region,
+    'DB_CITIZEN_ROL': '2',
+    'INCIDENT_QUEUE_URL': 'memory://',
+    # Todas las peticiones llegan desde la misma IP, el límite de escrituras falsearía los escenarios
+    'WRITE_RATE_LIMIT': '0',
+    'PUBLIC_WRITE_RATE_LIMIT': '0',
+    # Las cuotas de Cognito solo espacian las llamadas, con el falso medirían time.sleep
+    'COGNITO_SIGNUP_RATE': '0',
+    'COGNITO_ADMIN_RATE': '0',
+    'COGNITO_READ_RATE': '0'
+}
+admin_email = user_email(1)
+citizen_email = user_email(2)
+
+# path, body y token reciben el número de iteración para generar datos únicos cuando la ruta los necesita
+Scenario = namedtuple('Scenario', ['name', 'service', 'method', 'route', 'path', 'body', 'token', 'expected'])
+
+
+def incident(n):
+    return {
+        "hechos": "Incidente de prueba %d" % n,
+        "ubicacion": "%.6f,%.6f" % (3.05 + (n % 50) * 0.0004, -76.77 + (n % 50) * 0.0004),
+        "fecha": "2021-06-%02d 10:00:00" % (n % 28 + 1),
+        "id_tipo_incidente": n % 10 + 1,
+        "id_municipio": 1,
+        "correo_usuario": citizen_email
+    }
+
+
+def cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def recent_change_cursor():
+    # Un tablero al día: su cursor es de la consulta anterior y no hay cambios nuevos
+    return cursor([(datetime.utcnow() - timedelta(seconds=10)).strftime('%Y-%m-%d %H:%M:%S.000'), 0])
+
+
+scenarios = [
+    Scenario('listas_municipios', 'incidentes', 'GET', '/listas/{tipo_lista}',
+             lambda n: '/listas/municipios', None, None, {200}),
+    Scenario('listas_invalidar', 'incidentes', 'POST', '/admin/listas/{tipo_lista}/invalidar',
+             lambda n: '/admin/listas/incidentes/invalidar', None, 'admin', {200}),
+    Scenario('crear_incidente', 'incidentes', 'POST', '/incidentes',
+             lambda n: '/incidentes', incident, 'ciudadano', {200}),
+    Scenario('crear_incidente_async', 'incidentes', 'POST', '/incidentes',
+             lambda n: '/incidentes', incident, 'ciudadano_async', {202}),
+    Scenario('crear_incidente_reintento', 'incidentes', 'POST', '/incidentes',
+             lambda n: '/incidentes', lambda n: incident(0), 'ciudadano_reintento', {200}),
+    Scenario('seguimiento_incidente', 'incidentes', 'GET', '/incidentes/seguimiento/{id_seguimiento}',
+             lambda n: '/incidentes/seguimiento/%032x' % n, None, 'ciudadano', {200}),
+    Scenario('lote_incidentes', 'incidentes', 'POST', '/incidentes/lote',
+             lambda n: '/incidentes/lote', lambda n: {"incidentes": [incident(n * 50 + i) for i in range(50)]},
+             'admin', {200}),
+    Scenario('listar_incidentes', 'incidentes', 'GET', '/admin/incidentes',
+             lambda n: '/admin/incidentes?fecha_inicial=2021-01-01&fecha_final=2021-12-31&id_municipio=%d'
+                       % (n % 42 + 1), None, 'admin', {200}),
+    Scenario('listar_incidentes_campos', 'incidentes', 'GET', '/admin/incidentes',
+             lambda n: '/admin/incidentes?fecha_inicial=2021-01-01&fecha_final=2021-12-31&id_municipio=%d'
+                       '&fields=id,fecha,tipo_incidente,municipio' % (n % 42 + 1), None, 'admin', {200}),
+    Scenario('buscar_incidentes', 'incidentes', 'GET', '/admin/incidentes',
+             lambda n: '/admin/incidentes?fecha_inicial=2021-01-01&fecha_final=2021-12-31&id_municipio=%d'
+                       '&q=robo%%20celular&fields=id,fecha,hechos' % (n % 42 + 1), None, 'admin', {200}),
+    Scenario('cambios_incidentes', 'incidentes', 'GET', '/admin/incidentes/cambios',
+             lambda n: '/admin/incidentes/cambios?desde=' + recent_change_cursor(), None, 'admin', {200}),
+    Scenario('exportar_incidentes', 'incidentes', 'POST', '/admin/incidentes/exportaciones',
+             lambda n: '/admin/incidentes/exportaciones',
+             lambda n: {"fecha_inicial": "2021-01-01", "fecha_final": "2021-01-31", "formato": "csv", "gzip": True},
+             'admin', {200}),
+    Scenario('consultar_exportacion', 'incidentes', 'GET', '/admin/incidentes/exportaciones/{id_exportacion}',
+             lambda n: '/admin/incidentes/exportaciones/%032x' % n, None, 'admin', {404}),
+    Scenario('estadisticas_incidentes', 'incidentes', 'GET', '/admin/incidentes/estadisticas',
+             lambda n: '/admin/incidentes/estadisticas?fecha_inicial=2021-01-01&fecha_final=2021-12-31'
+                       '&id_municipio=%d&agrupacion=mes' % (n % 42 + 1), None, 'admin', {200}),
+    Scenario('incidentes_cercanos', 'incidentes', 'GET', '/admin/incidentes/cercanos',
+             lambda n: '/admin/incidentes/cercanos?latitud=3.05&longitud=-76.77&radio=2000', None, 'admin', {200}),
+    Scenario('incidentes_cercanos_zoom', 'incidentes', 'GET', '/admin/incidentes/cercanos',
+             lambda n: '/admin/incidentes/cercanos?bbox=2.9,-77.0,5.3,-75.4&zoom=9', None, 'admin', {200}),
+    Scenario('listar_usuarios', 'usuarios', 'GET', '/admin/usuarios',
+             lambda n: '/admin/usuarios?limit=50', None, 'admin', {200}),
+    Scenario('consultar_usuario', 'usuarios', 'GET', '/admin/usuarios/{email}',
+             lambda n: '/admin/usuarios/' + citizen_email, None, 'admin', {200}),
+    Scenario('perfil', 'usuarios', 'GET', '/usuarios',
+             lambda n: '/usuarios', None, 'admin', {200}),
+    Scenario('crear_usuario', 'usuarios', 'POST', '/admin/usuarios',
+             lambda n: '/admin/usuarios',
+             lambda n: {"correo": "alta%04d@sis247.test" % n, "password": "Clave.2021", "nombres": "Alta",
+                        "apellidos": "Prueba", "id_municipio": 1, "id_rol": 2}, 'admin', {200}),
+    Scenario('actualizar_usuario', 'usuarios', 'PUT', '/admin/usuarios',
+             lambda n: '/admin/usuarios',
+             lambda n: {"correo": citizen_email, "nombres": "Nombre %d" % n, "id_rol": 2}, 'admin', {200}),
+    Scenario('eliminar_usuario', 'usuarios', 'DELETE', '/admin/usuarios/{email}',
+             lambda n: '/admin/usuarios/alta%04d@sis247.test' % n, None, 'admin', {200}),
+    Scenario('lote_usuarios', 'usuarios', 'POST', '/admin/usuarios/lote',
+             lambda n: '/admin/usuarios/lote',
+             lambda n: {"usuarios": [{"correo": "lote%04d_%03d@sis247.test" % (n, i), "password": "Clave.2021",
+                                      "nombres": "Lote", "apellidos": "Prueba", "id_municipio": i % 42 + 1,
+                                      "id_rol": 2} for i in range(200)]}, 'admin', {200}),
+    Scenario('eliminar_lote_usuarios', 'usuarios', 'DELETE', '/admin/usuarios/lote',
+             lambda n: '/admin/usuarios/lote',
+             lambda n: {"correos": ["lote%04d_%03d@sis247.test" % (n, i) for i in range(200)]}, 'admin', {200}),
+    Scenario('registro', 'usuarios', 'POST', '/usuarios/registro',
+             lambda n: '/usuarios/registro',
+             lambda n: {"correo": "registro%04d@sis247.test" % n, "password": "Clave.2021", "nombres": "Registro",
+                        "apellidos": "Prueba", "id_municipio": 1, "id_terminos": 1}, None, {200}),
+    Scenario('login', 'usuarios', 'POST', '/usuarios/login',
+             lambda n: '/usuarios/login', lambda n: {"correo": admin_email, "password": "Clave.2021"}, None, {200}),
+    Scenario('logout', 'usuarios', 'POST', '/usuarios/logout',
+             lambda n: '/usuarios/logout', 'access_token', 'admin', {200}),
+]
+
+
+class Environment:
+
+    def __init__(self, args, directory):
+        self.issuer = TokenIssuer(region, user_pool_id, client_id)
+        self.data_api = FakeDataApi(latency=args.db_latency / 1000)
+        self.cognito_idp = FakeCognitoIdp(self.issuer, latency=args.cognito_latency / 1000)
+        self.data_api.seed(usuarios=args.users, incidentes=args.incidents)
+        for n in range(1, args.users + 1):
+            self.cognito_idp.add_user(user_email(n))
+        # Con custom:id_rol y la versión vigente (la del seed es el id del usuario) la autorización usa la caché
+        role_claims = (lambda id_rol, version: {}) if args.no_role_claims else \
+            (lambda id_rol, version: {'custom:id_rol': id_rol, 'custom:version_rol': version})
+        self.tokens = {
+            'admin': self.issuer.issue(admin_email, **role_claims('1', '1')),
+            'ciudadano': self.issuer.issue(citizen_email, **role_claims('2', '2'))
+        }
+        self.access_token = self.issuer.issue(admin_email, token_use='access')
+        jwks_path = temp_jwks_file(self.issuer.jwks, directory)
+        os.environ.update(base_env, AWS_COGNITO_JWKS_PATH=jwks_path, JWKS_SNAPSHOT=jwks_path,
+                          EXPORT_STORE_URL='file://' + os.path.join(directory, 'exportaciones'),
+                          TIMING_SAMPLE_RATE=str(args.timing_sample_rate), TIMING_SLOW_MS='inf')
+
+    def load(self, service):
+        for name in list(sys.modules):
+            if name == 'app' or name == 'chalicelib' or name.startswith('chalicelib.'):
+                del sys.modules[name]
+        sys.path.insert(0, os.path.join(root_dir, service))
+        try:
+            module = importlib.import_module('app')
+        finally:
+            sys.path.pop(0)
+        # Los servicios crean sus clientes con el primer uso, se reemplazan antes de la primera petición
+        module.db._client = module.timing.instrument(self.data_api, 'db')
+        if hasattr(module, 'cognito'):
+            module.cognito._client = module.timing.instrument(self.cognito_idp, 'cognito')
+        return module
+
+    def request(self, client, scenario, n):
+        headers = {'Content-Type': 'application/json'}
+        if scenario.token:
+            token, _, mode = scenario.token.partition('_')
+            headers['Authorization'] = 'Bearer ' + self.tokens[token]
+            if mode == 'async':
+                headers['Prefer'] = 'respond-async'
+            elif mode == 'reintento':
+                # Reintentos de un mismo cliente, desde la segunda iteración se repite la respuesta guardada
+                headers['Idempotency-Key'] = 'reintento-' + scenario.name
+        if scenario.body == 'access_token':
+            body = {"access_token": self.access_token}
+        else:
+            body = scenario.body(n) if scenario.body else None
+        return client.http.request(scenario.method, scenario.path(n), headers=headers,
+                                   body=json.dumps(body).encode('utf-8') if body is not None else b'')
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def run_scenario(env, client, scenario, iterations, warmup):
+    durations = []
+    db_calls = 0
+    cognito_calls = 0
+    errors = {}
+    for n in range(warmup + iterations):
+        db_before, cognito_before = env.data_api.total_calls(), env.cognito_idp.total_calls()
+        start = time.perf_counter()
+        # Los registros de los servicios no se mezclan con el reporte
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = env.request(client, scenario, n)
+        elapsed = (time.perf_counter() - start) * 1000
+        if response.status_code not in scenario.expected:
+            errors[response.status_code] = response.body[:200].decode('utf-8', 'replace')
+        if n >= warmup:
+            durations.append(elapsed)
+            db_calls += env.data_api.total_calls() - db_before
+            cognito_calls += env.cognito_idp.total_calls() - cognito_before
+    return {
+        "p50_ms": round(statistics.median(durations), 3),
+        "p95_ms": round(percentile(durations, 95), 3),
+        "db_calls": round(db_calls / iterations, 2),
+        "cognito_calls": round(cognito_calls / iterations, 2),
+        "errors": errors
+    }
+
+
+def compare(results, baseline, max_regression):
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        if result['db_calls'] > previous['db_calls'] or result['cognito_calls'] > previous['cognito_calls']:
+            regressions.append("%s: más llamadas por petición (db %.2f -> %.2f, cognito %.2f -> %.2f)" % (
+                name, previous['db_calls'], result['db_calls'], previous['cognito_calls'],
+                result['cognito_calls']))
+        # Diferencias por debajo de medio milisegundo son ruido de la máquina
+        if result['p50_ms'] > previous['p50_ms'] * (1 + max_regression / 100) and \
+                result['p50_ms'] - previous['p50_ms'] > 0.5:
+            regressions.append("%s: p50 %.2f ms -> %.2f ms" % (name, previous['p50_ms'], result['p50_ms']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark de las rutas de incidentes y usuarios sin AWS (Data API sobre SQLite, Cognito en memoria)")
+    parser.add_argument('--iterations', type=int, default=50, help="Peticiones medidas por escenario")
+    parser.add_argument('--warmup', type=int, default=3, help="Peticiones previas que no se miden")
+    parser.add_argument('--db-latency', type=float, default=0.0, help="Latencia por llamada a la Data API (ms)")
+    parser.add_argument('--cognito-latency', type=float, default=0.0, help="Latencia por llamada a Cognito (ms)")
+    parser.add_argument('--users', type=int, default=200, help="Usuarios sembrados")
+    parser.add_argument('--incidents', type=int, default=5000, help="Incidentes sembrados")
+    parser.add_argument('--no-role-claims', action='store_true',
+                        help="Tokens sin custom:id_rol, la autorización consulta la base de datos")
+    parser.add_argument('--timing-sample-rate', type=float, default=0.0,
+                        help="TIMING_SAMPLE_RATE de los servicios, para medir el costo de la instrumentación")
+    parser.add_argument('--only', nargs='*', help="Escenarios a ejecutar (por defecto todos)")
+    parser.add_argument('--save', help="Guarda el resultado en un archivo JSON")
+    parser.add_argument('--compare', help="Compara contra un resultado guardado con --save")
+    parser.add_argument('--max-regression', type=float, default=20.0,
+                        help="Porcentaje de aumento del p50 que se considera regresión")
+    args = parser.parse_args()
+
+    from chalice.test import Client
+    warnings.simplefilter('ignore')
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        env = Environment(args, directory)
+        for service in ('incidentes', 'usuarios'):
+            selected = [s for s in scenarios if s.service == service and (not args.only or s.name in args.only)]
+            if not selected:
+                continue
+            module = env.load(service)
+            covered = {(s.method, s.route) for s in scenarios if s.service == service}
+            for route, methods in module.app.routes.items():
+                for method in methods:
+                    if (method, route) not in covered:
+                        print("Aviso: %s %s no tiene escenario" % (method, route))
+            with Client(module.app) as client:
+                for scenario in selected:
+                    results[scenario.name] = run_scenario(env, client, scenario, args.iterations, args.warmup)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print("%-28s %10s %10s %10s %10s" % ("escenario", "p50 ms", "p95 ms", "db/req", "cognito/req"))
+    for name, result in results.items():
+        previous = baseline.get(name, {})
+        print("%-28s %10.2f %10.2f %10.2f %10.2f" % (name, result['p50_ms'], result['p95_ms'], result['db_calls'],
+                                                    result['cognito_calls']) +
+              ("   (antes %.2f / %.2f / %.2f)" % (previous['p50_ms'], previous['db_calls'],
+                                                  previous['cognito_calls']) if previous else ''))
+        for status, body in result['errors'].items():
+            print("    respuesta inesperada %s: %s" % (status, body))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    regressions = compare(results, baseline, args.max_regression)
+    for regression in regressions:
+        print("Regresión: " + regression)
+    if regressions or any(result['errors'] for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
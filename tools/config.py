@@ -0,0 +1,13 @@
+import json
+import os
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+services = ['incidentes', 'usuarios']
+
+
+def service_env(service, stage):
+    with open(os.path.join(root_dir, service, '.chalice', 'config.json')) as f:
+        config = json.load(f)
+    env = dict(config.get('environment_variables', {}))
+    env.update(config['stages'][stage].get('environment_variables', {}))
+    return env
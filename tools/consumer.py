@@ -0,0 +1,62 @@
+import argparse
+import importlib
+import os
+import sys
+import time
+
+from config import root_dir, service_env
+
+
+def load_app(stage):
+    # Las variables ya definidas en el entorno tienen prioridad sobre las del stage
+    env = service_env('incidentes', stage)
+    env.update(os.environ)
+    os.environ.update(env)
+    os.environ.setdefault('AWS_DEFAULT_REGION', os.environ['REGION'])
+    sys.path.insert(0, os.path.join(root_dir, 'incidentes'))
+    return importlib.import_module('app')
+
+
+def drain(module):
+    incidents = module.drain_incident_queue() if module.incident_queue else 0
+    exports = module.drain_export_queue() if module.export_queue else 0
+    return incidents, exports
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Consumidor local de las colas de incidentes y exportaciones (el equivalente de los "
+                    "handlers on_sqs_message cuando la cola es sqlite:///)")
+    parser.add_argument('--stage', default='dev')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help="Segundos de espera cuando las colas están vacías")
+    parser.add_argument('--once', action='store_true', help="Vacía las colas una vez y termina")
+    args = parser.parse_args()
+
+    for name in ('INCIDENT_QUEUE_URL', 'EXPORT_QUEUE_URL'):
+        if os.environ.get(name, '').startswith('memory://'):
+            # La cola en memoria solo existe dentro del proceso de chalice local
+            sys.exit("%s=memory:// no se comparte entre procesos, use sqlite:///<ruta>" % name)
+    module = load_app(args.stage)
+    if not module.incident_queue and not module.export_queue:
+        sys.exit("INCIDENT_QUEUE_URL y EXPORT_QUEUE_URL no están configuradas")
+
+    try:
+        while True:
+            try:
+                incidents, exports = drain(module)
+            except Exception as e:
+                print(e)
+                incidents, exports = 0, 0
+            if incidents or exports:
+                print("Incidentes procesados: %d, exportaciones procesadas: %d" % (incidents, exports))
+            if not incidents and not exports:
+                if args.once:
+                    break
+                time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,393 @@
+import base64
+import itertools
+import json
+import os
+import random
+import re
+import secrets
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta
+
+# Esquema de Aurora (tablas base más las migraciones) traducido a SQLite. Al agregar una migración que cambie
+# columnas usadas por los servicios hay que reflejarla aquí
+schema = """
+CREATE TABLE MUNICIPIO (id INTEGER PRIMARY KEY, nombre TEXT, logo TEXT, slogan TEXT, coordenadas TEXT);
+CREATE TABLE TIPO_INCIDENTE (id INTEGER PRIMARY KEY, descripcion TEXT, icono TEXT);
+CREATE TABLE TERMINOS_CONDICIONES (id INTEGER PRIMARY KEY, texto_legal TEXT, version TEXT);
+CREATE TABLE ROL (id INTEGER PRIMARY KEY, nombre TEXT);
+CREATE TABLE RECURSO (id INTEGER PRIMARY KEY, nombre TEXT, path TEXT);
+CREATE TABLE ROL_RECURSO (id_rol INTEGER, id_recurso INTEGER);
+CREATE TABLE USUARIO (id INTEGER PRIMARY KEY, correo TEXT UNIQUE, nombres TEXT, apellidos TEXT,
+    tipo_documento TEXT, numero_documento TEXT, celular TEXT, id_municipio INTEGER, id_rol INTEGER,
+    id_terminos INTEGER);
+CREATE TABLE INCIDENTE (id INTEGER PRIMARY KEY, hechos TEXT, ubicacion TEXT, fecha TEXT, id_tipo_incidente INTEGER,
+    id_municipio INTEGER, id_usuario INTEGER, id_seguimiento TEXT UNIQUE, latitud REAL, longitud REAL, geohash TEXT,
+    actualizado TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')));
+CREATE INDEX idx_incidente_municipio_fecha ON INCIDENTE (id_municipio, fecha);
+CREATE INDEX idx_incidente_fecha ON INCIDENTE (fecha, id);
+CREATE INDEX idx_incidente_geohash ON INCIDENTE (geohash);
+CREATE INDEX idx_incidente_actualizado ON INCIDENTE (actualizado, id);
+CREATE TABLE VERSION_LISTA (tipo TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 1);
+INSERT INTO VERSION_LISTA (tipo) VALUES ('municipios'), ('incidentes'), ('terminos'), ('roles');
+CREATE TABLE INCIDENTE_RECHAZADO (id_seguimiento TEXT PRIMARY KEY, motivo TEXT NOT NULL,
+    fecha TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE CAMBIO_ROL (id INTEGER PRIMARY KEY, correo TEXT NOT NULL, id_rol INTEGER,
+    fecha TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP);
+CREATE INDEX idx_cambio_rol_correo ON CAMBIO_ROL (correo, id);
+CREATE TABLE ESTADISTICA_INCIDENTE (id_municipio INTEGER, id_tipo_incidente INTEGER, dia TEXT, total INTEGER,
+    PRIMARY KEY (id_municipio, dia, id_tipo_incidente));
+"""
+
+# Expresiones de MySQL que usan los servicios y su equivalente en SQLite
+translations = [
+    (re.compile(r"INSERT IGNORE"), "INSERT OR IGNORE"),
+    (re.compile(r"STR_TO_DATE\((:\w+),\s*'%Y-%m-%d'\)\s*\+\s*INTERVAL 1 DAY"), r"DATE(\1, '+1 day')"),
+    (re.compile(r"STR_TO_DATE\((:\w+),\s*'%Y-%m-%d'\)"), r"DATE(\1)"),
+    (re.compile(r"NOW\(\) - INTERVAL (:\w+) HOUR"), r"DATETIME('now', '-' || \1 || ' hours')"),
+    (re.compile(r"NOW\(3\) - INTERVAL (:\w+) SECOND"),
+     r"strftime('%Y-%m-%d %H:%M:%f', 'now', '-' || \1 || ' seconds')"),
+    (re.compile(r"ON DUPLICATE KEY UPDATE (\w+) = \1 \+ VALUES\(\1\)"),
+     r"ON CONFLICT DO UPDATE SET \1 = \1 + excluded.\1"),
+    (re.compile(r"ON DUPLICATE KEY UPDATE (\w+) = \1(?=\s*$)"), "ON CONFLICT DO NOTHING"),
+    (re.compile(r"DATE_FORMAT\(([\w.]+), '([%\w-]+)'\)"), r"strftime('\2', \1)"),
+    (re.compile(r"LEFT\(([\w.]+), (\d+)\)"), r"substr(\1, 1, \2)"),
+    (re.compile(r"MATCH\(([\w.]+)\) AGAINST \((:\w+) IN NATURAL LANGUAGE MODE\)"), r"FTS_SCORE(\1, \2)"),
+    (re.compile(r"LIKE (:\w+)"), r"LIKE \1 ESCAPE '\\'"),
+]
+
+resources = [
+    'GET/admin/incidentes', 'POST/incidentes', 'POST/incidentes/lote', 'GET/incidentes/seguimiento',
+    'POST/admin/listas', 'GET/admin/usuarios', 'POST/admin/usuarios', 'PUT/admin/usuarios',
+    'DELETE/admin/usuarios', 'POST/admin/incidentes/exportaciones', 'GET/admin/incidentes/exportaciones',
+    'POST/admin/usuarios/lote', 'DELETE/admin/usuarios/lote'
+]
+citizen_resources = ['POST/incidentes', 'GET/incidentes/seguimiento']
+
+
+class FakeClientError(Exception):
+
+    def __init__(self, code, message):
+        super().__init__("An error occurred (%s): %s" % (code, message))
+        self.response = {'Error': {'Code': code, 'Message': message}}
+
+
+narratives = [
+    'Robo de celular a mano armada en la parada del bus',
+    'Hurto de motocicleta frente al parque principal',
+    'Riña entre vecinos con heridos leves',
+    'Accidente de tránsito entre un bus y una motocicleta',
+    'Violencia intrafamiliar reportada por los vecinos',
+    'Venta de estupefacientes cerca del colegio',
+    'Robo a residencia mientras los propietarios viajaban',
+    'Vandalismo contra el alumbrado del parque'
+]
+word_pattern = re.compile(r'\w{3,}')
+
+
+def fts_score(text, query):
+    # Aproximación del modo natural de FULLTEXT: frecuencia de los términos de la búsqueda de 3 o más letras
+    words = Counter(word_pattern.findall(str(text or '').lower()))
+    return float(sum(words[term] for term in set(word_pattern.findall(str(query or '').lower()))))
+
+
+def _exceptions(*names):
+    return type('exceptions', (), {name: type(name, (FakeClientError,), {}) for name in names})
+
+
+class FakeService:
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._calls_lock = threading.Lock()
+
+    def _call(self, name):
+        with self._calls_lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def total_calls(self):
+        with self._calls_lock:
+            return sum(self.calls.values())
+
+
+class FakeDataApi(FakeService):
+    """Cliente rds-data sobre SQLite. Las transacciones solo se cuentan, SQLite trabaja en autocommit."""
+
+    exceptions = _exceptions('BadRequestException', 'DatabaseErrorException', 'StatementTimeoutException')
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.conn = sqlite3.connect(':memory:', check_same_thread=False, isolation_level=None)
+        self.conn.create_function('CRC32', 1, lambda value: zlib.crc32(str(value).encode('utf-8')))
+        self.conn.create_function('CONCAT', -1, lambda *values: ''.join(str(v) for v in values))
+        self.conn.create_function('POW', 2, lambda base, exp: None if base is None else base ** exp)
+        self.conn.create_function('FTS_SCORE', 2, fts_score)
+        # LIKE 'prefijo%' recorre el índice como en MySQL (búsquedas por geohash)
+        self.conn.execute("PRAGMA case_sensitive_like = ON")
+        self.conn.executescript(schema)
+        self._lock = threading.RLock()
+        self._transaction_ids = itertools.count(1)
+
+    @staticmethod
+    def translate(sql):
+        for pattern, replacement in translations:
+            sql = pattern.sub(replacement, sql)
+        return sql
+
+    @staticmethod
+    def _params(parameters):
+        params = {}
+        for param in parameters or []:
+            value = param['value']
+            params[param['name']] = None if value.get('isNull') else list(value.values())[0]
+        return params
+
+    @staticmethod
+    def _field(value):
+        if value is None:
+            return {'isNull': True}
+        if isinstance(value, bool):
+            return {'booleanValue': value}
+        if isinstance(value, int):
+            return {'longValue': value}
+        if isinstance(value, float):
+            return {'doubleValue': value}
+        return {'stringValue': str(value)}
+
+    def _execute(self, sql, params):
+        try:
+            with self._lock:
+                cursor = self.conn.execute(self.translate(sql), params)
+                rows = cursor.fetchall() if cursor.description else None
+                return cursor, rows
+        except sqlite3.Error as e:
+            raise self.exceptions.BadRequestException('BadRequestException', str(e))
+
+    def begin_transaction(self, **kwargs):
+        self._call('begin_transaction')
+        return {'transactionId': str(next(self._transaction_ids))}
+
+    def commit_transaction(self, **kwargs):
+        self._call('commit_transaction')
+        return {'transactionStatus': 'Transaction Committed'}
+
+    def rollback_transaction(self, **kwargs):
+        self._call('rollback_transaction')
+        return {'transactionStatus': 'Rollback Complete'}
+
+    def execute_statement(self, sql, parameters=None, **kwargs):
+        self._call('execute_statement')
+        cursor, rows = self._execute(sql, self._params(parameters))
+        if rows is not None:
+            return {
+                'columnMetadata': [{'name': d[0], 'label': d[0], 'typeName': 'VARCHAR'} for d in cursor.description],
+                'records': [[self._field(v) for v in row] for row in rows],
+                'numberOfRecordsUpdated': 0
+            }
+        response = {'numberOfRecordsUpdated': cursor.rowcount}
+        if sql.lstrip().upper().startswith('INSERT') and cursor.rowcount:
+            response['generatedFields'] = [{'longValue': cursor.lastrowid}]
+        return response
+
+    def batch_execute_statement(self, sql, parameterSets, **kwargs):
+        self._call('batch_execute_statement')
+        results = []
+        with self._lock:
+            # Sin transacciones reales, una fila rechazada deshace al menos las filas previas del mismo lote,
+            # que es lo que ve el llamador después de su rollback
+            self.conn.execute("SAVEPOINT lote")
+            try:
+                for parameters in parameterSets:
+                    cursor, rows = self._execute(sql, self._params(parameters))
+                    inserted = sql.lstrip().upper().startswith('INSERT') and cursor.rowcount
+                    results.append({'generatedFields': [{'longValue': cursor.lastrowid}] if inserted else []})
+            except self.exceptions.BadRequestException:
+                self.conn.execute("ROLLBACK TO lote")
+                raise
+            finally:
+                self.conn.execute("RELEASE lote")
+        return {'updateResults': results}
+
+    def seed(self, municipios=42, usuarios=200, incidentes=5000, seed=1):
+        rng = random.Random(seed)
+        self.conn.executemany("INSERT INTO MUNICIPIO VALUES (?, ?, ?, ?, ?)", [
+            (i, 'Municipio %d' % i, 'data:image/png;base64,' + 'A' * 4096, 'Slogan %d' % i,
+             '%.4f,%.4f' % (3.0 + i * 0.05, -76.8 + i * 0.03)) for i in range(1, municipios + 1)])
+        self.conn.executemany("INSERT INTO TIPO_INCIDENTE VALUES (?, ?, ?)",
+                              [(i, 'Tipo %d' % i, 'icono-%d' % i) for i in range(1, 11)])
+        self.conn.execute("INSERT INTO TERMINOS_CONDICIONES VALUES (1, 'Términos', '1.0')")
+        self.conn.executemany("INSERT INTO ROL VALUES (?, ?)", [(1, 'administrador'), (2, 'ciudadano')])
+        self.conn.executemany("INSERT INTO RECURSO VALUES (?, ?, ?)",
+                              [(i, path, path) for i, path in enumerate(resources, 1)])
+        self.conn.executemany("INSERT INTO ROL_RECURSO VALUES (?, ?)",
+                              [(1, i) for i in range(1, len(resources) + 1)] +
+                              [(2, resources.index(path) + 1) for path in citizen_resources])
+        self.conn.executemany("INSERT INTO USUARIO VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", [
+            (i, user_email(i), 'Nombre %d' % i, 'Apellido %d' % i, 'CC', str(1000 + i), '300%07d' % i,
+             rng.randint(1, municipios), 1 if i == 1 else 2, 1) for i in range(1, usuarios + 1)])
+        # Rol ya estampado en Cognito: la versión del usuario n es n
+        self.conn.execute("INSERT INTO CAMBIO_ROL (id, correo, id_rol) SELECT id, correo, id_rol FROM USUARIO")
+        encode = load_geo().encode
+        start = datetime(2021, 1, 1)
+        rows = []
+        for i in range(1, incidentes + 1):
+            id_municipio = rng.randint(1, municipios)
+            lat, lon = 3.0 + id_municipio * 0.05 + rng.uniform(-0.02, 0.02), \
+                -76.8 + id_municipio * 0.03 + rng.uniform(-0.02, 0.02)
+            fecha = start + timedelta(minutes=rng.randint(0, 365 * 24 * 60))
+            rows.append(('%s (%d)' % (rng.choice(narratives), i), '%.6f,%.6f' % (lat, lon), fecha.strftime('%Y-%m-%d %H:%M:%S'),
+                         rng.randint(1, 10), id_municipio, rng.randint(1, usuarios), lat, lon, encode(lat, lon)))
+        self.conn.executemany("""
+            INSERT INTO INCIDENTE (hechos, ubicacion, fecha, id_tipo_incidente, id_municipio, id_usuario,
+                                   latitud, longitud, geohash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+        self.conn.execute("""
+            INSERT INTO ESTADISTICA_INCIDENTE
+            SELECT id_municipio, id_tipo_incidente, DATE(fecha), COUNT(*) FROM INCIDENTE
+            GROUP BY id_municipio, id_tipo_incidente, DATE(fecha)""")
+
+
+def user_email(n):
+    return 'usuario%04d@sis247.test' % n
+
+
+def load_geo():
+    # Mismo geohash con el que incidentes guarda las ubicaciones
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(
+        'bench_geo', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'incidentes',
+                                  'chalicelib', 'geo.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class TokenIssuer:
+    """Firma tokens RS256 con una llave generada al vuelo y expone el JWKS para verificarlos."""
+
+    def __init__(self, region, user_pool_id, client_id, kid='bench'):
+        import rsa
+        from jose import jwk
+        _, private_key = rsa.newkeys(2048)
+        self.private_pem = private_key.save_pkcs1().decode('utf-8')
+        public = jwk.construct(self.private_pem, 'RS256').public_key().to_dict()
+        public = {k: v.decode('utf-8') if isinstance(v, bytes) else v for k, v in public.items()}
+        public.update(kid=kid, use='sig', alg='RS256')
+        self.jwks = {'keys': [public]}
+        self.issuer = 'https://cognito-idp.{}.amazonaws.com/{}'.format(region, user_pool_id)
+        self.client_id = client_id
+        self.kid = kid
+
+    def issue(self, email, token_use='id', ttl=3600, **claims):
+        from jose import jwt
+        now = int(time.time())
+        payload = {'sub': str(uuid.uuid5(uuid.NAMESPACE_URL, email)), 'iss': self.issuer, 'iat': now,
+                   'exp': now + ttl, 'token_use': token_use}
+        if token_use == 'id':
+            payload.update(email=email, aud=self.client_id)
+        else:
+            payload.update(username=email, client_id=self.client_id)
+        payload.update(claims)
+        return jwt.encode(payload, self.private_pem, algorithm='RS256', headers={'kid': self.kid})
+
+
+class FakeCognitoIdp(FakeService):
+    """Cliente cognito-idp en memoria. El flujo SRP se acepta sin validar la contraseña."""
+
+    exceptions = _exceptions('UserNotFoundException', 'UsernameExistsException', 'NotAuthorizedException')
+
+    def __init__(self, issuer, latency=0.0):
+        super().__init__(latency)
+        self.issuer = issuer
+        self.users = {}
+        self._lock = threading.Lock()
+
+    def add_user(self, username, attributes=None):
+        with self._lock:
+            self.users[username] = dict({'email': username, 'email_verified': 'true',
+                                         'sub': str(uuid.uuid5(uuid.NAMESPACE_URL, username))}, **(attributes or {}))
+
+    def _user(self, username):
+        with self._lock:
+            if username not in self.users:
+                raise self.exceptions.UserNotFoundException('UserNotFoundException', 'User does not exist.')
+            return self.users[username]
+
+    def admin_get_user(self, UserPoolId, Username, **kwargs):
+        self._call('admin_get_user')
+        attributes = self._user(Username)
+        return {'Username': Username, 'Enabled': True, 'UserStatus': 'CONFIRMED',
+                'UserAttributes': [{'Name': k, 'Value': v} for k, v in attributes.items()]}
+
+    def admin_delete_user(self, UserPoolId, Username, **kwargs):
+        self._call('admin_delete_user')
+        self._user(Username)
+        with self._lock:
+            del self.users[Username]
+
+    def admin_update_user_attributes(self, UserPoolId, Username, UserAttributes, **kwargs):
+        self._call('admin_update_user_attributes')
+        self._user(Username).update({a['Name']: a['Value'] for a in UserAttributes})
+
+    def sign_up(self, ClientId, Username, Password, UserAttributes=(), **kwargs):
+        self._call('sign_up')
+        with self._lock:
+            if Username in self.users:
+                raise self.exceptions.UsernameExistsException('UsernameExistsException', 'User already exists')
+        self.add_user(Username, {a['Name']: a['Value'] for a in UserAttributes})
+        return {'UserConfirmed': False, 'UserSub': self.users[Username]['sub'], 'CodeDeliveryDetails': {},
+                'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    def list_users(self, UserPoolId, **kwargs):
+        self._call('list_users')
+        with self._lock:
+            users = list(self.users.items())
+        return {'Users': [{'Username': k, 'Attributes': [{'Name': a, 'Value': b} for a, b in v.items()]}
+                          for k, v in users]}
+
+    def initiate_auth(self, AuthFlow, AuthParameters, ClientId, **kwargs):
+        self._call('initiate_auth')
+        username = AuthParameters['USERNAME']
+        self._user(username)
+        return {
+            'ChallengeName': 'PASSWORD_VERIFIER',
+            'ChallengeParameters': {
+                'USERNAME': username,
+                'USER_ID_FOR_SRP': username,
+                'SALT': secrets.token_hex(16),
+                'SRP_B': secrets.token_hex(384),
+                'SECRET_BLOCK': base64.standard_b64encode(secrets.token_bytes(64)).decode('utf-8')
+            }
+        }
+
+    def respond_to_auth_challenge(self, ClientId, ChallengeName, ChallengeResponses, **kwargs):
+        self._call('respond_to_auth_challenge')
+        attributes = self._user(ChallengeResponses['USERNAME'])
+        claims = {k: v for k, v in attributes.items() if k.startswith('custom:')}
+        return {
+            'AuthenticationResult': {
+                'AccessToken': self.issuer.issue(attributes['email'], token_use='access'),
+                'IdToken': self.issuer.issue(attributes['email'], **claims),
+                'RefreshToken': secrets.token_urlsafe(32),
+                'TokenType': 'Bearer',
+                'ExpiresIn': 3600
+            }
+        }
+
+    def global_sign_out(self, AccessToken, **kwargs):
+        self._call('global_sign_out')
+        return {}
+
+
+def temp_jwks_file(jwks, directory):
+    path = os.path.join(directory, 'jwks.json')
+    with open(path, 'w') as f:
+        json.dump(jwks, f)
+    return path
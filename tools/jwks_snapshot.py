@@ -0,0 +1,29 @@
+import argparse
+import json
+import os
+import urllib.request
+
+from config import root_dir, service_env, services
+
+keys_url_template = 'https://cognito-idp.{}.amazonaws.com/{}/.well-known/jwks.json'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Descarga el JWKS del user pool y lo empaqueta en chalicelib/jwks.json")
+    parser.add_argument('--stage', default='dev')
+    parser.add_argument('services', nargs='*', default=services)
+    args = parser.parse_args()
+
+    for service in args.services:
+        env = service_env(service, args.stage)
+        keys_url = keys_url_template.format(env['REGION'], env['COGNITO_USER_POOL_ID'])
+        with urllib.request.urlopen(keys_url) as f:
+            jwks = json.loads(f.read().decode('utf-8'))
+        path = os.path.join(root_dir, service, 'chalicelib', 'jwks.json')
+        with open(path, 'w') as f:
+            json.dump(jwks, f, indent=2)
+        print("%s: %d llaves en %s" % (service, len(jwks['keys']), os.path.relpath(path, root_dir)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from config import root_dir, service_env, services
+
+import_line = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$')
+probe = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+
+
+def measure(service, stage):
+    env = dict(os.environ)
+    env.update(service_env(service, stage))
+    env.setdefault('AWS_DEFAULT_REGION', env['REGION'])
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', probe], cwd=os.path.join(root_dir, service),
+                          env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        sys.exit("Error importando %s:\n%s" % (service, proc.stderr[-2000:]))
+    packages = defaultdict(int)
+    for line in proc.stderr.splitlines():
+        match = import_line.match(line)
+        if match:
+            packages[match.group(4).split('.')[0]] += int(match.group(1))
+    return float(proc.stdout.strip().splitlines()[-1]) * 1000, {k: v / 1000 for k, v in packages.items()}
+
+
+def report(service, stage, runs):
+    totals = []
+    samples = defaultdict(list)
+    for _ in range(runs):
+        total, packages = measure(service, stage)
+        totals.append(total)
+        for name, ms in packages.items():
+            samples[name].append(ms)
+    return {
+        "total_ms": statistics.median(totals),
+        "packages_ms": {name: statistics.median(values) for name, values in samples.items()}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiempo de importación de app.py por paquete (arranque en frío)")
+    parser.add_argument('--stage', default='dev')
+    parser.add_argument('--runs', type=int, default=5, help="Repeticiones por servicio, se reporta la mediana")
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--save', help="Guarda el resultado en un archivo JSON")
+    parser.add_argument('--compare', help="Compara contra un resultado guardado con --save")
+    parser.add_argument('--max-regression', type=float, default=10.0,
+                        help="Porcentaje de aumento del total que se considera regresión")
+    parser.add_argument('services', nargs='*', default=services)
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+    for service in args.services:
+        result = report(service, args.stage, args.runs)
+        results[service] = result
+        previous = baseline.get(service, {})
+        print("== %s: %.1f ms" % (service, result['total_ms']) +
+              (" (antes %.1f ms)" % previous['total_ms'] if previous else ''))
+        ranking = sorted(result['packages_ms'].items(), key=lambda item: item[1], reverse=True)
+        for name, ms in ranking[:args.top]:
+            before = previous.get('packages_ms', {}).get(name)
+            print("  %-30s %8.1f ms" % (name, ms) + ("  %+8.1f ms" % (ms - before) if before is not None else ''))
+        if previous and result['total_ms'] > previous['total_ms'] * (1 + args.max_regression / 100):
+            regressions.append(service)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if regressions:
+        sys.exit("Regresión en el tiempo de arranque: %s" % ', '.join(regressions))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,30 +1,82 @@
 import json
 import os
-import aurora_data_api
-from chalice import Chalice, BadRequestError, ChaliceViewError, CognitoUserPoolAuthorizer, UnauthorizedError
-from cognitojwt import CognitoJWTException
-from pycognito import Cognito
-import cognitojwt
-import urllib.request
+from chalice import Chalice, BadRequestError, ChaliceViewError, CognitoUserPoolAuthorizer, UnauthorizedError, \
+    Response, CORSConfig
+from concurrent.futures import ThreadPoolExecutor
+from chalicelib import admission, db, timing
+from chalicelib.cache import TTLCache
+from chalicelib.cognito import CognitoPool, RateLimiter
+from chalicelib.pagination import decode_cursor, default_page_size, encode_cursor, parse_limit
+from chalicelib.rbac import PermissionIndex
+from chalicelib.tokens import CognitoJWTException, JWTVerifier, load_snapshot
 
 region = os.environ['REGION']
 user_pool_id = os.environ['COGNITO_USER_POOL_ID']
 client_id = os.environ['COGNITO_CLIENT_ID']
 client_secret = os.environ['COGNITO_CLIENT_SECRET']
-db_cluster_arn = os.environ['DB_CLUSTER_ARN']
-db_credentials_secret_arn = os.environ['DB_CREDENTIALS_SECRET_ARN']
-db_name = os.environ['DB_NAME']
 db_citizen_role_id = os.environ['DB_CITIZEN_ROL']
-u = Cognito(user_pool_id, client_id, client_secret=client_secret)
+permissions = PermissionIndex(check_interval=int(os.environ.get('RBAC_CHECK_INTERVAL', '30')),
+                              cache_size=int(os.environ.get('ACCESS_CACHE_SIZE', '1024')),
+                              cache_ttl=int(os.environ.get('ACCESS_CACHE_TTL', '60')),
+                              token_max_age_hours=int(os.environ.get('TOKEN_MAX_AGE_HOURS', '24')))
+catalog_cache = TTLCache(maxsize=1, ttl=int(os.environ.get('CATALOG_CACHE_TTL', '300')))
+jwks_snapshot = load_snapshot()
+cognito = CognitoPool(user_pool_id, client_id, client_secret=client_secret, pool_jwk=jwks_snapshot)
+executor = ThreadPoolExecutor(max_workers=int(os.environ.get('MAX_WORKERS', '8')))
+# Cognito tiene cuotas por categoría: la creación de usuarios, las operaciones administrativas y las lecturas se
+# limitan aparte
+signup_limiter = RateLimiter(float(os.environ.get('COGNITO_SIGNUP_RATE', '50')))
+admin_limiter = RateLimiter(float(os.environ.get('COGNITO_ADMIN_RATE', '25')))
+read_limiter = RateLimiter(float(os.environ.get('COGNITO_READ_RATE', '100')))
+# Cada usuario del listado cuesta un AdminGetUser, la página por defecto es menor que la del resto de listados
+user_list_page_size = int(os.environ.get('USER_LIST_PAGE_SIZE', '50'))
+user_list_max_page_size = int(os.environ.get('USER_LIST_MAX_PAGE_SIZE', '100'))
+user_fields = ('correo', 'password', 'nombres', 'apellidos', 'id_municipio', 'id_rol')
+# Con las cuotas por defecto un lote de 200 cuesta 4 s de registros más 8 s si hay que compensarlos, o 8 s de
+# eliminaciones, dentro del límite de 29 s de API Gateway
+user_batch_max = int(os.environ.get('USER_BATCH_MAX', '200'))
+insert_user_sql = """
+    INSERT INTO USUARIO (correo, nombres, apellidos, tipo_documento,
+                         numero_documento, celular, id_municipio, id_rol, id_terminos)
+    VALUES (:correo, :nombres, :apellidos, :tipo_documento,
+            :numero_documento, :celular, :id_municipio, :id_rol, :id_terminos)
+    """
+insert_role_change_sql = """
+    INSERT INTO CAMBIO_ROL (correo, id_rol) VALUES (:email, :id_rol)
+    """
+verifier = JWTVerifier(region, user_pool_id, jwks_path=os.environ.get('AWS_COGNITO_JWKS_PATH'),
+                       snapshot=jwks_snapshot, client_id=client_id)
 authorizer = CognitoUserPoolAuthorizer(os.environ['COGNITO_USER_POOL'],
                                        provider_arns=[os.environ['COGNITO_USER_POOL_ARN']])
-keys_url = 'https://cognito-idp.{}.amazonaws.com/{}/.well-known/jwks.json'.format(region, user_pool_id)
-with urllib.request.urlopen(keys_url) as f:
-    response = f.read()
-keys = json.loads(response.decode('utf-8'))['keys']
+
+# Escrituras que aceptan Idempotency-Key; login y logout quedan fuera para no guardar tokens
+idempotent_routes = {'/usuarios/registro', '/admin/usuarios', '/admin/usuarios/lote'}
 
 app = Chalice(app_name=os.environ['API_NAME'])
-app.api.cors = True
+app.api.cors = CORSConfig(allow_origin='*', allow_headers=['Idempotency-Key'],
+                          expose_headers=['X-Next-Cursor', 'Retry-After', 'Idempotent-Replayed'])
+
+
+@app.middleware('http')
+def request_timing(event, get_response):
+    with timing.request() as timer:
+        response = get_response(event)
+    timing.finish(timer, event, response)
+    return response
+
+
+@app.middleware('http')
+def admission_control(event, get_response):
+    return admission.admit(event, get_response, idempotent_routes, app.api.cors)
+
+
+@app.middleware('http')
+def db_transaction(event, get_response):
+    with db.transaction() as tx:
+        response = get_response(event)
+        if response.status_code >= 400:
+            tx.rollback()
+    return response
 
 
 @app.route('/admin/usuarios', methods=['GET'], authorizer=authorizer)
@@ -33,11 +85,19 @@ def get_admin_users():
     resource = app.current_request.method + '/admin/usuarios'
     try:
         if check_user_access(id_token, resource):
-            users = u.get_users()
-            users_list = []
-            for item in users:
-                users_list.append(item.__dict__.get('_data')['email'])
-            return json.dumps(get_users_db(users_list))
+            query_params = app.current_request.query_params or {}
+            users_list, next_cursor = get_users_db(
+                id_municipio=query_params.get('id_municipio'),
+                id_rol=query_params.get('id_rol'),
+                nombre=query_params.get('nombre'),
+                limit=parse_limit(query_params.get('limit'), user_list_page_size, user_list_max_page_size),
+                cursor=decode_cursor(query_params['cursor']) if 'cursor' in query_params else None)
+            attributes = get_cognito_users([user['correo'] for user in users_list])
+            # Se marca el usuario cuyos atributos de Cognito no se pudieron leer en lugar de omitirlos sin aviso
+            users_list = [{**attributes[user['correo']], **user} if user['correo'] in attributes
+                          else dict(user, atributos_cognito=False) for user in users_list]
+            headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
+            return Response(body=users_list, headers=headers)
         else:
             raise UnauthorizedError("El usuario no tiene acceso al recurso")
     except CognitoJWTException as e:
@@ -50,11 +110,14 @@ def get_admin_user(email):
     resource = app.current_request.method + '/admin/usuarios'
     try:
         if email:
+            # Primero el acceso, así un token sin permiso o vencido no consume la cuota de Cognito. Cognito y la
+            # base de datos no dependen entre sí y se consultan en paralelo
             if check_user_access(id_token, resource):
+                cognito_user = executor.submit(timing.bind(get_cognito_user), email)
+                profile = executor.submit(timing.bind(get_user_profile_db), email)
                 try:
-                    u.username = email
-                    user = u.admin_get_user().__dict__.get('_data')
-                    userdb = get_user_profile_db(email)
+                    user = cognito_user.result()
+                    userdb = profile.result()
                     return json.dumps({**user, **userdb})
                 except Exception as e:
                     print(e)
@@ -75,9 +138,10 @@ def get_user():
     id_token = app.current_request.headers["Authorization"][7:]
     try:
         email = get_token_claims(id_token)['email']
-        u.username = email
-        user = u.admin_get_user().__dict__.get('_data')
-        userdb = get_user_profile_db(email)
+        cognito_user = executor.submit(timing.bind(get_cognito_user), email)
+        profile = executor.submit(timing.bind(get_user_profile_db), email)
+        user = cognito_user.result()
+        userdb = profile.result()
         return json.dumps({**user, **userdb})
     except CognitoJWTException as e:
         raise UnauthorizedError("Token expirado")
@@ -90,8 +154,7 @@ def get_user():
 
 def check_user_exist(email):
     try:
-        u.username = email
-        u.admin_get_user()
+        cognito.user(username=email).admin_get_user()
         return True
     except Exception as e:
         return False
@@ -104,19 +167,25 @@ def create_user():
     try:
         if check_user_access(id_token, resource):
             body = app.current_request.json_body
-            if all(k in body for k in ('correo', 'password', 'nombres', 'apellidos', 'id_municipio', 'id_rol')):
+            if all(k in body for k in user_fields):
                 if check_user_exist(body['correo']):
                     raise BadRequestError("El usuario ya existe")
                 else:
-                    u.username = body['correo']
-                    u.set_base_attributes(email=body['correo'])
-                    user = u.register(body['correo'], body['password'])
+                    user_cognito = cognito.user(username=body['correo'])
+                    user_cognito.set_base_attributes(email=body['correo'])
+                    user = user_cognito.register(body['correo'], body['password'])
                     try:
-                        create_user_db(body)
+                        with db.transaction() as tx:
+                            create_user_db(body)
+                            stamp_user_role(body['correo'], body['id_rol'])
+                            # Se confirma aquí y no en el middleware para que un fallo al confirmar también
+                            # elimine el usuario de Cognito
+                            tx.commit()
                     except Exception as e:
                         delete_user_cognito(body['correo'])
                         print(e)
                         raise ChaliceViewError("Ocurrio un error al crear el usuario")
+                    invalidate_user_access(body['correo'])
                     return {
                         "status": "success",
                         "message": "Usuario creado"
@@ -142,9 +211,13 @@ def update_user():
                 else:
                     try:
                         update_user_db(body)
+                        if 'id_rol' in body:
+                            stamp_user_role(body['correo'], body['id_rol'])
                     except Exception as e:
                         print(e)
                         raise ChaliceViewError("Ocurrio un error al actualizar el usuario")
+                    if 'id_rol' in body:
+                        invalidate_user_access(body['correo'])
                     return {
                         "status": "success",
                         "message": "Usuario actualizado"
@@ -170,9 +243,11 @@ def delete_user(email):
                     try:
                         delete_user_cognito(email)
                         delete_user_db(email)
+                        record_role_change_db(email, None)
                     except Exception as e:
                         print(e)
                         raise ChaliceViewError("Ocurrio un error al eliminar el usuario")
+                    invalidate_user_access(email)
                     return {
                         "status": "success",
                         "message": "Usuario eliminado"
@@ -185,6 +260,54 @@ def delete_user(email):
         raise UnauthorizedError("Token expirado")
 
 
+@app.route('/admin/usuarios/lote', methods=['POST'], authorizer=authorizer)
+def create_user_batch():
+    id_token = app.current_request.headers["Authorization"][7:]
+    resource = app.current_request.method + '/admin/usuarios/lote'
+    try:
+        if check_user_access(id_token, resource):
+            users = parse_user_batch(app.current_request.json_body, 'usuarios')
+            results = create_user_batch_cognito(users)
+            created = len([r for r in results if r['status'] == 'success'])
+            return {
+                "status": "success",
+                "message": "Lote procesado",
+                "data": {
+                    "creados": created,
+                    "rechazados": len(results) - created,
+                    "resultados": results
+                }
+            }
+        else:
+            raise UnauthorizedError("El usuario no tiene acceso al recurso")
+    except CognitoJWTException as e:
+        raise UnauthorizedError("Token expirado")
+
+
+@app.route('/admin/usuarios/lote', methods=['DELETE'], authorizer=authorizer)
+def delete_user_batch():
+    id_token = app.current_request.headers["Authorization"][7:]
+    resource = app.current_request.method + '/admin/usuarios/lote'
+    try:
+        if check_user_access(id_token, resource):
+            emails = parse_user_batch(app.current_request.json_body, 'correos')
+            results = delete_user_batch_cognito(emails)
+            deleted = len([r for r in results if r['status'] == 'success'])
+            return {
+                "status": "success",
+                "message": "Lote procesado",
+                "data": {
+                    "eliminados": deleted,
+                    "rechazados": len(results) - deleted,
+                    "resultados": results
+                }
+            }
+        else:
+            raise UnauthorizedError("El usuario no tiene acceso al recurso")
+    except CognitoJWTException as e:
+        raise UnauthorizedError("Token expirado")
+
+
 @app.route('/usuarios/registro', methods=['POST'])
 def register_user():
     body = app.current_request.json_body
@@ -192,16 +315,23 @@ def register_user():
         if check_user_exist(body['correo']):
             raise BadRequestError("El usuario ya existe")
         else:
-            u.username = body['correo']
-            u.set_base_attributes(email=body['correo'])
-            user = u.register(body['correo'], body['password'] if 'password' in body else 'TempPassword2021')
+            user_cognito = cognito.user(username=body['correo'])
+            user_cognito.set_base_attributes(email=body['correo'])
+            user = user_cognito.register(body['correo'],
+                                         body['password'] if 'password' in body else 'TempPassword2021')
             body['id_rol'] = db_citizen_role_id
             try:
-                create_user_db(body)
+                with db.transaction() as tx:
+                    create_user_db(body)
+                    stamp_user_role(body['correo'], body['id_rol'])
+                    # Se confirma aquí y no en el middleware para que un fallo al confirmar también
+                    # elimine el usuario de Cognito
+                    tx.commit()
             except Exception as e:
                 delete_user_cognito(body['correo'])
                 print(e)
                 raise ChaliceViewError("Ocurrio un error al registrar el usuario")
+            invalidate_user_access(body['correo'])
             return {
                 "status": "success",
                 "message": "Registro exitoso"
@@ -215,15 +345,23 @@ def login_user():
     body = app.current_request.json_body
     if all(k in body for k in ('correo', 'password')):
         try:
-            u.username = body['correo']
-            u.authenticate(password=body['password'])
+            user_cognito = cognito.user(username=body['correo'])
+            user_cognito.authenticate(password=body['password'])
             user = get_user_profile_db(body['correo'])
+            if user and 'custom:id_rol' not in (user_cognito.id_claims or {}):
+                # Usuarios creados por lote o antes de estampar el rol, los siguientes tokens ya lo incluyen
+                try:
+                    stamp_user_role(body['correo'], user['id_rol'])
+                except Exception as e:
+                    # El token emitido no trae atributos de rol y se valida contra la base de datos, se
+                    # vuelve a intentar en el próximo login
+                    print(e)
             return {
-                "correo": u.username,
-                "token_type": u.token_type,
-                "access_token": u.access_token,
-                "refresh_token": u.refresh_token,
-                "id_token": u.id_token,
+                "correo": user_cognito.username,
+                "token_type": user_cognito.token_type,
+                "access_token": user_cognito.access_token,
+                "refresh_token": user_cognito.refresh_token,
+                "id_token": user_cognito.id_token,
                 "user_data": user
             }
         except Exception as e:
@@ -244,8 +382,7 @@ def logout_user():
     body = app.current_request.json_body
     if 'access_token' in body:
         try:
-            u.access_token = body['access_token']
-            u.logout()
+            cognito.user(access_token=body['access_token']).logout()
             return {
                 "status": "success",
                 "message": "Logout exitoso"
@@ -258,28 +395,22 @@ def logout_user():
 
 
 def create_user_db(user):
-    with aurora_data_api.connect(aurora_cluster_arn=db_cluster_arn, secret_arn=db_credentials_secret_arn,
-                                 database=db_name) as conn:
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                INSERT INTO USUARIO (correo, nombres, apellidos, tipo_documento, 
-                           numero_documento, celular, id_municipio, id_rol, id_terminos) 
-                           VALUES (:correo, :nombres, :apellidos, :tipo_documento, 
-                           :numero_documento, :celular, :id_municipio, :id_rol, :id_terminos)
-                """,
-                           {
-                               "correo": user["correo"],
-                               "nombres": user["nombres"],
-                               "apellidos": user["apellidos"],
-                               "tipo_documento": user["tipo_documento"] if "tipo_documento" in user else "",
-                               "numero_documento": user[
-                                   "numero_documento"] if "numero_documento" in user else "",
-                               "celular": user["celular"] if "celular" in user else "",
-                               "id_municipio": user["id_municipio"],
-                               "id_rol": user["id_rol"],
-                               "id_terminos": user["id_terminos"] if "id_terminos" in user else None
-                           }
-                           )
+    with db.cursor() as cursor:
+        cursor.execute(insert_user_sql, user_params(user))
+
+
+def user_params(user):
+    return {
+        "correo": user["correo"],
+        "nombres": user["nombres"],
+        "apellidos": user["apellidos"],
+        "tipo_documento": user["tipo_documento"] if "tipo_documento" in user else "",
+        "numero_documento": user["numero_documento"] if "numero_documento" in user else "",
+        "celular": user["celular"] if "celular" in user else "",
+        "id_municipio": user["id_municipio"],
+        "id_rol": user["id_rol"],
+        "id_terminos": user["id_terminos"] if "id_terminos" in user else None
+    }
 
 
 def update_user_db(user):
@@ -290,24 +421,35 @@ def update_user_db(user):
         sql += "%s = %s, " % (k, ":"+k)
     sql = sql[:-2] + " WHERE correo = :correo"
     params.update(correo=user['correo'])
-    with aurora_data_api.connect(aurora_cluster_arn=db_cluster_arn, secret_arn=db_credentials_secret_arn,
-                                 database=db_name) as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(sql, params)
+    with db.cursor() as cursor:
+        cursor.execute(sql, params)
 
 
 def delete_user_db(email):
     sql = "DELETE FROM USUARIO WHERE correo = :email"
-    with aurora_data_api.connect(aurora_cluster_arn=db_cluster_arn, secret_arn=db_credentials_secret_arn,
-                                 database=db_name) as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(sql, {"email": email})
+    with db.cursor() as cursor:
+        cursor.execute(sql, {"email": email})
+
+
+def record_role_change_db(email, id_rol):
+    with db.cursor() as cursor:
+        cursor.execute(insert_role_change_sql, {"email": email, "id_rol": id_rol})
+        return cursor.lastrowid
+
+
+def stamp_user_role(email, id_rol):
+    # El cliente de la app no debe tener permiso de escritura sobre custom:id_rol ni custom:version_rol, solo
+    # este llamado administrativo los cambia. Un error se propaga para que la operación falle y se deshaga
+    version = record_role_change_db(email, id_rol)
+    cognito.user(username=email).admin_update_profile({
+        "custom:id_rol": str(id_rol),
+        "custom:version_rol": str(version)
+    })
 
 
 def delete_user_cognito(email):
     try:
-        u.username = email
-        u.admin_delete_user()
+        cognito.user(username=email).admin_delete_user()
     except Exception as e:
         return {
             "status": "error",
@@ -315,94 +457,319 @@ def delete_user_cognito(email):
         }
 
 
-def get_users_db(email_list):
-    format_list = ''
+def parse_user_batch(body, key):
+    items = body.get(key) if isinstance(body, dict) else None
+    if not isinstance(items, list) or not items:
+        raise BadRequestError("El campo " + key + " es obligatorio")
+    if len(items) > user_batch_max:
+        raise BadRequestError("El lote supera el máximo de %d usuarios" % user_batch_max)
+    return items
+
+
+def validate_user(user, seen):
+    if not isinstance(user, dict):
+        return "El usuario debe ser un objeto"
+    if not all(k in user for k in user_fields):
+        return "Campos obligatorios incompletos"
+    if user['correo'] in seen:
+        return "El usuario está repetido en el lote"
+    if int(user['id_municipio']) not in get_municipios():
+        return "El municipio no existe"
+    if not permissions.resources(int(user['id_rol'])):
+        return "El rol no existe"
+    return None
+
+
+def throttled(func, limiter):
+    def run(*args):
+        limiter.wait()
+        return func(*args)
+    return timing.bind(run)
+
+
+def create_user_batch_cognito(users):
+    results = [None] * len(users)
+    valid = []
+    seen = set()
+    for index, user in enumerate(users):
+        try:
+            error = validate_user(user, seen)
+        except (TypeError, ValueError):
+            error = "Campos no válidos"
+        if error:
+            results[index] = {"indice": index, "status": "error", "message": error}
+        else:
+            seen.add(user['correo'])
+            valid.append(index)
+    existing = get_existing_users_db([users[i]['correo'] for i in valid])
+    for index in [i for i in valid if users[i]['correo'] in existing]:
+        results[index] = {"indice": index, "correo": users[index]['correo'], "status": "error",
+                          "message": "El usuario ya existe"}
+    valid = [i for i in valid if users[i]['correo'] not in existing]
+
+    def register(index):
+        user_cognito = cognito.user(username=users[index]['correo'])
+        user_cognito.set_base_attributes(email=users[index]['correo'])
+        try:
+            user_cognito.register(users[index]['correo'], users[index]['password'])
+            return index, None
+        except Exception as e:
+            print(e)
+            return index, "El usuario ya existe" if "UsernameExistsException" in str(e) else \
+                "Ocurrio un error al crear el usuario"
+
+    # Los registros en Cognito corren en paralelo con el executor y respetando la cuota de la API
+    registered = []
+    for index, error in executor.map(throttled(register, signup_limiter), valid):
+        if error:
+            results[index] = {"indice": index, "correo": users[index]['correo'], "status": "error", "message": error}
+        else:
+            registered.append(index)
+    try:
+        with db.transaction() as tx:
+            ids = create_users_db([user_params(users[i]) for i in registered]) if registered else []
+            # Se confirma aquí para que un fallo al confirmar también compense los registros en Cognito
+            tx.commit()
+    except Exception as e:
+        print(e)
+        delete_users_cognito([users[i]['correo'] for i in registered])
+        raise ChaliceViewError("Ocurrio un error al crear el lote de usuarios")
+    created = [i for i, id_user in zip(registered, ids) if id_user]
+    # Compensación por elemento: la fila que la base de datos no aceptó no deja usuario huérfano en Cognito
+    rejected = [i for i, id_user in zip(registered, ids) if not id_user]
+    delete_users_cognito([users[i]['correo'] for i in rejected])
+    for index in rejected:
+        results[index] = {"indice": index, "correo": users[index]['correo'], "status": "error",
+                          "message": "Ocurrio un error al crear el usuario"}
+    # El rol se estampa en Cognito con el primer login, así el lote no paga una llamada más por usuario
+    for index in created:
+        invalidate_user_access(users[index]['correo'])
+        results[index] = {"indice": index, "correo": users[index]['correo'], "status": "success"}
+    return results
+
+
+def delete_user_batch_cognito(emails):
+    results = [None] * len(emails)
+    valid = []
+    seen = set()
+    for index, email in enumerate(emails):
+        if not isinstance(email, str) or not email:
+            results[index] = {"indice": index, "status": "error", "message": "El campo correo es obligatorio"}
+        elif email in seen:
+            results[index] = {"indice": index, "correo": email, "status": "error",
+                              "message": "El usuario está repetido en el lote"}
+        else:
+            seen.add(email)
+            valid.append(index)
+
+    # La base de datos se actualiza primero: si falla no se toca Cognito, y un usuario que después no se pueda
+    # eliminar de Cognito ya no tiene perfil ni rol con los que operar
+    existing = get_existing_users_db([emails[i] for i in valid])
+    in_db = [i for i in valid if emails[i] in existing]
+    if in_db:
+        try:
+            with db.transaction() as tx:
+                delete_users_db([emails[i] for i in in_db])
+                db.execute_batch(insert_role_change_sql, [{"email": emails[i], "id_rol": None} for i in in_db])
+                tx.commit()
+        except Exception as e:
+            print(e)
+            raise ChaliceViewError("Ocurrio un error al eliminar el lote de usuarios")
+        for index in in_db:
+            invalidate_user_access(emails[index])
+    in_db = set(in_db)
+
+    def delete(index):
+        try:
+            cognito.user(username=emails[index]).admin_delete_user()
+            return index, None
+        except Exception as e:
+            print(e)
+            if "UserNotFoundException" in str(e):
+                # Sin fila en la base de datos tampoco existía; con fila, Cognito ya lo había eliminado
+                return index, None if index in in_db else "El usuario no existe"
+            return index, "El usuario se eliminó de la base de datos pero no de Cognito" if index in in_db else \
+                "Ocurrio un error al eliminar el usuario"
+
+    for index, error in executor.map(throttled(delete, admin_limiter), valid):
+        if error:
+            results[index] = {"indice": index, "correo": emails[index], "status": "error", "message": error}
+        else:
+            results[index] = {"indice": index, "correo": emails[index], "status": "success"}
+    return results
+
+
+def create_users_db(params):
+    try:
+        return db.execute_batch(insert_user_sql, params)
+    except db.get_client().exceptions.BadRequestException as e:
+        # Una fila que la base de datos rechaza hace fallar todo el lote, se deshace y se inserta fila por fila
+        # para dejar sin id solo la que falla
+        print(e)
+        with db.transaction() as tx:
+            tx.rollback()
+        return [create_user_row_db(p) for p in params]
+
+
+def create_user_row_db(params):
+    try:
+        return db.execute_batch(insert_user_sql, [params])[0]
+    except db.get_client().exceptions.BadRequestException as e:
+        print(e)
+        return None
+
+
+def delete_users_cognito(email_list):
+    list(executor.map(throttled(delete_user_cognito, admin_limiter), email_list))
+
+
+def get_existing_users_db(email_list):
+    existing = set()
+    if not email_list:
+        return existing
+    with db.read_cursor() as cursor:
+        cursor.execute("""
+            SELECT correo
+            FROM USUARIO
+            WHERE correo IN (%s)
+            """ % ','.join(':' + str(i) for i in range(len(email_list))),
+                       {str(i): email_list[i] for i in range(len(email_list))})
+        for reg in cursor:
+            existing.add(reg[0])
+    return existing
+
+
+def delete_users_db(email_list):
+    with db.cursor() as cursor:
+        cursor.execute("DELETE FROM USUARIO WHERE correo IN (%s)" % ','.join(
+            ':' + str(i) for i in range(len(email_list))), {str(i): email_list[i] for i in range(len(email_list))})
+
+
+def get_users_db(id_municipio=None, id_rol=None, nombre=None, limit=default_page_size, cursor=None):
     users_list = []
-    for i in range(0, len(email_list)):
-        format_list += ',:' + str(i)
-    with aurora_data_api.connect(aurora_cluster_arn=db_cluster_arn, secret_arn=db_credentials_secret_arn,
-                                 database=db_name) as conn:
-        with conn.cursor() as cursor:
-            cursor.execute("""
-            SELECT u.correo, u.nombres, u.apellidos, u.tipo_documento, 
-            u.numero_documento, u.celular
-            FROM USUARIO u
-            WHERE u.correo in (%s)
-            """ % format_list[1:], {str(i): email_list[i] for i in range(0, len(email_list))})
-            for reg in cursor:
-                user = {}
-                user.update(correo=reg[0])
-                user.update(nombres=reg[1])
-                user.update(apellidos=reg[2])
-                user.update(tipo_documento=reg[3])
-                user.update(numero_documento=reg[4])
-                user.update(celular=reg[5])
-                users_list.append(user)
-            return users_list
+    query = """
+        SELECT u.correo, u.nombres, u.apellidos, u.tipo_documento,
+        u.numero_documento, u.celular, u.id_municipio, u.id_rol
+        FROM USUARIO u
+        WHERE 1 = 1
+        """
+    params = {}
+    if id_municipio:
+        query += " AND u.id_municipio = :id_municipio"
+        params.update(id_municipio=id_municipio)
+    if id_rol:
+        query += " AND u.id_rol = :id_rol"
+        params.update(id_rol=id_rol)
+    if nombre:
+        query += " AND (u.nombres LIKE :nombre OR u.apellidos LIKE :nombre)"
+        params.update(nombre=nombre.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+    if cursor:
+        if len(cursor) != 1:
+            raise BadRequestError("El cursor no es válido")
+        query += " AND u.correo > :cursor_correo"
+        params.update(cursor_correo=cursor[0])
+    query += " ORDER BY u.correo LIMIT %d" % (limit + 1)
+    with db.read_cursor() as db_cursor:
+        db_cursor.execute(query, params)
+        for reg in db_cursor:
+            user = {}
+            user.update(correo=reg[0])
+            user.update(nombres=reg[1])
+            user.update(apellidos=reg[2])
+            user.update(tipo_documento=reg[3])
+            user.update(numero_documento=reg[4])
+            user.update(celular=reg[5])
+            user.update(id_municipio=reg[6])
+            user.update(id_rol=reg[7])
+            users_list.append(user)
+    next_cursor = None
+    if len(users_list) > limit:
+        users_list = users_list[:limit]
+        next_cursor = encode_cursor([users_list[-1]['correo']])
+    return users_list, next_cursor
+
+
+def get_cognito_user(email):
+    from pycognito import cognito_to_dict
+    user = cognito.client.admin_get_user(UserPoolId=user_pool_id, Username=email)
+    return cognito_to_dict(user.get('UserAttributes', []))
+
+
+def get_cognito_users(email_list):
+    def get_attributes(email):
+        try:
+            return email, get_cognito_user(email)
+        except Exception as e:
+            print(e)
+            return email, None
+
+    return {email: attributes
+            for email, attributes in executor.map(throttled(get_attributes, read_limiter), email_list)
+            if attributes is not None}
 
 
 def get_user_profile_db(email):
-    with aurora_data_api.connect(aurora_cluster_arn=db_cluster_arn, secret_arn=db_credentials_secret_arn,
-                                 database=db_name) as conn:
-        with conn.cursor() as cursor:
+    with db.read_cursor() as cursor:
+        cursor.execute("""
+        SELECT u.correo, u.nombres, u.apellidos, u.tipo_documento, 
+        u.numero_documento, u.celular, r.id AS id_rol, r.nombre AS rol, u.id_municipio
+        FROM USUARIO u, ROL r
+        WHERE u.id_rol = r.id AND u.correo = :email
+        """, {"email": email})
+        reg = cursor.fetchone()
+    user = {}
+    if reg is None:
+        return user
+    # Municipio y recursos son catálogos compartidos entre usuarios, no se repiten por cada recurso del rol
+    resources = permissions.resources(reg[6])
+    municipio = get_municipios().get(reg[8])
+    if not resources or municipio is None:
+        return user
+    user.update(correo=reg[0])
+    user.update(nombres=reg[1])
+    user.update(apellidos=reg[2])
+    user.update(tipo_documento=reg[3])
+    user.update(numero_documento=reg[4])
+    user.update(celular=reg[5])
+    user.update(id_rol=reg[6])
+    user.update(rol=reg[7])
+    user.update(id_municipio=reg[8])
+    user.update(municipio=municipio['nombre'])
+    user.update(logo=municipio['logo'])
+    user.update(slogan=municipio['slogan'])
+    user.update(resources=list(resources))
+    return user
+
+
+def get_municipios():
+    municipios = catalog_cache.get('municipios')
+    if municipios is None:
+        municipios = {}
+        with db.read_cursor() as cursor:
             cursor.execute("""
-            SELECT u.correo, u.nombres, u.apellidos, u.tipo_documento, 
-            u.numero_documento, u.celular, r.id AS id_rol, r.nombre AS rol, 
-            m.id AS id_municipio, m.nombre AS municipio, m.logo, m.slogan, re.path
-            FROM USUARIO u, ROL r, MUNICIPIO m, ROL_RECURSO rr, RECURSO re
-            WHERE u.id_rol = r.id AND u.id_municipio = m.id 
-            AND u.id_rol = rr.id_rol AND rr.id_recurso = re.id
-            AND u.correo = :email
-            """, {"email": email})
-            user = {}
-            resources = []
+            SELECT id, nombre, logo, slogan
+            FROM MUNICIPIO
+            """)
             for reg in cursor:
-                user.update(correo=reg[0])
-                user.update(nombres=reg[1])
-                user.update(apellidos=reg[2])
-                user.update(tipo_documento=reg[3])
-                user.update(numero_documento=reg[4])
-                user.update(celular=reg[5])
-                user.update(id_rol=reg[6])
-                user.update(rol=reg[7])
-                user.update(id_municipio=reg[8])
-                user.update(municipio=reg[9])
-                user.update(logo=reg[10])
-                user.update(slogan=reg[11])
-                resources.append(reg[12])
-                user.update(resources=resources)
-            return user
+                municipios[reg[0]] = {"nombre": reg[1], "logo": reg[2], "slogan": reg[3]}
+        catalog_cache.set('municipios', municipios)
+    return municipios
 
 
 def check_user_access(id_token, resource):
-    user_claims = get_token_claims(id_token)
-    if user_claims:
-        email = user_claims.get('email')
-        with aurora_data_api.connect(aurora_cluster_arn=db_cluster_arn, secret_arn=db_credentials_secret_arn,
-                                     database=db_name) as conn:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                SELECT re.nombre AS recurso, re.path
-                FROM USUARIO u, ROL r, ROL_RECURSO rr, RECURSO re
-                WHERE rr.id_rol = r.id AND rr.id_recurso = re.id
-                AND u.id_rol = r.id
-                AND u.correo = :email and re.path = :resource
-                """, {
-                    "email": email,
-                    "resource": resource
-                })
-                if cursor.rowcount > 0:
-                    return True
-                else:
-                    return False
-    else:
-        return False
+    with timing.phase('acceso'):
+        user_claims = get_token_claims(id_token)
+        if user_claims:
+            return permissions.check(user_claims, resource)
+        else:
+            return False
+
+
+def invalidate_user_access(email):
+    permissions.forget(email)
 
 
 def get_token_claims(id_token):
-    verified_claims: dict = cognitojwt.decode(
-        id_token,
-        region,
-        user_pool_id
-    )
+    with timing.phase('jwt'):
+        verified_claims: dict = verifier.decode(id_token)
     return verified_claims
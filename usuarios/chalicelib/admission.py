@@ -0,0 +1,198 @@
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+
+from chalice import Response
+
+from chalicelib.cache import TTLCache
+
+write_methods = ('POST', 'PUT', 'DELETE')
+write_rate = float(os.environ.get('WRITE_RATE_LIMIT', '2'))
+write_burst = float(os.environ.get('WRITE_RATE_BURST', '20'))
+# Login, registro y logout llegan sin token y se cuentan por IP: detrás de un NAT comparten balde muchos usuarios
+public_write_rate = float(os.environ.get('PUBLIC_WRITE_RATE_LIMIT', '20'))
+public_write_burst = float(os.environ.get('PUBLIC_WRITE_RATE_BURST', '200'))
+idempotency_ttl = int(os.environ.get('IDEMPOTENCY_TTL', '86400'))
+idempotency_lock_ttl = int(os.environ.get('IDEMPOTENCY_LOCK_TTL', '60'))
+idempotency_key_max_length = 255
+
+
+class MemoryStore:
+
+    def __init__(self, maxsize=10000):
+        self._cache = TTLCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value, ttl):
+        self._cache.set(key, value, ttl)
+
+    def compare_and_set(self, key, expected, value, ttl):
+        with self._lock:
+            if self._cache.get(key) != expected:
+                return False
+            self._cache.set(key, value, ttl)
+            return True
+
+    def delete(self, key):
+        self._cache.discard(key)
+
+
+class DynamoDBStore:
+    # Tabla con llave de partición "llave" (S) y TTL de DynamoDB sobre "expira"
+
+    def __init__(self, table):
+        self.table = table
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            self._client = boto3.client('dynamodb')
+        return self._client
+
+    def get(self, key):
+        item = self.client.get_item(TableName=self.table, Key={'llave': {'S': key}},
+                                    ConsistentRead=True).get('Item')
+        # El borrado por TTL de DynamoDB puede tardar, los vencidos se descartan al leer
+        if item is None or int(item['expira']['N']) <= time.time():
+            return None
+        return item['valor']['S']
+
+    def _item(self, key, value, ttl):
+        return {'llave': {'S': key}, 'valor': {'S': value}, 'expira': {'N': str(int(time.time() + ttl))}}
+
+    def set(self, key, value, ttl):
+        self.client.put_item(TableName=self.table, Item=self._item(key, value, ttl))
+
+    def compare_and_set(self, key, expected, value, ttl):
+        if expected is None:
+            condition = {'ConditionExpression': 'attribute_not_exists(llave) OR expira <= :ahora',
+                         'ExpressionAttributeValues': {':ahora': {'N': str(int(time.time()))}}}
+        else:
+            condition = {'ConditionExpression': 'valor = :esperado',
+                         'ExpressionAttributeValues': {':esperado': {'S': expected}}}
+        try:
+            self.client.put_item(TableName=self.table, Item=self._item(key, value, ttl), **condition)
+            return True
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def delete(self, key):
+        self.client.delete_item(TableName=self.table, Key={'llave': {'S': key}})
+
+
+def get_store(url):
+    if not url:
+        return None
+    if url.startswith('memory://'):
+        if os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+            # Cada instancia de Lambda tendría sus propios baldes y su propio registro de idempotencia
+            raise ValueError("El almacén de admisión memory:// solo se admite en local, use dynamodb://")
+        return MemoryStore()
+    if url.startswith('dynamodb://'):
+        return DynamoDBStore(url[len('dynamodb://'):])
+    raise ValueError("El almacén de admisión no es válido: " + url)
+
+
+class TokenBucket:
+
+    def __init__(self, store, rate, burst, attempts=5):
+        self.store = store
+        self.rate = rate
+        self.burst = burst
+        self.attempts = attempts
+
+    def take(self, key, cost=1):
+        # Devuelve si se admite la petición y, si no, los segundos hasta que haya fichas
+        if self.store is None or self.rate <= 0:
+            return True, 0
+        for _ in range(self.attempts):
+            current = self.store.get(key)
+            now = time.time()
+            tokens, updated = json.loads(current) if current else (self.burst, now)
+            tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+            if tokens < cost:
+                return False, (cost - tokens) / self.rate
+            # La entrada vence cuando el balde estaría lleno de nuevo, equivale a no tenerla
+            if self.store.compare_and_set(key, current, json.dumps([tokens - cost, now]),
+                                          math.ceil(self.burst / self.rate) + 1):
+                return True, 0
+        # Con tanta contención sobre la misma llave la petición se descarta
+        return False, 1 / self.rate
+
+
+store = get_store(os.environ.get('ADMISSION_STORE_URL', 'memory://'))
+write_limiter = TokenBucket(store, write_rate, write_burst)
+public_write_limiter = TokenBucket(store, public_write_rate, public_write_burst)
+
+
+def caller(event):
+    # Los claims del authorizer de API Gateway ya vienen verificados, sin token se usa la IP de origen
+    claims = (event.context.get('authorizer') or {}).get('claims') or {}
+    if claims.get('sub'):
+        return 'usuario:' + claims['sub']
+    return 'ip:' + ((event.context.get('identity') or {}).get('sourceIp') or 'desconocida')
+
+
+def fingerprint(event):
+    data = json.dumps([event.method, event.path, event.uri_params, event.query_params], sort_keys=True,
+                      default=str).encode('utf-8') + b'\n' + (event.raw_body or b'')
+    return hashlib.sha256(data).hexdigest()
+
+
+def error_response(status_code, code, message, headers):
+    return Response(body={"Code": code, "Message": message}, headers=headers, status_code=status_code)
+
+
+def admit(event, get_response, idempotent_routes, cors=None):
+    if event.method not in write_methods:
+        return get_response(event)
+    headers = dict(cors.get_access_control_headers()) if cors is not None and cors is not True else {}
+    identity = caller(event)
+    limiter = public_write_limiter if identity.startswith('ip:') else write_limiter
+    allowed, retry_after = limiter.take('cuota:' + identity)
+    if not allowed:
+        headers.update({'Retry-After': str(max(1, math.ceil(retry_after)))})
+        return error_response(429, 'TooManyRequestsError', "Demasiadas peticiones, intente más tarde", headers)
+    key = event.headers.get('Idempotency-Key')
+    if not key or event.path not in idempotent_routes or store is None:
+        return get_response(event)
+    if len(key) > idempotency_key_max_length:
+        return error_response(400, 'BadRequestError', "La llave de idempotencia no es válida", headers)
+    return replay_or_run(event, get_response, 'idempotencia:' + identity + ':' + key, headers)
+
+
+def replay_or_run(event, get_response, key, headers):
+    request_fingerprint = fingerprint(event)
+    lock = json.dumps({"estado": "en_proceso", "huella": request_fingerprint})
+    if not store.compare_and_set(key, None, lock, idempotency_lock_ttl):
+        record = json.loads(store.get(key) or lock)
+        if record['huella'] != request_fingerprint:
+            return error_response(422, 'UnprocessableEntityError',
+                                  "La llave de idempotencia ya se usó con otra petición", headers)
+        if record['estado'] == 'en_proceso':
+            headers.update({'Retry-After': '1'})
+            return error_response(409, 'ConflictError', "La petición con esta llave aún está en proceso", headers)
+        # La respuesta guardada se entrega sin volver a tocar la base de datos ni Cognito
+        return Response(body=record['body'], headers=dict(record['headers'], **{'Idempotent-Replayed': 'true'}),
+                        status_code=record['status'])
+    try:
+        response = get_response(event)
+    except BaseException:
+        store.delete(key)
+        raise
+    if response.status_code >= 500 or response.status_code == 429:
+        # Un error transitorio no se guarda, el reintento con la misma llave vuelve a ejecutarse
+        store.delete(key)
+    else:
+        store.set(key, json.dumps({"estado": "completada", "huella": request_fingerprint,
+                                   "status": response.status_code, "body": response.body,
+                                   "headers": response.headers}, default=str), idempotency_ttl)
+    return response
@@ -0,0 +1,82 @@
+import functools
+import threading
+import time
+
+from chalicelib import timing
+
+
+class CognitoPool:
+
+    def __init__(self, user_pool_id, client_id, client_secret=None, pool_jwk=None):
+        self.user_pool_id = user_pool_id
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.user_pool_region = user_pool_id.split('_')[0]
+        self.pool_jwk = pool_jwk
+        self.stats = {'clients_created': 0, 'clients_reused': 0}
+        self._client = None
+        self._lock = threading.Lock()
+        self._session = _SharedSession(self)
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                import boto3
+                self._client = timing.instrument(boto3.client('cognito-idp', region_name=self.user_pool_region),
+                                                 'cognito')
+                self.stats['clients_created'] += 1
+            else:
+                self.stats['clients_reused'] += 1
+            return self._client
+
+    def user(self, username=None, access_token=None):
+        return pooled_cognito_class()(self, username=username, access_token=access_token)
+
+
+class RateLimiter:
+    # Espacia las llamadas de todos los hilos para no superar la cuota por segundo de la API de Cognito
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+@functools.lru_cache(maxsize=None)
+def pooled_cognito_class():
+    # pycognito se importa con el primer uso y no en el arranque del contenedor
+    from pycognito import Cognito
+
+    class PooledCognito(Cognito):
+        # Objeto de un solo request: el estado del usuario es propio y el cliente boto3 es el del pool
+
+        def __init__(self, pool, **kwargs):
+            self.pool = pool
+            super().__init__(pool.user_pool_id, pool.client_id, client_secret=pool.client_secret,
+                             session=pool._session, **kwargs)
+
+        def get_keys(self):
+            if self.pool.pool_jwk is None:
+                self.pool.pool_jwk = super().get_keys()
+            self.pool_jwk = self.pool.pool_jwk
+            return self.pool_jwk
+
+    return PooledCognito
+
+
+class _SharedSession:
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def client(self, service_name, **kwargs):
+        return self.pool.client
@@ -0,0 +1,36 @@
+import base64
+import json
+import os
+
+from chalice import BadRequestError
+
+default_page_size = int(os.environ.get('PAGE_SIZE', '200'))
+max_page_size = int(os.environ.get('MAX_PAGE_SIZE', '1000'))
+
+
+def encode_cursor(values):
+    data = json.dumps(values, separators=(',', ':'), default=str).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(data.decode('utf-8'))
+    except ValueError:
+        raise BadRequestError("El cursor no es válido")
+    if not isinstance(values, list):
+        raise BadRequestError("El cursor no es válido")
+    return values
+
+
+def parse_limit(value, default=default_page_size, maximum=max_page_size):
+    if value is None:
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise BadRequestError("El campo limit debe ser numérico")
+    if limit < 1:
+        raise BadRequestError("El campo limit debe ser mayor que cero")
+    return min(limit, maximum)
@@ -0,0 +1,108 @@
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+sample_rate = float(os.environ.get('TIMING_SAMPLE_RATE', '0.01'))
+slow_request_ms = float(os.environ.get('TIMING_SLOW_MS', '1000'))
+server_timing = os.environ.get('SERVER_TIMING', 'false').lower() == 'true'
+
+_request = threading.local()
+
+
+class RequestTimer:
+
+    def __init__(self, sampled):
+        self.sampled = sampled
+        self.phases = {}
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        # Las fases pueden ocurrir en los hilos del executor, por eso el lock
+        with self._lock:
+            total, count = self.phases.get(name, (0.0, 0))
+            self.phases[name] = (total + seconds, count + 1)
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self._start) * 1000
+
+
+@contextmanager
+def request():
+    _request.timer = RequestTimer(sample_rate > 0 and random.random() < sample_rate)
+    try:
+        yield _request.timer
+    finally:
+        _request.timer = None
+
+
+@contextmanager
+def phase(name):
+    timer = getattr(_request, 'timer', None)
+    if timer is None or not timer.sampled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - start)
+
+
+def bind(func):
+    timer = getattr(_request, 'timer', None)
+
+    def run(*args, **kwargs):
+        previous = getattr(_request, 'timer', None)
+        _request.timer = timer
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _request.timer = previous
+    return run
+
+
+class InstrumentedClient:
+    # Cada llamada del cliente boto3 (o de un cliente falso) se suma a la fase del servicio
+
+    def __init__(self, client, name):
+        self._client = client
+        self._name = name
+
+    def __getattr__(self, attribute):
+        value = getattr(self._client, attribute)
+        if attribute.startswith('_') or not callable(value) or isinstance(value, type):
+            return value
+
+        def call(*args, **kwargs):
+            with phase(self._name):
+                return value(*args, **kwargs)
+        return call
+
+
+def instrument(client, name):
+    return InstrumentedClient(client, name)
+
+
+def finish(timer, event, response):
+    total_ms = timer.elapsed_ms()
+    if timer.sampled and server_timing:
+        response.headers['Server-Timing'] = ', '.join(
+            ['%s;dur=%.1f;desc="%d"' % (name, total * 1000, count) for name, (total, count) in timer.phases.items()] +
+            ['total;dur=%.1f' % total_ms])
+        response.headers['Timing-Allow-Origin'] = '*'
+    if timer.sampled or total_ms >= slow_request_ms or response.status_code >= 500:
+        print(json.dumps({
+            "tipo": "peticion",
+            "request_id": event.context.get('requestId'),
+            "metodo": event.method,
+            "ruta": event.path,
+            "estado": response.status_code,
+            "duracion_ms": round(total_ms, 1),
+            "muestreada": timer.sampled,
+            "fases": {name: {"ms": round(total * 1000, 1), "llamadas": count}
+                      for name, (total, count) in timer.phases.items()}
+        }, separators=(',', ':')))
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from chalicelib.cache import TTLCache
+
+KEYS_URL_TEMPLATE = 'https://cognito-idp.{}.amazonaws.com/{}/.well-known/jwks.json'
+ISSUER_TEMPLATE = 'https://cognito-idp.{}.amazonaws.com/{}'
+snapshot_path = os.environ.get('JWKS_SNAPSHOT') or \
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jwks.json')
+
+
+class CognitoJWTException(Exception):
+    pass
+
+
+def load_snapshot(path=snapshot_path):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return json.loads(f.read().decode('utf-8'))
+
+
+class JWTVerifier:
+
+    def __init__(self, region, user_pool_id, jwks_path=None, jwks_ttl=86400, refresh_interval=60,
+                 cache_size=4096, snapshot=None, client_id=None):
+        self.keys_url = jwks_path or KEYS_URL_TEMPLATE.format(region, user_pool_id)
+        self.issuer = ISSUER_TEMPLATE.format(region, user_pool_id)
+        self.client_id = client_id
+        self.jwks_ttl = jwks_ttl
+        self.refresh_interval = refresh_interval
+        self.claims_cache = TTLCache(maxsize=cache_size)
+        self.jwks_fetches = 0
+        self._snapshot = snapshot
+        self._keys = {}
+        self._loaded_at = None
+        self._from_snapshot = False
+        self._lock = threading.Lock()
+
+    def _fetch_keys(self):
+        if self.keys_url.startswith('http'):
+            import urllib.request
+            with urllib.request.urlopen(self.keys_url) as f:
+                response = f.read()
+        else:
+            with open(self.keys_url, 'rb') as f:
+                response = f.read()
+        return json.loads(response.decode('utf-8'))['keys']
+
+    def _refresh(self, force=False):
+        from jose import jwk
+        with self._lock:
+            now = time.monotonic()
+            if self._loaded_at is None and self._snapshot:
+                # El JWKS empaquetado con el despliegue evita la descarga en el arranque en frío
+                self._keys = {k['kid']: jwk.construct(k) for k in self._snapshot['keys']}
+                self._loaded_at = now
+                self._from_snapshot = True
+                return
+            if self._loaded_at is not None:
+                age = now - self._loaded_at
+                # Un kid desconocido solo fuerza la descarga si el JWKS no se bajó hace poco
+                if age < self.jwks_ttl and (not force or (age < self.refresh_interval and not self._from_snapshot)):
+                    return
+            keys = self._fetch_keys()
+            self._keys = {k['kid']: jwk.construct(k) for k in keys}
+            self._loaded_at = now
+            self._from_snapshot = False
+            self.jwks_fetches += 1
+
+    def get_public_key(self, kid):
+        self._refresh()
+        if kid not in self._keys:
+            self._refresh(force=True)
+        key = self._keys.get(kid)
+        if key is None:
+            raise CognitoJWTException('Public key not found in jwks.json')
+        return key
+
+    def decode(self, token):
+        digest = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        claims = self.claims_cache.get(digest)
+        if claims is not None:
+            return claims
+        from jose import jwt
+        from jose.exceptions import JOSEError
+        from jose.utils import base64url_decode
+        try:
+            message, encoded_signature = token.rsplit('.', 1)
+            kid = jwt.get_unverified_header(token)['kid']
+            public_key = self.get_public_key(kid)
+            if not public_key.verify(message.encode('utf-8'),
+                                     base64url_decode(encoded_signature.encode('utf-8'))):
+                raise CognitoJWTException('Signature verification failed')
+            claims = jwt.get_unverified_claims(token)
+        except (ValueError, KeyError, JOSEError) as e:
+            raise CognitoJWTException('Invalid token') from e
+        ttl = claims.get('exp', 0) - time.time()
+        if ttl <= 0:
+            raise CognitoJWTException('Token is expired')
+        if claims.get('iss') != self.issuer:
+            raise CognitoJWTException('Token was not issued by this user pool')
+        # El token de identidad trae el cliente en aud y el de acceso en client_id
+        if self.client_id and claims.get('aud', claims.get('client_id')) != self.client_id:
+            raise CognitoJWTException('Token was not issued for this app client')
+        self.claims_cache.set(digest, claims, ttl=ttl)
+        return claims
+
+    def stats(self):
+        return {**self.claims_cache.stats(), 'jwks_fetches': self.jwks_fetches}
@@ -0,0 +1,56 @@
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import pytest
+
+service_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, service_dir)
+sys.path.insert(0, os.path.join(os.path.dirname(service_dir), 'tools'))
+
+from chalicelib.cognito import CognitoPool  # noqa: E402
+from fakes import FakeCognitoIdp  # noqa: E402
+
+user_pool_id = 'us-east-1_test'
+client_id = 'test-client'
+
+
+@pytest.fixture
+def fake_idp(monkeypatch):
+    # Sin issuer: el flujo de login no se usa, solo registro, consulta y eliminación
+    idp = FakeCognitoIdp(issuer=None, latency=0.002)
+    created = []
+
+    def client(service_name, **kwargs):
+        created.append(service_name)
+        return idp
+
+    monkeypatch.setattr(boto3, 'client', client)
+    idp.created = created
+    return idp
+
+
+def test_concurrent_requests_do_not_share_user_state(fake_idp):
+    pool = CognitoPool(user_pool_id, client_id, client_secret='test-secret', pool_jwk={'keys': []})
+    emails = ['usuario%03d@sis247.test' % n for n in range(200)]
+
+    def cycle(email):
+        # Registro, consulta y eliminación con un objeto por paso, como lo hacen los handlers de usuarios
+        user = pool.user(username=email)
+        user.set_base_attributes(email=email, name=email.split('@')[0])
+        user.register(email, 'Password2021!')
+        attributes = pool.user(username=email).admin_get_user()._data
+        pool.user(username=email).admin_delete_user()
+        return email, attributes
+
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        results = list(executor.map(cycle, emails))
+
+    for email, attributes in results:
+        assert attributes['email'] == email
+        assert attributes['name'] == email.split('@')[0]
+    assert fake_idp.users == {}
+    assert fake_idp.calls['sign_up'] == len(emails)
+    assert fake_idp.created == ['cognito-idp']
+    assert pool.stats['clients_created'] == 1
@@ -0,0 +1,92 @@
+import os
+import sys
+
+import pytest
+
+service_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, service_dir)
+sys.path.insert(0, os.path.join(os.path.dirname(service_dir), 'tools'))
+
+from chalicelib.tokens import CognitoJWTException, JWTVerifier, load_snapshot  # noqa: E402
+from fakes import TokenIssuer, temp_jwks_file  # noqa: E402
+
+region = 'us-east-1'
+user_pool_id = 'us-east-1_test'
+client_id = 'test-client'
+email = 'usuario@sis247.test'
+
+
+@pytest.fixture(scope='module')
+def issuer():
+    return TokenIssuer(region, user_pool_id, client_id)
+
+
+@pytest.fixture
+def jwks_path(issuer, tmp_path):
+    return temp_jwks_file(issuer.jwks, str(tmp_path))
+
+
+def verifier_for(jwks_path, **kwargs):
+    return JWTVerifier(region, user_pool_id, jwks_path=jwks_path, client_id=client_id, **kwargs)
+
+
+def test_valid_token(issuer, jwks_path):
+    verifier = verifier_for(jwks_path)
+    claims = verifier.decode(issuer.issue(email))
+    assert claims['email'] == email
+    # La segunda verificación sale de la caché de claims sin volver a leer el JWKS
+    verifier.decode(issuer.issue(email, token_use='access'))
+    assert verifier.jwks_fetches == 1
+
+
+def test_expired_token(issuer, jwks_path):
+    with pytest.raises(CognitoJWTException, match='expired'):
+        verifier_for(jwks_path).decode(issuer.issue(email, ttl=-10))
+
+
+def test_wrong_issuer(issuer, jwks_path):
+    token = issuer.issue(email, iss='https://cognito-idp.us-east-1.amazonaws.com/us-east-1_otro')
+    with pytest.raises(CognitoJWTException, match='user pool'):
+        verifier_for(jwks_path).decode(token)
+
+
+@pytest.mark.parametrize('token_use, claim', [('id', 'aud'), ('access', 'client_id')])
+def test_wrong_audience(issuer, jwks_path, token_use, claim):
+    token = issuer.issue(email, token_use=token_use, **{claim: 'otro-cliente'})
+    with pytest.raises(CognitoJWTException, match='app client'):
+        verifier_for(jwks_path).decode(token)
+
+
+def test_tampered_signature(issuer, jwks_path):
+    other = TokenIssuer(region, user_pool_id, client_id)
+    with pytest.raises(CognitoJWTException, match='Signature'):
+        verifier_for(jwks_path).decode(other.issue(email))
+
+
+def test_unknown_kid_refreshes_snapshot(tmp_path):
+    # El snapshot empaquetado trae la llave anterior; el pool ya firma con una rotada
+    previous = TokenIssuer(region, user_pool_id, client_id, kid='anterior')
+    rotated = TokenIssuer(region, user_pool_id, client_id, kid='rotada')
+    path = temp_jwks_file(rotated.jwks, str(tmp_path))
+    verifier = verifier_for(path, snapshot=previous.jwks)
+
+    verifier.decode(previous.issue(email))
+    assert verifier.jwks_fetches == 0
+    verifier.decode(rotated.issue(email))
+    assert verifier.jwks_fetches == 1
+
+    # Un kid que tampoco está en el JWKS descargado no vuelve a descargarlo dentro del intervalo
+    unknown = TokenIssuer(region, user_pool_id, client_id, kid='desconocida')
+    with pytest.raises(CognitoJWTException, match='Public key'):
+        verifier.decode(unknown.issue(email))
+    assert verifier.jwks_fetches == 1
+
+
+def test_load_snapshot(issuer, jwks_path, tmp_path):
+    snapshot = load_snapshot(jwks_path)
+    assert snapshot == issuer.jwks
+    assert load_snapshot(str(tmp_path / 'no-existe.json')) is None
+
+    verifier = verifier_for(str(tmp_path / 'no-existe.json'), snapshot=snapshot)
+    assert verifier.decode(issuer.issue(email))['email'] == email
+    assert verifier.jwks_fetches == 0